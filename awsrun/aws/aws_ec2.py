@@ -1,9 +1,17 @@
 import datetime
+import json
 import logging
+import os
 import re
 import sys
+import threading
 import time
 from typing import Optional
+
+import requests
+
+from botocore.exceptions import ClientError
+
 from aws.aws_backend import AWSBackend
 from utils.Meta import Singleton
 from utils.constant import Const
@@ -11,8 +19,18 @@ from boto3_type_annotations.ec2 import Client, ServiceResource, Instance
 
 
 class VPCManager:
+    # services reached through interface endpoints; S3 always gets a gateway endpoint
+    INTERFACES = ('sqs',)
+    ENDPOINT_SG = "awsrun-endpoints"
+    # endpoint states that will not carry traffic again
+    ENDPOINT_GONE = ('Deleting', 'Deleted', 'Rejected', 'Failed', 'Expired')
+    # describe_<kind> result key, see list_resources
+    KINDS = {'vpcs': 'Vpcs', 'subnets': 'Subnets', 'internet_gateways': 'InternetGateways',
+             'route_tables': 'RouteTables', 'vpc_endpoints': 'VpcEndpoints', 'security_groups': 'SecurityGroups'}
+
     def __init__(self, region='us-west-1'):
         self._ec2cli: Client = AWSBackend().get_client(service='ec2', region=region)
+        self._region = region
         self.logger = logging.getLogger(VPCManager.__class__.__name__)
 
     def _name_it(self, resource_id, name):
@@ -37,10 +55,13 @@ class VPCManager:
         self.logger.info("Created vpc %s with cidr block  %s ", name, cidr_block)
         return vpc_id
 
-    def create_igw(self):
+    def create_igw(self, name=None):
         response = self._ec2cli.create_internet_gateway()
+        igw_id = response["InternetGateway"]["InternetGatewayId"]
+        if name:
+            self._name_it(igw_id, name)
         self.logger.info("created an internet gateway")
-        return response["InternetGateway"]["InternetGatewayId"]
+        return igw_id
 
     def attach_igw2vpc(self, igw_id, vpc_id):
         self.logger.info("Attaching IGW %s to VPC %s", igw_id, vpc_id)
@@ -49,20 +70,25 @@ class VPCManager:
             VpcId=vpc_id
         )
 
-    def create_subnet(self, name, vpc_id, cidr_block):
+    def create_subnet(self, name, vpc_id, cidr_block, zone=None):
+        placement = {"AvailabilityZone": zone} if zone else dict()
         response = self._ec2cli.create_subnet(
             VpcId=vpc_id,
-            CidrBlock=cidr_block
+            CidrBlock=cidr_block,
+            **placement
         )
         subnet_id = response["Subnet"]["SubnetId"]
         self._name_it(subnet_id, name)
         self.logger.info("Created a subnet for VPC %s with CIDR block %s", vpc_id, cidr_block)
         return subnet_id
 
-    def create_routing_table(self, vpc_id):
+    def create_routing_table(self, vpc_id, name=None):
         response = self._ec2cli.create_route_table(VpcId=vpc_id)
+        rtb_id = response["RouteTable"]["RouteTableId"]
+        if name:
+            self._name_it(rtb_id, name)
         self.logger.info("Created a routing table for VPC  %s", vpc_id)
-        return response["RouteTable"]["RouteTableId"]
+        return rtb_id
 
     def add_igw_route(self, rtb_id, igw_id, dest_cidr="0.0.0.0/0"):
         self.logger.info("adding route for igw %s to the route table %s", igw_id, rtb_id)
@@ -86,6 +112,152 @@ class VPCManager:
             MapPublicIpOnLaunch={"Value": True}
         )
 
+    def enable_dns(self, vpc_id):
+        # private DNS of interface endpoints needs both; one attribute per call
+        self._ec2cli.modify_vpc_attribute(VpcId=vpc_id, EnableDnsSupport={"Value": True})
+        self._ec2cli.modify_vpc_attribute(VpcId=vpc_id, EnableDnsHostnames={"Value": True})
+
+    def create_security_group(self, name, vpc_id, description, *permissions):
+        response = self._ec2cli.create_security_group(GroupName=name, VpcId=vpc_id, Description=description)
+        sg_id = response["GroupId"]
+        self._name_it(sg_id, name)
+        if permissions:
+            self._ec2cli.authorize_security_group_ingress(GroupId=sg_id, IpPermissions=list(permissions))
+        self.logger.info("Created security group %s in VPC %s", name, vpc_id)
+        return sg_id
+
+    def get_security_group_id(self, name, vpc_id):
+        _filter = [{'Name': 'group-name', 'Values': [name]}, {'Name': 'vpc-id', 'Values': [vpc_id]}]
+        groups = self._ec2cli.describe_security_groups(Filters=_filter)['SecurityGroups']
+        return groups[0]['GroupId'] if groups else None
+
+    def get_vpc_cidr(self, vpc_id):
+        return self._ec2cli.describe_vpcs(VpcIds=[vpc_id])['Vpcs'][0]['CidrBlock']
+
+    def get_subnets(self, vpc_id):
+        _filter = [{'Name': 'vpc-id', 'Values': [vpc_id]}]
+        return self._ec2cli.describe_subnets(Filters=_filter)['Subnets']
+
+    def get_route_table_ids(self, vpc_id):
+        _filter = [{'Name': 'vpc-id', 'Values': [vpc_id]}]
+        return [rtb['RouteTableId'] for rtb in self._ec2cli.describe_route_tables(Filters=_filter)['RouteTables']]
+
+    def service_name(self, service):
+        return "com.amazonaws.{0}.{1}".format(self._region, service)
+
+    def get_endpoints(self, vpc_id):
+        """{service name: endpoint} of the VPC's live endpoints."""
+        _filter = [{'Name': 'vpc-id', 'Values': [vpc_id]}]
+        endpoints = self._ec2cli.describe_vpc_endpoints(Filters=_filter)['VpcEndpoints']
+        return {e['ServiceName']: e for e in endpoints if e['State'] not in VPCManager.ENDPOINT_GONE}
+
+    def create_gateway_endpoint(self, vpc_id, service, rtb_ids):
+        """S3 and DynamoDB: routes to the service's prefix list are added to the route tables."""
+        response = self._ec2cli.create_vpc_endpoint(VpcEndpointType='Gateway', VpcId=vpc_id,
+                                                    ServiceName=self.service_name(service), RouteTableIds=rtb_ids)
+        endpoint_id = response['VpcEndpoint']['VpcEndpointId']
+        self.logger.info("Created %s gateway endpoint %s for route tables %s", service, endpoint_id, rtb_ids)
+        return endpoint_id
+
+    def create_interface_endpoint(self, vpc_id, service, subnet_ids, sg_id):
+        """With private DNS, the service's public name resolves to the endpoint inside the VPC."""
+        response = self._ec2cli.create_vpc_endpoint(VpcEndpointType='Interface', VpcId=vpc_id,
+                                                    ServiceName=self.service_name(service), SubnetIds=subnet_ids,
+                                                    SecurityGroupIds=[sg_id], PrivateDnsEnabled=True)
+        endpoint_id = response['VpcEndpoint']['VpcEndpointId']
+        self.logger.info("Created %s interface endpoint %s in subnets %s", service, endpoint_id, subnet_ids)
+        return endpoint_id
+
+    def create_endpoints(self, vpc_id):
+        """Keeps S3 and SQS traffic of the VPC off the internet gateway; returns {service: endpoint id}.
+
+        S3 gets a gateway endpoint on every route table of the VPC, the INTERFACES get an
+        interface endpoint in one subnet per zone, behind ENDPOINT_SG, which admits HTTPS
+        from the VPC's CIDR. Both keep the public service names, so S3Handler and
+        SqsHandler use them without any change. Existing endpoints are reused and route
+        tables added since are attached, so this can run again after the VPC grows. A VPC
+        without subnets only gets the S3 endpoint."""
+        existing = self.get_endpoints(vpc_id)
+        endpoints = dict()
+        rtb_ids = self.get_route_table_ids(vpc_id)
+        s3 = existing.get(self.service_name('s3'))
+        if s3 is None:
+            endpoints['s3'] = self.create_gateway_endpoint(vpc_id, 's3', rtb_ids)
+        else:
+            endpoints['s3'] = s3['VpcEndpointId']
+            missing = [rtb_id for rtb_id in rtb_ids if rtb_id not in s3.get('RouteTableIds', [])]
+            if missing:
+                self._ec2cli.modify_vpc_endpoint(VpcEndpointId=s3['VpcEndpointId'], AddRouteTableIds=missing)
+                self.logger.info("Routed %s through S3 endpoint %s", missing, s3['VpcEndpointId'])
+        interfaces = [service for service in VPCManager.INTERFACES if self.service_name(service) not in existing]
+        endpoints.update({service: existing[self.service_name(service)]['VpcEndpointId']
+                          for service in VPCManager.INTERFACES if service not in interfaces})
+        if not interfaces:
+            return endpoints
+        # an interface endpoint takes at most one subnet per availability zone
+        zones = dict()
+        for subnet in self.get_subnets(vpc_id):
+            zones.setdefault(subnet['AvailabilityZone'], subnet['SubnetId'])
+        if not zones:
+            self.logger.warning("VPC %s has no subnets, skipped the %s endpoints", vpc_id, ", ".join(interfaces))
+            return endpoints
+        self.enable_dns(vpc_id)
+        sg_id = self.get_security_group_id(VPCManager.ENDPOINT_SG, vpc_id)
+        if sg_id is None:
+            sg_id = self.create_security_group(VPCManager.ENDPOINT_SG, vpc_id, "awsrun VPC endpoints",
+                                               IPPermissions.https_access(self.get_vpc_cidr(vpc_id)))
+        for service in interfaces:
+            endpoints[service] = self.create_interface_endpoint(vpc_id, service, sorted(zones.values()), sg_id)
+        return endpoints
+
+    def delete_endpoints(self, endpoint_ids, timeout=600, poll_interval=5):
+        """Deletes the endpoints and waits until they are gone; interface endpoints hold
+        network interfaces in their subnets until then."""
+        self._ec2cli.delete_vpc_endpoints(VpcEndpointIds=endpoint_ids)
+        deadline = time.time() + timeout
+        _filter = [{'Name': 'vpc-endpoint-id', 'Values': endpoint_ids}]
+        while any(e['State'] != 'Deleted' for e in self.list_resources('vpc_endpoints', _filter)):
+            if time.time() > deadline:
+                raise RuntimeError("VPC endpoints {0} not deleted after {1} s".format(endpoint_ids, timeout))
+            time.sleep(poll_interval)
+        self.logger.info("Deleted VPC endpoints %s", endpoint_ids)
+
+    def delete_security_group(self, sg_id):
+        self._ec2cli.delete_security_group(GroupId=sg_id)
+        self.logger.info("Deleted security group %s", sg_id)
+
+    def delete_route_table(self, rtb_id, association_ids=()):
+        for association_id in association_ids:
+            self._ec2cli.disassociate_route_table(AssociationId=association_id)
+        self._ec2cli.delete_route_table(RouteTableId=rtb_id)
+        self.logger.info("Deleted route table %s", rtb_id)
+
+    def delete_subnet(self, subnet_id):
+        self._ec2cli.delete_subnet(SubnetId=subnet_id)
+        self.logger.info("Deleted subnet %s", subnet_id)
+
+    def delete_igw(self, igw_id, vpc_ids=()):
+        for vpc_id in vpc_ids:
+            self._ec2cli.detach_internet_gateway(InternetGatewayId=igw_id, VpcId=vpc_id)
+        self._ec2cli.delete_internet_gateway(InternetGatewayId=igw_id)
+        self.logger.info("Deleted internet gateway %s", igw_id)
+
+    def delete_vpc(self, vpc_id):
+        self._ec2cli.delete_vpc(VpcId=vpc_id)
+        self.logger.info("Deleted vpc %s", vpc_id)
+
+    def list_resources(self, kind, filters=None):
+        """Every item of one describe call, e.g. kind 'subnets' for describe_subnets."""
+        paginator = self._ec2cli.get_paginator('describe_' + kind)
+        return [item for page in paginator.paginate(Filters=filters or []) for item in page[VPCManager.KINDS[kind]]]
+
+    @staticmethod
+    def name_of(item):
+        for tag in item.get('Tags', []):
+            if tag['Key'] == 'Name':
+                return tag['Value']
+        return None
+
     def get_all_vpcs(self):
         return self._ec2cli.describe_vpcs()['Vpcs']
 
@@ -117,12 +289,28 @@ class IPPermissions:
             "IpRanges": [{"CidrIp": "0.0.0.0/0"}]
         };
 
+    @staticmethod
+    def https_access(cidr="0.0.0.0/0"):
+        return {
+            "IpProtocol": "tcp",
+            "FromPort": 443,
+            "ToPort": 443,
+            "IpRanges": [{"CidrIp": cidr}]
+        };
+
 
 class InstanceType:
-    def __init__(self, name, cpu, ram_gb):
+    # families that run on CPU credits and slow down once they are spent
+    BURSTABLE = ('t1', 't2', 't3', 't3a', 't4g')
+
+    def __init__(self, name, cpu, ram_gb, zone=None, cores=None):
         self._name = name
         self._cpu = cpu
         self.ram_gb = ram_gb
+        # physical cores (VCpuInfo.DefaultCores), None for types EC2 wasn't asked about
+        self.cores = cores
+        # availability zone the prices are from, None for region-wide figures
+        self.zone = zone
         self.prices = []
         self.avg_price = 0.0
         self.max_price = 0.0
@@ -148,23 +336,36 @@ class InstanceType:
         else:
             self.metric_cost = self.avg_price / self._cpu
 
-    def calculate_ratio(self, ratio):
+    def containers(self, ratio):
+        """How many jobs of `cpu:ram` (cores, GB) fit on the type."""
+        cpu, ram = ratio.split(':')
+        return min((self._cpu / int(cpu)), (self.ram_gb / int(ram)))
+
+    def calculate_ratio(self, ratio, speed=1.0):
+        """Price per job slot; `speed` is the type's per-core throughput relative to the
+        others (see fleet.benchmark.BenchTable), a faster core finishing more jobs per hour."""
         if self.avg_price <= 0:
             return
         else:
-            cpu, ram = ratio.split(':')
-            num_of_cont = min((self._cpu / int(cpu)), (self.ram_gb / int(ram)))
-            if num_of_cont > 0:
-                self.metric_cost = self.avg_price / num_of_cont
+            num_of_cont = self.containers(ratio)
+            if num_of_cont > 0 and speed > 0:
+                self.metric_cost = self.avg_price / (num_of_cont * speed)
 
     def to_json(self):
-        return {"name": self._name, "cpu": self._cpu, "ram": self.ram_gb,
+        data = {"name": self._name, "cpu": self._cpu, "ram": self.ram_gb,
                 "avg_price": self.avg_price, "max_price": self.max_price}
+        if self.zone:
+            data["zone"] = self.zone
+        return data
 
     @property
     def name(self):
         return self._name
 
+    @property
+    def burstable(self):
+        return self._name.split('.')[0] in InstanceType.BURSTABLE
+
     @property
     def ram(self):
         return self.ram_gb
@@ -203,6 +404,145 @@ class EC2InstTypes:
     def x2large():
         return InstanceType("t3.2xlarge", 8, 32)
 
+    @staticmethod
+    def all():
+        return [EC2InstTypes.nano(), EC2InstTypes.micro(), EC2InstTypes.small(), EC2InstTypes.medium(),
+                EC2InstTypes.large(), EC2InstTypes.xlarge(), EC2InstTypes.x2large()]
+
+    @staticmethod
+    def by_name(name):
+        for instance_type in EC2InstTypes.all():
+            if instance_type.name == name:
+                return instance_type
+        raise KeyError('Unknown instance type "' + name + '"')
+
+
+class LaunchProfile:
+    """How workers are placed on the hardware, chosen per queue.
+
+    `throughput` takes whatever capacity is there. `timing` is for performance-graded
+    work: only non-burstable types, one thread on each of the type's cores so no job
+    shares a core with another, and a cluster placement group so the workers run on the
+    same kind of hardware close together. `dedicated` adds single-tenant hardware on
+    top, at a price."""
+    TAG = "awsrun:profile"
+
+    def __init__(self, name, placement_group=None, strategy='cluster', threads_per_core=None, tenancy=None,
+                 burstable=True):
+        self.name = name
+        self.placement_group = placement_group
+        self.strategy = strategy
+        self.threads_per_core = threads_per_core
+        # None inherits the VPC's tenancy, see VPCManager.set_dedicated
+        self.tenancy = tenancy
+        self.burstable = burstable
+
+    def allows(self, instance_type: InstanceType):
+        return self.burstable or not instance_type.burstable
+
+    def request(self, instance_type: InstanceType):
+        """The create_instances arguments of the profile for `instance_type`."""
+        if not self.allows(instance_type):
+            raise ValueError('Profile "{0}" does not launch burstable {1}'.format(self.name, instance_type.name))
+        request = dict()
+        placement = dict()
+        if self.placement_group:
+            placement['GroupName'] = self.placement_group
+        if self.tenancy:
+            placement['Tenancy'] = self.tenancy
+        if placement:
+            request['Placement'] = placement
+        if self.threads_per_core:
+            if instance_type.cores is None:
+                raise ValueError('Profile "{0}" needs the core count of {1}; look it up with '
+                                 'SpotMarket.instance_types'.format(self.name, instance_type.name))
+            request['CpuOptions'] = {'CoreCount': instance_type.cores, 'ThreadsPerCore': self.threads_per_core}
+        return request
+
+
+class LaunchProfiles:
+    @staticmethod
+    def throughput():
+        return LaunchProfile("throughput")
+
+    @staticmethod
+    def timing():
+        return LaunchProfile("timing", placement_group="awsrun-timing", threads_per_core=1, burstable=False)
+
+    @staticmethod
+    def dedicated():
+        return LaunchProfile("dedicated", placement_group="awsrun-dedicated", threads_per_core=1,
+                             tenancy='dedicated', burstable=False)
+
+    @staticmethod
+    def all():
+        return [LaunchProfiles.throughput(), LaunchProfiles.timing(), LaunchProfiles.dedicated()]
+
+    @staticmethod
+    def by_name(name):
+        for profile in LaunchProfiles.all():
+            if profile.name == name:
+                return profile
+        raise KeyError('Unknown launch profile "' + name + '"')
+
+
+class SpotMarket:
+    """Spot price history of instance types, one InstanceType per type and availability zone."""
+    PRODUCT = 'Linux/UNIX'
+
+    def __init__(self, region='us-west-1'):
+        self._ec2cli: Client = AWSBackend().get_client(service='ec2', region=region)
+        self._logger = logging.getLogger(SpotMarket.__name__)
+
+    def instance_types(self, names):
+        """InstanceTypes with the vCPUs and memory EC2 reports for them."""
+        types = []
+        paginator = self._ec2cli.get_paginator('describe_instance_types')
+        for page in paginator.paginate(InstanceTypes=names):
+            for info in page['InstanceTypes']:
+                types.append(InstanceType(info['InstanceType'], info['VCpuInfo']['DefaultVCpus'],
+                                          info['MemoryInfo']['SizeInMiB'] / 1024,
+                                          cores=info['VCpuInfo'].get('DefaultCores')))
+        return types
+
+    def zones(self, subnet_ids):
+        """{availability zone: subnet id}; launching into a zone needs a subnet there."""
+        subnets = self._ec2cli.describe_subnets(SubnetIds=subnet_ids)['Subnets']
+        return {subnet['AvailabilityZone']: subnet['SubnetId'] for subnet in subnets}
+
+    def prices(self, types, zones=None, hours=24):
+        """{(type name, zone): InstanceType} with the prices of the last `hours` and their average."""
+        specs = {t.name: t for t in types}
+        book = dict()
+        start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=hours)
+        paginator = self._ec2cli.get_paginator('describe_spot_price_history')
+        for page in paginator.paginate(InstanceTypes=list(specs), ProductDescriptions=[SpotMarket.PRODUCT],
+                                       StartTime=start):
+            for entry in page['SpotPriceHistory']:
+                zone = entry['AvailabilityZone']
+                if zones is not None and zone not in zones:
+                    continue
+                spec = specs[entry['InstanceType']]
+                key = (spec.name, zone)
+                if key not in book:
+                    book[key] = InstanceType(spec.name, spec.cpu, spec.ram, zone, spec.cores)
+                book[key].add_price(float(entry['SpotPrice']))
+        for instance_type in book.values():
+            instance_type.calc_avg()
+        self._logger.info("Spot prices of %s types in %s zones", len(specs), len({z for _, z in book}))
+        return book
+
+    @staticmethod
+    def cheapest(book, ratio, speeds=None):
+        """The InstanceType (with its zone) running a `cpu:ram` job for the least, None if none fits one.
+
+        `speeds` maps type names to relative per-core throughput; types without one count as 1.0."""
+        speeds = speeds or dict()
+        fitting = [t for t in book.values() if t.containers(ratio) >= 1]
+        for instance_type in fitting:
+            instance_type.calculate_ratio(ratio, speeds.get(instance_type.name, 1.0))
+        return min(fitting, key=lambda t: t.metric_cost, default=None)
+
 
 class InstanceState(Const):
     PENDING = [0, 'pending']
@@ -221,16 +561,99 @@ class InstanceState(Const):
         return state[1]
 
 
+class FleetSnapshot:
+    """State and status checks of the instances of one sweep, see EC2InstanceUtility.snapshot."""
+
+    def __init__(self, statuses, taken):
+        # instance id -> InstanceStatuses entry
+        self._statuses = statuses
+        self.taken = taken
+
+    @property
+    def age(self):
+        return time.time() - self.taken
+
+    def __contains__(self, inst_id):
+        return inst_id in self._statuses
+
+    def state(self, inst_id, default=None):
+        entry = self._statuses.get(inst_id)
+        return entry['InstanceState']['Name'] if entry else default
+
+    def check(self, inst_id):
+        """Instance status check ('passed', 'initializing', 'failed', ...), None while not reported."""
+        entry = self._statuses.get(inst_id)
+        if not entry or not entry.get('InstanceStatus', {}).get('Details'):
+            return None
+        return entry['InstanceStatus']['Details'][0]['Status']
+
+    def system_check(self, inst_id):
+        entry = self._statuses.get(inst_id)
+        if not entry or not entry.get('SystemStatus', {}).get('Details'):
+            return None
+        return entry['SystemStatus']['Details'][0]['Status']
+
+    def ids(self, state=None):
+        return [inst_id for inst_id, entry in self._statuses.items()
+                if state is None or entry['InstanceState']['Name'] == state]
+
+
 class EC2InstanceUtility:
-    def __init__(self, region='us-west-1'):
+    """Instance queries answered from a FleetSnapshot at most `ttl` seconds old.
+
+    A sweep covers the instances tagged `type_tag`, or the whole region without one, in a
+    few paginated calls however many instances are asked about; refresh_instances()
+    forces the next query to sweep again."""
+    METADATA = "http://169.254.169.254/latest"
+    # describe_instance_status takes at most this many instance ids
+    STATUS_IDS = 100
+
+    def __init__(self, region='us-west-1', ttl=5.0, type_tag=None):
         self._ec2res: ServiceResource = AWSBackend().get_resource(service='ec2', region=region)
         self._ec2cli: Client = AWSBackend().get_client(service='ec2', region=region)
+        self._ttl = ttl
+        self._type_tag = type_tag
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger(EC2InstanceUtility.__name__)
+
+    def snapshot(self, refresh=False) -> FleetSnapshot:
+        with self._lock:
+            if refresh or self._snapshot is None or self._snapshot.age > self._ttl:
+                statuses = self._sweep() if self._type_tag is None else self._sweep_tagged()
+                self._snapshot = FleetSnapshot(statuses, time.time())
+                self._logger.debug("Fleet snapshot of %s instances", len(statuses))
+            return self._snapshot
+
+    def _sweep(self):
+        statuses = dict()
+        paginator = self._ec2cli.get_paginator('describe_instance_status')
+        for page in paginator.paginate(IncludeAllInstances=True, PaginationConfig={'PageSize': 1000}):
+            for entry in page['InstanceStatuses']:
+                statuses[entry['InstanceId']] = entry
+        return statuses
+
+    def _sweep_tagged(self):
+        # states of the tagged instances, then the status checks of those that have any
+        statuses = dict()
+        _filter = [{'Name': 'tag:' + self._type_tag[0], 'Values': [self._type_tag[1]]}]
+        for page in self._ec2cli.get_paginator('describe_instances').paginate(Filters=_filter):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    statuses[instance['InstanceId']] = {'InstanceId': instance['InstanceId'],
+                                                        'InstanceState': instance['State']}
+        gone = (InstanceState.status(InstanceState.SHUTTING), InstanceState.status(InstanceState.TERMINATED))
+        live = [inst_id for inst_id, entry in statuses.items() if entry['InstanceState']['Name'] not in gone]
+        for i in range(0, len(live), EC2InstanceUtility.STATUS_IDS):
+            response = self._ec2cli.describe_instance_status(
+                InstanceIds=live[i:i + EC2InstanceUtility.STATUS_IDS], IncludeAllInstances=True)
+            for entry in response['InstanceStatuses']:
+                statuses[entry['InstanceId']] = entry
+        return statuses
 
     def _get_instance_state(self, inst_id):
-        for instance in self._ec2res.instances.all():
-            if instance.id == inst_id:
-                return instance.state['Name']
-        return InstanceState.status(InstanceState.PENDING)
+        # instances launched after the last sweep show up in the next one
+        return self.snapshot().state(inst_id, InstanceState.status(InstanceState.PENDING))
 
     def get_instance_statuses(self, inst_ids, max_retry=1):
         response = self._ec2cli.describe_instance_status(
@@ -250,24 +673,27 @@ class EC2InstanceUtility:
         return list(self._ec2res.instances.filter(InstanceIds=ids))
 
     # running vs stopped
-    def get_instance_status(self, inst_id, max_retry=5, default=None):
-        instances = self.get_instance_statuses([inst_id], max_retry=max_retry)
-        if not instances:
-            if default:
-                return default
-            else:
-                return self._get_instance_state(inst_id)
-        else:
-            return instances[0]['InstanceState']['Name']
-
-    def get_instance_state(self, instance_id, max_retry=5):
-        instances = self.get_instance_statuses([instance_id], max_retry=max_retry)
-        if instances:
-            for instance in instances:
-                if instance['InstanceId'] == instance_id:
-                    return instance['InstanceStatus']['Details'][0]['Status']
-        else:
-            return 'Initializing'
+    def get_instance_status(self, inst_id, default=None):
+        snapshot = self.snapshot()
+        if inst_id not in snapshot and default:
+            return default
+        return self._get_instance_state(inst_id)
+
+    def get_instance_state(self, instance_id):
+        check = self.snapshot().check(instance_id)
+        return check if check else 'Initializing'
+
+    @staticmethod
+    def local_instance_id(timeout=1):
+        """Id of the instance this code runs on (IMDSv2), or None when not on EC2."""
+        try:
+            token = requests.put(EC2InstanceUtility.METADATA + "/api/token", timeout=timeout,
+                                 headers={"X-aws-ec2-metadata-token-ttl-seconds": "60"}).text
+            response = requests.get(EC2InstanceUtility.METADATA + "/meta-data/instance-id", timeout=timeout,
+                                    headers={"X-aws-ec2-metadata-token": token})
+        except requests.RequestException:
+            return None
+        return response.text if response.ok else None
 
     @staticmethod
     def get_tag_value(instance, key):
@@ -289,8 +715,8 @@ class EC2InstanceUtility:
             lambda i: False if i.tags is None else any(
                 map(lambda t: t['Key'] == tag[0] and t['Value'] == tag[1], i.tags)), instances)
 
-    def refresh_instances(self, instances):
-        self.get_instance_statuses(list(map(lambda i: i.id, instances)))
+    def refresh_instances(self):
+        self.snapshot(refresh=True)
 
     def _status_check(self, instance, status):
         return self.get_instance_status(instance.id) == status
@@ -327,26 +753,10 @@ class EC2InstanceUtility:
             inst.stop()
 
     @staticmethod
-    def terminate_instances(self,instances):
+    def terminate_instances(instances):
         for inst in instances:
             inst.terminate()
 
-    @staticmethod
-    def wait_for_state(state_cb, instances, max_retry=5, interval=12, success_msg=None):
-        if success_msg is None:
-            success_msg = "Instances are ready as you like"
-        retries = max_retry
-        while retries > 0:
-            if state_cb(instances):
-                print(success_msg)
-                return True
-            retries -= 1
-            print("Waiting for desired state... (retries remaining: {})".format(retries))
-            time.sleep(interval)
-
-        print("Retries exceeded. Proceeding anyway.")
-        return False
-
     def check_expired(self,instance, tag_datetime, max_time):
         if self.is_terminated(instance):
             return False
@@ -364,16 +774,85 @@ class EC2InstanceUtility:
         return uptime > max_time
 
 
+class AMIIndex:
+    """Latest image per AMI name template and region, persisted so launches skip describe_images.
+
+    Entries older than `ttl` seconds are looked up again; baking an image records it
+    right away."""
+    DEFAULT = os.path.join(os.path.expanduser("~"), ".awsrun", "amis.json")
+
+    def __init__(self, path=DEFAULT, ttl=600):
+        self._path = path
+        self._ttl = ttl
+
+    @staticmethod
+    def _key(region, template_name):
+        return region + "/" + template_name
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return dict()
+
+    def get(self, region, template_name):
+        """(image, version) like EC2Launcher.get_ami, or None when unknown or stale."""
+        entry = self._load().get(AMIIndex._key(region, template_name))
+        if entry is None or time.time() - entry["time"] > self._ttl:
+            return None
+        return {'ImageId': entry["image_id"], 'Name': entry["name"]}, entry["version"]
+
+    def put(self, region, template_name, image, version):
+        entries = self._load()
+        entries[AMIIndex._key(region, template_name)] = {"image_id": image['ImageId'], "name": image['Name'],
+                                                         "version": version, "time": time.time()}
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        # concurrent launches on this machine read either the old or the new index
+        with open(self._path + ".tmp", "w") as f:
+            json.dump(entries, f, indent=2)
+        os.replace(self._path + ".tmp", self._path)
+
+
 class EC2Launcher:
-    def __init__(self, type_tag, region='us-west-1'):
+    # create_instances errors after which a spot launch is retried on demand
+    SPOT_UNAVAILABLE = ('InsufficientInstanceCapacity', 'SpotMaxPriceTooLow', 'MaxSpotInstanceCountExceeded',
+                        'UnfulfillableCapacity')
+
+    def __init__(self, type_tag, region='us-west-1', index: AMIIndex = None):
         self._ec2res: ServiceResource = AWSBackend().get_resource(service='ec2', region=region)
         self._ec2cli: Client = AWSBackend().get_client(service='ec2', region=region)
-        self._ec2helper = EC2InstanceUtility(region)
+        self._ec2helper = EC2InstanceUtility(region, type_tag=type_tag)
         self._type_tag = type_tag
+        self._region = region
+        self._index = index if index else AMIIndex()
+        # placement groups known to exist
+        self._groups = set()
         self._logger = logging.getLogger(EC2Launcher.__class__.__name__)
 
-    def launch_instance(self, key_name, sg_id, subnet_id, img_id, instance_type: InstanceType, num_inst, userdata=''):
-        instances = self._ec2res.create_instances(
+    def placement_group(self, name, strategy='cluster'):
+        """Creates the placement group unless it exists."""
+        if name in self._groups:
+            return name
+        try:
+            self._ec2cli.create_placement_group(GroupName=name, Strategy=strategy)
+            self._logger.info("Created %s placement group %s", strategy, name)
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'InvalidPlacementGroup.Duplicate':
+                raise
+        self._groups.add(name)
+        return name
+
+    def launch_instance(self, key_name, sg_id, subnet_id, img_id, instance_type: InstanceType, num_inst, userdata='',
+                        spot=False, max_price=None, profile: LaunchProfile = None):
+        """With `spot`, launches one-time spot instances (they cannot be stopped, only terminated)
+        and falls back to on-demand when EC2 has no spot capacity at the price. A `profile`
+        adds its placement group, tenancy and CPU options, and raises ValueError for a
+        type it does not allow."""
+        placement = profile.request(instance_type) if profile else dict()
+        if profile and profile.placement_group:
+            self.placement_group(profile.placement_group, profile.strategy)
+        request = dict(
             ImageId=img_id,
             MinCount=num_inst,
             MaxCount=num_inst,
@@ -381,17 +860,35 @@ class EC2Launcher:
             SecurityGroupIds=[sg_id],
             SubnetId=subnet_id,
             KeyName=key_name,
-            UserData=userdata
+            UserData=userdata,
+            **placement
         )
+        instances = None
+        if spot:
+            options = {'SpotInstanceType': 'one-time', 'InstanceInterruptionBehavior': 'terminate'}
+            if max_price:
+                options['MaxPrice'] = str(max_price)
+            try:
+                instances = self._ec2res.create_instances(
+                    InstanceMarketOptions={'MarketType': 'spot', 'SpotOptions': options}, **request)
+            except ClientError as error:
+                if error.response['Error']['Code'] not in EC2Launcher.SPOT_UNAVAILABLE:
+                    raise
+                self._logger.warning("No spot capacity for %s in %s (%s), launching on demand",
+                                     instance_type.name, subnet_id, error.response['Error']['Code'])
+        if instances is None:
+            instances = self._ec2res.create_instances(**request)
 
         # tag the instances
+        tags = [self._type_tag] + ([(LaunchProfile.TAG, profile.name)] if profile else [])
         for inst in instances:
-            self.tag_instance(inst.id, self._type_tag)
+            self.tag_instance(inst.id, *tags)
 
         return instances
 
-    def get_ami(self, template_name):
-        images = self._ec2cli.describe_images(Owners=['self'])['Images']
+    @staticmethod
+    def latest_image(images, template_name):
+        """(image, version) of the highest `<template>.<version>` image in a describe_images listing."""
         chosen_image = (None, -1)
         for image in images:
             if re.match(template_name, image['Name']):
@@ -404,11 +901,52 @@ class EC2Launcher:
         else:
             return chosen_image
 
+    def get_ami(self, template_name, refresh=False):
+        cached = None if refresh else self._index.get(self._region, template_name)
+        if cached:
+            return cached
+        # images still being created are not launchable yet
+        images = self._ec2cli.describe_images(Owners=['self'],
+                                              Filters=[{'Name': 'state', 'Values': ['available']}])['Images']
+        chosen_image = EC2Launcher.latest_image(images, template_name)
+        self._index.put(self._region, template_name, *chosen_image)
+        return chosen_image
+
+    def next_version(self, template_name):
+        """Version number for a new image of the template, one past every existing image."""
+        images = self._ec2cli.describe_images(Owners=['self'])['Images']
+        try:
+            return EC2Launcher.latest_image(images, template_name)[1] + 1
+        except KeyError:
+            return 1
+
+    def create_image(self, inst_id, name, *tags: tuple):
+        response = self._ec2cli.create_image(
+            InstanceId=inst_id,
+            Name=name,
+            TagSpecifications=[{'ResourceType': 'image',
+                                'Tags': [{'Key': tup[0], 'Value': tup[1]} for tup in tags]}]
+        )
+        self._logger.info("Creating image %s from %s", name, inst_id)
+        return response['ImageId']
+
+    def wait_for_image(self, image_id, template_name, version, timeout=3600):
+        self._ec2cli.get_waiter('image_available').wait(
+            ImageIds=[image_id],
+            WaiterConfig={'Delay': 15, 'MaxAttempts': max(1, timeout // 15)}
+        )
+        image = self._ec2cli.describe_images(ImageIds=[image_id])['Images'][0]
+        self._index.put(self._region, template_name, image, version)
+        return image
+
     def tag_instance(self, inst_id, *tags: tuple):
         assert all(map(lambda t: len(t) == 2, tags)), "all pairs should key/value pairs"
         self._ec2res.create_tags(Resources=[inst_id],
                                  Tags=[{'Key': tup[0], 'Value': tup[1]} for tup in tags])
 
+    def untag_instance(self, inst_id, *keys):
+        self._ec2cli.delete_tags(Resources=[inst_id], Tags=[{'Key': key} for key in keys])
+
     def get_instances(self, inst_ids):
         return list(self._ec2res.instances.filter(InstanceIds=inst_ids))
 
@@ -426,14 +964,15 @@ class EC2Launcher:
         )
 
     def all_instances(self):
-        all_instances = list(self._ec2res.instances.all())
-        return EC2InstanceUtility.filter_instances_by_tag(self._type_tag, all_instances)
+        # filtered and paginated by EC2, not client-side over every instance of the account
+        return list(self._ec2res.instances.filter(
+            Filters=[{'Name': 'tag:' + self._type_tag[0], 'Values': [self._type_tag[1]]}]))
 
     def terminate_instances(self):
         return EC2InstanceUtility.terminate_instances(self.all_instances())
 
     def refresh_instances(self):
-        return self._ec2helper.refresh_instances(self.all_instances())
+        return self._ec2helper.refresh_instances()
 
     def get_running_instances(self):
         return self._ec2helper.get_running(self.all_instances())
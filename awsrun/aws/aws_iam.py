@@ -154,6 +154,13 @@ class IAMHandler:
         return self._client.create_instance_profile(InstanceProfileName=profile_name,
                                                     Path=path)
 
+    def delete_instance_profile(self, profile_name):
+        self._client.delete_instance_profile(InstanceProfileName=profile_name)
+
+    def remove_role_from_instance_profile(self, profile_name, role_name):
+        self._client.remove_role_from_instance_profile(InstanceProfileName=profile_name,
+                                                       RoleName=role_name)
+
     #######################################################################################
     # POLICY BASED FUNCTIONALITY
     #######################################################################################
@@ -228,6 +235,27 @@ class IAMHandler:
         except self._client.exceptions.NoSuchEntityException as e:
             return None
 
+    def list_roles(self):
+        return [role for page in self._client.get_paginator('list_roles').paginate() for role in page['Roles']]
+
+    def list_attached_role_policies(self, role_name):
+        paginator = self._client.get_paginator('list_attached_role_policies')
+        return [policy['PolicyArn'] for page in paginator.paginate(RoleName=role_name)
+                for policy in page['AttachedPolicies']]
+
+    def detach_policy_from_role(self, policy_arn, role_name):
+        return self._client.detach_role_policy(RoleName=role_name, PolicyArn=policy_arn)
+
+    def put_role_policy(self, role_name, policy_name, policy_doc):
+        return self._client.put_role_policy(RoleName=role_name, PolicyName=policy_name,
+                                            PolicyDocument=json.dumps(policy_doc))
+
+    def delete_role_policy(self, role_name, policy_name):
+        return self._client.delete_role_policy(RoleName=role_name, PolicyName=policy_name)
+
+    def delete_role(self, role_name):
+        return self._client.delete_role(RoleName=role_name)
+
     def role_for_instance_profile(self, profile_name, role_name):
         self._client.add_role_to_instance_profile(InstanceProfileName=profile_name,
                                                   RoleName=role_name)
@@ -215,6 +215,33 @@ class S3Handler:
 
         return tcb.thread_info
 
+    def object_exists(self, bucket_name, object_key):
+        try:
+            self.s3.meta.client.head_object(Bucket=bucket_name, Key=object_key)
+            exists = True
+        except ClientError:
+            exists = False
+        return exists
+
+    def object_etag(self, bucket_name, object_key):
+        try:
+            response = self.s3.meta.client.head_object(Bucket=bucket_name, Key=object_key)
+        except ClientError:
+            self.logger.exception("Couldn't get object %s from bucket '%s'.", object_key, bucket_name)
+            raise
+        else:
+            return response['ETag'].strip('"')
+
+    def list_objects(self, bucket_name, prefix=""):
+        try:
+            objects = list(self.s3.Bucket(bucket_name).objects.filter(Prefix=prefix))
+            self.logger.info("Got %s objects under %s/%s.", len(objects), bucket_name, prefix)
+        except ClientError:
+            self.logger.exception("Couldn't list objects under %s in bucket '%s'.", prefix, bucket_name)
+            raise
+        else:
+            return [{"key": o.key, "size": o.size, "last_modified": o.last_modified} for o in objects]
+
     def download_file(self, bucket_name, object_key, target_path,
                       file_size_mb=None, sse_key=None):
         s3 = self.s3
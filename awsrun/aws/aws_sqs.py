@@ -173,10 +173,44 @@ class SqsHandler:
         else:
             return response
 
+    def change_message_visibility(self, message, visibility_timeout):
+        try:
+            message.change_visibility(VisibilityTimeout=visibility_timeout)
+            self.logger.info("Changed visibility of %s to %s", message.message_id, visibility_timeout)
+        except ClientError as error:
+            self.logger.exception("Couldn't change visibility of message: %s", message.message_id)
+            raise error
+
+    def change_message_visibility_batch(self, queue, messages, visibility_timeout):
+        try:
+            entries = [{
+                'Id': str(ind),
+                'ReceiptHandle': msg.receipt_handle,
+                'VisibilityTimeout': visibility_timeout
+            } for ind, msg in enumerate(messages)]
+            response = queue.change_message_visibility_batch(Entries=entries)
+            if 'Failed' in response:
+                for msg_meta in response['Failed']:
+                    self.logger.warning(
+                        "Could not change visibility of %s",
+                        messages[int(msg_meta['Id'])].receipt_handle
+                    )
+        except ClientError:
+            self.logger.exception("Couldn't change message visibility on queue %s", queue)
+        else:
+            return response
+
     @staticmethod
     def get_message_cnt(queue: Queue):
         return int(queue.attributes['ApproximateNumberOfMessages'])
 
+    @staticmethod
+    def get_queue_depth(queue: Queue):
+        """(visible, in flight) approximate message counts, freshly read from SQS."""
+        queue.reload()
+        return (int(queue.attributes['ApproximateNumberOfMessages']),
+                int(queue.attributes['ApproximateNumberOfMessagesNotVisible']))
+
     @staticmethod
     def apply_queue_policy(queue, policy):
         queue.set_attributes(Attributes={
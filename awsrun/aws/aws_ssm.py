@@ -15,7 +15,8 @@ class SSMHandler:
         return response['Commands']
 
     def instance_information(self):
-        return self._ssm_client.describe_instance_information()['InstanceInformationList']
+        paginator = self._ssm_client.get_paginator('describe_instance_information')
+        return [info for page in paginator.paginate() for info in page['InstanceInformationList']]
 
     def session_output(self, cmd_id, inst_id):
         """Checks the status of a command on an instance
@@ -53,6 +54,11 @@ class SSMHandler:
         except self._ssm_client.exceptions.InvocationDoesNotExist:
             return "Failed"
 
+    def invocation_status(self, cmd_id, inst_id):
+        """Status of a command on an instance, None while SSM doesn't know the invocation (yet)."""
+        result = self.session_output(cmd_id, inst_id)
+        return result['Status'] if result else None
+
     def run_cmd_on_inst(self, cmd_list, inst_id):
         """ commands = [
              'echo "hello world" > /home/ec2-user/hello.txt',  # demo comma is important!
@@ -21,10 +21,11 @@ class Compress(Command):
     def is_tar(filename):
         return filename.endswith(".tar")
 
-    def __init__(self, tarfile: File, *required: OSPath):
+    def __init__(self, tarfile: File, *required: OSPath, root: Folder = None):
         if self.is_tar(tarfile.path):
             self._tarfile = tarfile
             self._required = required
+            self._root = root
         else:
             raise RuntimeError("Not a tarfile!!!")
 
@@ -33,7 +34,11 @@ class Compress(Command):
             tarball.dereference = True
             for path in map(lambda c: c.path, self._required):
                 try:
-                    tarball.add(path)
+                    if self._root is None:
+                        tarball.add(path)
+                    else:
+                        # members are named relative to root
+                        tarball.add(os.path.join(self._root.path, path), arcname=path)
                 except FileNotFoundError:
                     pass  # ignore since all cli args are treated as file paths
         return self._tarfile
@@ -10,6 +10,7 @@ import objectfactory
 
 from aws import S3Handler, SqsHandler, subscribe, list_subscriptions, get_topic, create_or_get_topic, delete_topic, \
     create_topic, AWSBackend
+from common.provision import BucketResource, Inventory, Plan, QueueResource, TopicResource
 from common.resources import Folder, S3Path, OSPath, Path
 
 
@@ -53,6 +54,11 @@ class InfraComponent(ABC):
     def report(self, tag):
         return {tag: (self._name,)}
 
+    @abstractmethod
+    def resource(self):
+        """The component as a node of a provisioning Plan."""
+        pass
+
     @property
     def name(self):
         return self._name
@@ -98,6 +104,9 @@ class S3Component(InfraComponent):
     def get_arn(self):
         return S3Handler.get_bucket_arn(self.name)
 
+    def resource(self):
+        return BucketResource(self.name)
+
     def _handler(self):
         return S3Handler(self._server)
 
@@ -122,6 +131,9 @@ class QueueComponent(InfraComponent):
     def get_arn(self):
         return self.component.attributes["QueueArn"]
 
+    def resource(self):
+        return QueueResource(self._name)
+
     def _handler(self):
         return SqsHandler(self._server)
 
@@ -174,6 +186,9 @@ class SubscriptionComponent(InfraComponent):
     def report(self, tag):
         return {tag: (self._name, self._domains)}
 
+    def resource(self):
+        return TopicResource(self._name)
+
     def _handler(self):
         return self._sub_handler
 
@@ -197,14 +212,26 @@ class AWSInfra(InfraComponent):
     def build(self, **kwargs):
         # infra build!!!!
         self._load(**kwargs)
-        component_tags = list(map(lambda t: t.value, AWSTags))
-        aws_data = dict(filter(lambda i: not (i[0] in component_tags), kwargs.items()))
-        for component in self._children.values():
-            component.build(**aws_data)
+        return self.plan().apply()
 
     def destroy(self):
-        for component in self._children.values():
-            component.destroy()
+        return self.plan(destroy=True).apply()
+
+    def resource(self):
+        """The composite has no node of its own: those of its components."""
+        return self.resources()
+
+    def resources(self, *extra):
+        """Provisioning nodes of the components, plus `extra` ones such as a Network's."""
+        return [component.resource() for component in self._children.values()] + list(extra)
+
+    def plan(self, *extra, destroy=False, workers=8):
+        """The Plan that builds (or destroys) the components and `extra` resources, from
+        what exists now; see common.provision."""
+        inventory = Inventory(self.path)
+        if destroy:
+            return Plan.destroy(inventory, self.resources(*extra), workers)
+        return Plan.build(inventory, self.resources(*extra), workers)
 
     def __init__(self, server_path, name="InfraStructure"):
         super().__init__(server_path, name)
@@ -333,6 +360,72 @@ class WSConfig(objectfactory.Serializable):
         return prefix + "_" + timestamp + "_" + str(uuid.uuid4())
 
 
+class DatasetRef:
+    """A registered dataset version: `name@version`, stored as one tarball under PREFIX in the bucket."""
+    PREFIX = "datasets"
+
+    def __init__(self, name, version):
+        self.name = name
+        self.version = version
+
+    @staticmethod
+    def parse(ref: str):
+        name, _, version = ref.partition("@")
+        return DatasetRef(name, version if version else None)
+
+    @property
+    def key(self):
+        return "/".join([DatasetRef.PREFIX, self.name, self.version + ".tar"])
+
+    @property
+    def mount(self):
+        # where the command finds the dataset, relative to its working directory
+        return os.path.join(DatasetRef.PREFIX, self.name)
+
+    def __str__(self):
+        return "{0}@{1}".format(self.name, self.version) if self.version else self.name
+
+
+class WorkerStatus:
+    """What a worker last said about itself, stored as one JSON object per worker under PREFIX.
+
+    `held` counts the messages the worker owns (running, staged or being fetched), `tasks`
+    lists [seconds, cores] of its most recently finished tasks and `time` is when it wrote
+    the status; the fleet autoscaler sizes the fleet from them. Workers write it at least
+    every INTERVAL seconds."""
+    PREFIX = "workers"
+    INTERVAL = 30.0
+
+    def __init__(self, worker, cpus, held, idle_since, tasks, time):
+        self.worker = worker
+        self.cpus = cpus
+        self.held = held
+        self.idle_since = idle_since
+        self.tasks = tasks
+        self.time = time
+
+    @staticmethod
+    def key_of(worker):
+        return "/".join([WorkerStatus.PREFIX, worker + ".json"])
+
+    @property
+    def key(self):
+        return WorkerStatus.key_of(self.worker)
+
+    @property
+    def busy(self):
+        return self.held > 0
+
+    def to_json(self):
+        return {"worker": self.worker, "cpus": self.cpus, "held": self.held, "idle_since": self.idle_since,
+                "tasks": self.tasks, "time": self.time}
+
+    @staticmethod
+    def from_json(data):
+        return WorkerStatus(data["worker"], data["cpus"], data["held"], data.get("idle_since"),
+                            data.get("tasks", []), data["time"])
+
+
 @objectfactory.Factory.register_class
 class CmdConfig(objectfactory.Serializable):
     _command = objectfactory.Field()
@@ -340,15 +433,17 @@ class CmdConfig(objectfactory.Serializable):
     _cores = objectfactory.Field()
     _depcfg = objectfactory.Field()
     _envcfg = objectfactory.Field()
+    _datasets = objectfactory.Field()
 
     @staticmethod
-    def new(cmd, timeout, cores, depfile, env):
+    def new(cmd, timeout, cores, depfile, env, datasets=None):
         cmdconfig = CmdConfig()
         cmdconfig._command = cmd
         cmdconfig._timeout = timeout
         cmdconfig._cores = cores
         cmdconfig._depcfg = depfile
         cmdconfig._envcfg = env
+        cmdconfig._datasets = [str(dataset) for dataset in datasets] if datasets else []
         return cmdconfig.normalize()
 
     @property
@@ -367,6 +462,11 @@ class CmdConfig(objectfactory.Serializable):
     def env_vars(self):
         return self._envcfg
 
+    @property
+    def datasets(self):
+        # pre-staged DatasetRefs, available to the command under datasets/<name>
+        return [DatasetRef.parse(ref) for ref in self._datasets] if self._datasets else []
+
     def normalize(self):
         for i in range(len(self.shell)):
             cmd_arg = self.shell[i]
@@ -1,4 +1,5 @@
 import json
+import os
 from abc import ABC, abstractmethod
 import objectfactory
 from common.configuration import CmdConfig, WSConfig
@@ -15,6 +16,10 @@ class AWSMsg(reconcile_meta(objectfactory.Serializable, IMessage, ABC)):
     def flatten(self):
         return json.dumps(self.serialize())
 
+    @staticmethod
+    def load(body: str):
+        return objectfactory.Factory.create_object(json.loads(body))
+
 
 @objectfactory.Factory.register_class
 class AWSIDRegistration(AWSMsg):
@@ -42,20 +47,37 @@ class IOTask(AWSMsg):
     _wsconfig = objectfactory.Nested()
     _localwd = objectfactory.Field()
     _perf_file = objectfactory.Field()
+    _artifacts = objectfactory.Field()
+    _benchmark = objectfactory.Field()
 
     @staticmethod
-    def new(cmdconfig: CmdConfig, wsconfig: WSConfig, localwd, perf_file):
+    def new(cmdconfig: CmdConfig, wsconfig: WSConfig, localwd, perf_file, artifacts=None, benchmark=False):
         iotask = IOTask()
         iotask._cmdconfig = cmdconfig
         iotask._wsconfig = wsconfig
         iotask._localwd = localwd
         iotask._perf_file = perf_file
+        iotask._artifacts = list(artifacts) if artifacts else []
+        iotask._benchmark = benchmark
         return iotask
 
     @property
     def command(self):
         return self._cmdconfig
 
+    @property
+    def commands(self):
+        return [self._cmdconfig]
+
+    @property
+    def concurrent(self):
+        return False
+
+    @property
+    def inputs(self):
+        # files the worker needs besides the command arguments and the dependency file
+        return []
+
     @property
     def workspace(self):
         return self._wsconfig
@@ -68,6 +90,16 @@ class IOTask(AWSMsg):
     def perf_file(self):
         return self._perf_file
 
+    @property
+    def artifacts(self):
+        # files (relative to the worker workspace) shipped back in _out.tar
+        return self._artifacts if self._artifacts else []
+
+    @property
+    def benchmark(self):
+        # run on isolated cores with calibration loops (see worker.noise)
+        return bool(self._benchmark)
+
     @property
     def cores(self):
         return self.command.cores
@@ -75,3 +107,104 @@ class IOTask(AWSMsg):
     @property
     def timeout(self):
         return self._cmdconfig.timeout
+
+
+@objectfactory.Factory.register_class
+class IOBatch(IOTask):
+    """Several commands run on one worker against the same input workspace.
+
+    Each command's stdout/stderr/exitcode come back in its own folder of the _out.tar
+    (see output_folder); the top-level members summarize the batch."""
+    _cmdconfigs = objectfactory.List(field_type=CmdConfig)
+    _concurrent = objectfactory.Field()
+
+    @staticmethod
+    def new(cmdconfigs, wsconfig: WSConfig, localwd, perf_file, artifacts=None, benchmark=False, concurrent=False):
+        batch = IOBatch()
+        batch._cmdconfig = cmdconfigs[0]
+        batch._cmdconfigs = list(cmdconfigs)
+        batch._wsconfig = wsconfig
+        batch._localwd = localwd
+        batch._perf_file = perf_file
+        batch._artifacts = list(artifacts) if artifacts else []
+        batch._benchmark = benchmark
+        batch._concurrent = concurrent
+        return batch
+
+    @staticmethod
+    def output_folder(index):
+        return "cmd{0}".format(index)
+
+    @property
+    def commands(self):
+        return self._cmdconfigs
+
+    @property
+    def concurrent(self):
+        # concurrent commands share the cores of the batch, each getting the cores it asks for
+        return bool(self._concurrent)
+
+    @property
+    def cores(self):
+        # concurrent commands need room side by side; CoreScheduler.submit caps it at the machine
+        if self.concurrent:
+            return sum(command.cores for command in self._cmdconfigs)
+        return max(command.cores for command in self._cmdconfigs)
+
+    @property
+    def timeout(self):
+        # upper bound for the whole batch, i.e. every command run back-to-back
+        return sum(command.timeout for command in self._cmdconfigs)
+
+
+@objectfactory.Factory.register_class
+class IOSuite(IOBatch):
+    """A test suite: batched commands with expected stdout/stderr/exit codes.
+
+    The worker runs the tests concurrently within the suite's core budget, compares
+    their outputs and returns a pass/fail report (REPORT) with diffs for failures only.
+    Expected output files travel in the input bundle like any other dependency."""
+    REPORT = "suite.json"
+    _names = objectfactory.Field()
+    _expected = objectfactory.Field()
+    _budget = objectfactory.Field()
+
+    @staticmethod
+    def new(cmdconfigs, wsconfig: WSConfig, localwd, perf_file, names, expected, cores, artifacts=None,
+            benchmark=False):
+        suite = IOSuite()
+        suite._cmdconfig = cmdconfigs[0]
+        suite._cmdconfigs = list(cmdconfigs)
+        suite._wsconfig = wsconfig
+        suite._localwd = localwd
+        suite._perf_file = perf_file
+        suite._artifacts = list(artifacts) if artifacts else []
+        suite._benchmark = benchmark
+        suite._concurrent = True
+        suite._names = list(names)
+        # one {"stdout": path, "stderr": path, "exitcode": int} per test, every key optional
+        suite._expected = [IOSuite._normalize(e) for e in expected]
+        suite._budget = cores
+        return suite
+
+    @staticmethod
+    def _normalize(expected):
+        # same treatment as CmdConfig arguments: absolute on the client, workspace-relative on the worker
+        return {k: os.path.abspath(v) if k in ("stdout", "stderr") else v for k, v in expected.items()}
+
+    @property
+    def names(self):
+        return self._names
+
+    @property
+    def expected(self):
+        return [{k: "." + v if k in ("stdout", "stderr") and v.startswith(os.path.sep) else v
+                 for k, v in expected.items()} for expected in self._expected]
+
+    @property
+    def inputs(self):
+        return [v for expected in self._expected for k, v in expected.items() if k in ("stdout", "stderr")]
+
+    @property
+    def cores(self):
+        return self._budget
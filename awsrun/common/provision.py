@@ -0,0 +1,555 @@
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from aws import S3Handler, SqsHandler, IAMHandler, list_topics, create_topic, delete_topic
+from aws.aws_ec2 import VPCManager
+
+
+class Inventory:
+    """Observed state of a region, one bulk listing per kind of resource.
+
+    A listing is fetched the first time any resource asks for it and shared by all the
+    others, so observing a whole environment costs one call per kind, not one per
+    resource. Resources observe from the plan's threads; each kind is fetched once."""
+
+    def __init__(self, region):
+        self.region = region
+        self.vpc_manager = VPCManager(region)
+        self._listings = dict()
+        self._locks = dict()
+        self._lock = threading.Lock()
+
+    def _listing(self, kind, fetch):
+        with self._lock:
+            lock = self._locks.setdefault(kind, threading.Lock())
+        with lock:
+            if kind not in self._listings:
+                self._listings[kind] = fetch()
+            return self._listings[kind]
+
+    def buckets(self):
+        return self._listing('buckets', lambda: {b.name for b in S3Handler(self.region).get_buckets()})
+
+    def queues(self):
+        """{queue name: url}"""
+        return self._listing('queues', lambda: {q.url.rsplit('/', 1)[-1]: q.url
+                                                for q in SqsHandler(self.region).get_queues()})
+
+    def topics(self):
+        """{topic name: Topic}"""
+        return self._listing('topics', lambda: {t.arn.rsplit(':', 1)[-1]: t for t in list_topics()})
+
+    def named(self, kind, name, vpc_id=None):
+        """The item of an EC2 kind (see VPCManager.KINDS) whose Name tag is `name`, or None."""
+        items = self._listing(kind, lambda: self.vpc_manager.list_resources(kind))
+        return next((item for item in items if VPCManager.name_of(item) == name
+                     and (vpc_id is None or item.get('VpcId') == vpc_id)), None)
+
+    def endpoints(self, vpc_id):
+        """{service name: endpoint} of the VPC's live endpoints."""
+        items = self._listing('vpc_endpoints', lambda: self.vpc_manager.list_resources('vpc_endpoints'))
+        return {e['ServiceName']: e for e in items
+                if e['VpcId'] == vpc_id and e['State'] not in VPCManager.ENDPOINT_GONE}
+
+    def roles(self):
+        return self._listing('roles', lambda: {role['RoleName']: role for role in IAMHandler().list_roles()})
+
+
+class Resource(ABC):
+    """One node of the provisioning graph.
+
+    `key` names it within the plan and `depends` lists the keys it needs to exist first;
+    their outputs (usually ids) are passed to create() and update(). observe() returns
+    what exists, or None; diff() lists what of it differs from the desired state."""
+
+    def __init__(self, key, depends=()):
+        self.key = key
+        self.depends = tuple(depends)
+
+    @abstractmethod
+    def observe(self, inventory: Inventory):
+        pass
+
+    def diff(self, observed):
+        return []
+
+    def output(self, observed):
+        return observed
+
+    @abstractmethod
+    def create(self, inventory: Inventory, outputs):
+        """Returns what observe() would now."""
+        pass
+
+    def update(self, inventory: Inventory, observed, outputs):
+        pass
+
+    @abstractmethod
+    def delete(self, inventory: Inventory, observed):
+        pass
+
+
+class BucketResource(Resource):
+    def __init__(self, name):
+        super().__init__("bucket:" + name)
+        self.name = name
+
+    def observe(self, inventory):
+        return self.name if self.name in inventory.buckets() else None
+
+    def create(self, inventory, outputs):
+        S3Handler(inventory.region).create_bucket(self.name)
+        return self.name
+
+    def delete(self, inventory, observed):
+        handler = S3Handler(inventory.region)
+        handler.delete_bucket(handler.get_bucket(self.name))
+
+
+class QueueResource(Resource):
+    def __init__(self, name):
+        super().__init__("queue:" + name)
+        self.name = name
+
+    def observe(self, inventory):
+        return inventory.queues().get(self.name)
+
+    def create(self, inventory, outputs):
+        return SqsHandler(inventory.region).create_queue(self.name).url
+
+    def delete(self, inventory, observed):
+        handler = SqsHandler(inventory.region)
+        handler.remove_queue(handler.get_queue_by_url(observed))
+
+
+class TopicResource(Resource):
+    def __init__(self, name):
+        super().__init__("topic:" + name)
+        self.name = name
+
+    def observe(self, inventory):
+        return inventory.topics().get(self.name)
+
+    def output(self, observed):
+        return observed.arn
+
+    def create(self, inventory, outputs):
+        return create_topic(self.name)
+
+    def delete(self, inventory, observed):
+        delete_topic(observed)
+
+
+class VpcResource(Resource):
+    def __init__(self, name, cidr_block="10.0.0.0/16", tenancy='default'):
+        super().__init__("vpc:" + name)
+        self.name = name
+        self._cidr_block = cidr_block
+        self._tenancy = tenancy
+
+    def observe(self, inventory):
+        return inventory.named('vpcs', self.name)
+
+    def diff(self, observed):
+        if observed['CidrBlock'] != self._cidr_block:
+            # the primary block of a VPC cannot change; reported, never updated
+            return ["cidr is {0}, not {1}".format(observed['CidrBlock'], self._cidr_block)]
+        return []
+
+    def output(self, observed):
+        return observed['VpcId']
+
+    def create(self, inventory, outputs):
+        vpc_id = inventory.vpc_manager.create_vpc(self.name, self._tenancy, self._cidr_block)
+        return {'VpcId': vpc_id, 'CidrBlock': self._cidr_block}
+
+    def delete(self, inventory, observed):
+        inventory.vpc_manager.delete_vpc(observed['VpcId'])
+
+
+class GatewayResource(Resource):
+    def __init__(self, name, vpc: VpcResource):
+        super().__init__("igw:" + name, [vpc.key])
+        self.name = name
+        self._vpc = vpc
+
+    def observe(self, inventory):
+        return inventory.named('internet_gateways', self.name)
+
+    def diff(self, observed):
+        return [] if observed.get('Attachments') else ["not attached"]
+
+    def output(self, observed):
+        return observed['InternetGatewayId']
+
+    def create(self, inventory, outputs):
+        igw_id = inventory.vpc_manager.create_igw(self.name)
+        inventory.vpc_manager.attach_igw2vpc(igw_id, outputs[self._vpc.key])
+        return {'InternetGatewayId': igw_id}
+
+    def update(self, inventory, observed, outputs):
+        inventory.vpc_manager.attach_igw2vpc(observed['InternetGatewayId'], outputs[self._vpc.key])
+
+    def delete(self, inventory, observed):
+        inventory.vpc_manager.delete_igw(observed['InternetGatewayId'],
+                                         [a['VpcId'] for a in observed.get('Attachments', [])])
+
+
+class SubnetResource(Resource):
+    """A public subnet: instances get a public IP."""
+
+    def __init__(self, name, vpc: VpcResource, cidr_block, zone=None):
+        super().__init__("subnet:" + name, [vpc.key])
+        self.name = name
+        self._vpc = vpc
+        self._cidr_block = cidr_block
+        self._zone = zone
+
+    def observe(self, inventory):
+        return inventory.named('subnets', self.name)
+
+    def diff(self, observed):
+        return [] if observed.get('MapPublicIpOnLaunch') else ["no public IPs"]
+
+    def output(self, observed):
+        return observed['SubnetId']
+
+    def create(self, inventory, outputs):
+        subnet_id = inventory.vpc_manager.create_subnet(self.name, outputs[self._vpc.key], self._cidr_block,
+                                                        self._zone)
+        inventory.vpc_manager.enable_auto_ip(subnet_id)
+        return {'SubnetId': subnet_id}
+
+    def update(self, inventory, observed, outputs):
+        inventory.vpc_manager.enable_auto_ip(observed['SubnetId'])
+
+    def delete(self, inventory, observed):
+        inventory.vpc_manager.delete_subnet(observed['SubnetId'])
+
+
+class RouteTableResource(Resource):
+    """Routes the subnets to the internet gateway."""
+    DEFAULT_ROUTE = "0.0.0.0/0"
+
+    def __init__(self, name, vpc: VpcResource, igw: GatewayResource, subnets):
+        super().__init__("rtb:" + name, [vpc.key, igw.key] + [subnet.key for subnet in subnets])
+        self.name = name
+        self._vpc = vpc
+        self._igw = igw
+        self._subnets = subnets
+
+    def observe(self, inventory):
+        return inventory.named('route_tables', self.name)
+
+    @staticmethod
+    def _routed(observed):
+        return any(r.get('DestinationCidrBlock') == RouteTableResource.DEFAULT_ROUTE and r.get('GatewayId')
+                   for r in observed.get('Routes', []))
+
+    @staticmethod
+    def _associated(observed):
+        return {a['SubnetId'] for a in observed.get('Associations', []) if a.get('SubnetId')}
+
+    def diff(self, observed):
+        changes = [] if RouteTableResource._routed(observed) else ["no route to the internet gateway"]
+        if len(RouteTableResource._associated(observed)) < len(self._subnets):
+            changes.append("not associated with every subnet")
+        return changes
+
+    def output(self, observed):
+        return observed['RouteTableId']
+
+    def _wire(self, vpc_manager, rtb_id, observed, outputs):
+        if not RouteTableResource._routed(observed):
+            vpc_manager.add_igw_route(rtb_id, outputs[self._igw.key], RouteTableResource.DEFAULT_ROUTE)
+        associated = RouteTableResource._associated(observed)
+        for subnet in self._subnets:
+            if outputs[subnet.key] not in associated:
+                vpc_manager.route_subnet(outputs[subnet.key], rtb_id)
+
+    def create(self, inventory, outputs):
+        rtb_id = inventory.vpc_manager.create_routing_table(outputs[self._vpc.key], self.name)
+        self._wire(inventory.vpc_manager, rtb_id, dict(), outputs)
+        return {'RouteTableId': rtb_id}
+
+    def update(self, inventory, observed, outputs):
+        self._wire(inventory.vpc_manager, observed['RouteTableId'], observed, outputs)
+
+    def delete(self, inventory, observed):
+        inventory.vpc_manager.delete_route_table(observed['RouteTableId'],
+                                                 [a['RouteTableAssociationId'] for a in observed.get('Associations', [])
+                                                  if not a.get('Main')])
+
+
+class EndpointsResource(Resource):
+    """The S3 gateway and SQS interface endpoints of VPCManager.create_endpoints."""
+
+    def __init__(self, vpc: VpcResource, route_table: RouteTableResource, subnets):
+        super().__init__("endpoints:" + vpc.name, [vpc.key, route_table.key] + [subnet.key for subnet in subnets])
+        self._vpc = vpc
+
+    def _services(self, inventory):
+        return [inventory.vpc_manager.service_name(service) for service in ('s3',) + VPCManager.INTERFACES]
+
+    def observe(self, inventory):
+        vpc = inventory.named('vpcs', self._vpc.name)
+        if vpc is None:
+            return None
+        endpoints = inventory.endpoints(vpc['VpcId'])
+        group = inventory.named('security_groups', VPCManager.ENDPOINT_SG, vpc['VpcId'])
+        # a group left behind without endpoints still has to go before the VPC can
+        if not endpoints and group is None:
+            return None
+        return {'VpcId': vpc['VpcId'], 'Endpoints': endpoints, 'Services': self._services(inventory),
+                'SecurityGroup': group}
+
+    def diff(self, observed):
+        missing = [s for s in observed['Services'] if s not in observed['Endpoints']]
+        return ["missing " + ", ".join(missing)] if missing else []
+
+    def output(self, observed):
+        return {service: e['VpcEndpointId'] for service, e in observed['Endpoints'].items()}
+
+    def create(self, inventory, outputs):
+        vpc_id = outputs[self._vpc.key]
+        endpoints = inventory.vpc_manager.create_endpoints(vpc_id)
+        return {'VpcId': vpc_id, 'Services': self._services(inventory), 'SecurityGroup': None,
+                'Endpoints': {inventory.vpc_manager.service_name(service): {'VpcEndpointId': endpoint_id}
+                              for service, endpoint_id in endpoints.items()}}
+
+    def update(self, inventory, observed, outputs):
+        # also attaches the S3 endpoint to route tables created since
+        inventory.vpc_manager.create_endpoints(observed['VpcId'])
+
+    def delete(self, inventory, observed):
+        if observed['Endpoints']:
+            inventory.vpc_manager.delete_endpoints([e['VpcEndpointId'] for e in observed['Endpoints'].values()])
+        if observed['SecurityGroup'] is not None:
+            inventory.vpc_manager.delete_security_group(observed['SecurityGroup']['GroupId'])
+
+
+class WorkerRoleResource(Resource):
+    """IAM role and instance profile of the workers: SSM, plus the bucket and queues."""
+    TRUST = '{"Version": "2012-10-17", "Statement": [{"Effect": "Allow", ' \
+            '"Principal": {"Service": "ec2.amazonaws.com"}, "Action": "sts:AssumeRole"}]}'
+    MANAGED = ("arn:aws:iam::aws:policy/AmazonSSMManagedInstanceCore",)
+    POLICY = "awsrun-worker"
+
+    def __init__(self, name, region, bucket, queues):
+        super().__init__("role:" + name)
+        self.name = name
+        self._region = region
+        self._bucket = bucket
+        self._queues = queues
+
+    def policy(self):
+        statements = [{"Effect": "Allow", "Action": ["s3:ListBucket"],
+                       "Resource": [S3Handler.get_bucket_arn(self._bucket)]},
+                      {"Effect": "Allow", "Action": ["s3:GetObject", "s3:PutObject", "s3:DeleteObject"],
+                       "Resource": [S3Handler.get_bucket_arn(self._bucket) + "/*"]}]
+        if self._queues:
+            statements.append({"Effect": "Allow", "Action": ["sqs:*"],
+                               "Resource": ["arn:aws:sqs:{0}:*:{1}".format(self._region, q) for q in self._queues]})
+        return {"Version": "2012-10-17", "Statement": statements}
+
+    def observe(self, inventory):
+        if self.name not in inventory.roles():
+            return None
+        iam = IAMHandler()
+        return {'RoleName': self.name, 'Attached': iam.list_attached_role_policies(self.name),
+                'Policy': iam.get_role_policy(self.name, WorkerRoleResource.POLICY) is not None,
+                'Profile': iam.find_instance_profile_by_name(self.name) is not None,
+                'InProfile': iam.has_role_for_profile(self.name, self.name)}
+
+    def diff(self, observed):
+        changes = ["policy {0} detached".format(arn) for arn in WorkerRoleResource.MANAGED
+                   if arn not in observed['Attached']]
+        if not observed['Policy']:
+            changes.append("no bucket and queue policy")
+        if not observed['InProfile']:
+            changes.append("not in its instance profile")
+        return changes
+
+    def output(self, observed):
+        return observed['RoleName']
+
+    def update(self, inventory, observed, outputs):
+        iam = IAMHandler()
+        for arn in WorkerRoleResource.MANAGED:
+            if arn not in observed['Attached']:
+                iam.attach_policy2role(arn, self.name)
+        # cheap, and keeps the bucket and queue names current
+        iam.put_role_policy(self.name, WorkerRoleResource.POLICY, self.policy())
+        if not observed['Profile']:
+            iam.instance_profile(self.name)
+        if not observed['InProfile']:
+            iam.role_for_instance_profile(self.name, self.name)
+
+    def create(self, inventory, outputs):
+        IAMHandler().create_role(self.name, WorkerRoleResource.TRUST, "awsrun workers")
+        observed = {'RoleName': self.name, 'Attached': [], 'Policy': False,
+                    'Profile': IAMHandler().find_instance_profile_by_name(self.name) is not None, 'InProfile': False}
+        self.update(inventory, observed, outputs)
+        return dict(observed, Attached=list(WorkerRoleResource.MANAGED), Policy=True, Profile=True, InProfile=True)
+
+    def delete(self, inventory, observed):
+        iam = IAMHandler()
+        if observed['InProfile']:
+            iam.remove_role_from_instance_profile(self.name, self.name)
+        if observed['Profile']:
+            iam.delete_instance_profile(self.name)
+        for arn in observed['Attached']:
+            iam.detach_policy_from_role(arn, self.name)
+        if observed['Policy']:
+            iam.delete_role_policy(self.name, WorkerRoleResource.POLICY)
+        iam.delete_role(self.name)
+
+
+class Network:
+    """Desired network of the workers: a VPC with an internet gateway, public subnets
+    (spread over `zones` when given) routed through one route table, and the S3 and SQS
+    endpoints. Every piece is found again by its Name tag, `<name>-<piece>`."""
+
+    def __init__(self, name, cidr_block="10.0.0.0/16", subnets=("10.0.0.0/24",), zones=(), tenancy='default',
+                 endpoints=True):
+        self.name = name
+        self._cidr_block = cidr_block
+        self._subnets = subnets
+        self._zones = zones
+        self._tenancy = tenancy
+        self._endpoints = endpoints
+
+    def resources(self):
+        vpc = VpcResource(self.name, self._cidr_block, self._tenancy)
+        igw = GatewayResource(self.name + "-igw", vpc)
+        subnets = [SubnetResource("{0}-subnet-{1}".format(self.name, i), vpc, cidr_block,
+                                  self._zones[i % len(self._zones)] if self._zones else None)
+                   for i, cidr_block in enumerate(self._subnets)]
+        route_table = RouteTableResource(self.name + "-rtb", vpc, igw, subnets)
+        resources = [vpc, igw] + subnets + [route_table]
+        if self._endpoints:
+            resources.append(EndpointsResource(vpc, route_table, subnets))
+        return resources
+
+
+class Step:
+    CREATE = "create"
+    UPDATE = "update"
+    KEEP = "keep"
+    DELETE = "delete"
+    SYMBOLS = {CREATE: "+", UPDATE: "~", KEEP: "=", DELETE: "-"}
+
+    def __init__(self, action, resource: Resource, observed=None, changes=()):
+        self.action = action
+        self.resource = resource
+        self.observed = observed
+        self.changes = list(changes)
+        # keys of the steps that must be done first
+        self.after = []
+
+    def __str__(self):
+        detail = " ({0})".format("; ".join(self.changes)) if self.changes else ""
+        return "{0} {1:<8} {2}{3}".format(Step.SYMBOLS[self.action], self.action, self.resource.key, detail)
+
+
+class Plan:
+    """What it takes to get from the observed state to the desired one.
+
+    A build plan creates what is missing and updates what drifted, dependencies first;
+    a destroy plan deletes what exists, dependents first. apply() starts every step the
+    moment the steps it waits for are done, up to `workers` at a time, so independent
+    branches (bucket, queues, topic, network, role) proceed side by side. Since steps
+    come from observation, applying a plan again is a no-op."""
+
+    def __init__(self, inventory: Inventory, steps, workers=8):
+        self._inventory = inventory
+        self.steps = steps
+        self._workers = workers
+        self._logger = logging.getLogger(Plan.__name__)
+
+    @staticmethod
+    def _observe(inventory, resources, workers):
+        keys = {resource.key for resource in resources}
+        for resource in resources:
+            unknown = [key for key in resource.depends if key not in keys]
+            if unknown:
+                raise ValueError("{0} depends on {1}, which is not in the plan".format(resource.key, unknown))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda r: r.observe(inventory), resources))
+
+    @staticmethod
+    def build(inventory: Inventory, resources, workers=8):
+        steps = []
+        for resource, observed in zip(resources, Plan._observe(inventory, resources, workers)):
+            if observed is None:
+                step = Step(Step.CREATE, resource)
+            else:
+                changes = resource.diff(observed)
+                step = Step(Step.UPDATE if changes else Step.KEEP, resource, observed, changes)
+            step.after = list(resource.depends)
+            steps.append(step)
+        return Plan(inventory, steps, workers)
+
+    @staticmethod
+    def destroy(inventory: Inventory, resources, workers=8):
+        steps = [Step(Step.DELETE, resource, observed)
+                 for resource, observed in zip(resources, Plan._observe(inventory, resources, workers))
+                 if observed is not None]
+        deleted = {step.resource.key for step in steps}
+        for step in steps:
+            step.after = [other.resource.key for other in steps
+                          if step.resource.key in other.resource.depends and other.resource.key in deleted]
+        return Plan(inventory, steps, workers)
+
+    @property
+    def changes(self):
+        return [step for step in self.steps if step.action != Step.KEEP]
+
+    def _run(self, step, outputs):
+        resource = step.resource
+        if step.action == Step.CREATE:
+            return resource.output(resource.create(self._inventory, outputs))
+        if step.action == Step.UPDATE:
+            resource.update(self._inventory, step.observed, outputs)
+        elif step.action == Step.DELETE:
+            resource.delete(self._inventory, step.observed)
+            return None
+        return resource.output(step.observed)
+
+    def apply(self):
+        """Runs the plan; returns {key: output}. Raises RuntimeError naming the failed
+        steps after letting the running ones finish; steps waiting on them never start."""
+        outputs = dict()
+        waiting = {step.resource.key: step for step in self.steps}
+        done, failed, running = set(), dict(), dict()
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            while waiting or running:
+                if not failed:
+                    for key, step in list(waiting.items()):
+                        if all(after in done for after in step.after):
+                            del waiting[key]
+                            running[executor.submit(self._run, step, outputs)] = step
+                if not running:
+                    if not failed:
+                        raise RuntimeError("Dependency cycle among " + ", ".join(sorted(waiting)))
+                    break
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    try:
+                        outputs[step.resource.key] = future.result()
+                        done.add(step.resource.key)
+                        if step.action != Step.KEEP:
+                            self._logger.info("%s done", step)
+                    except Exception as error:
+                        self._logger.exception("%s failed", step)
+                        failed[step.resource.key] = error
+        if failed:
+            raise RuntimeError("Provisioning failed at {0}; not started: {1}".format(
+                ", ".join(sorted(failed)), ", ".join(sorted(waiting)) or "nothing"))
+        self._logger.info("Applied %s changes in %.1f s", len(self.changes), time.time() - start)
+        return outputs
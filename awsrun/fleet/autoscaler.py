@@ -0,0 +1,204 @@
+import json
+import logging
+import math
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from common.configuration import WorkerStatus
+from fleet.pool import WarmPool
+from fleet.spot import SpotPlacement
+
+
+class FleetSample:
+    """One look at the queue and the fleet: approximate message counts and worker statuses."""
+
+    def __init__(self, visible, inflight, statuses, time):
+        self.visible = visible
+        self.inflight = inflight
+        # {worker id: WorkerStatus}
+        self.statuses = statuses
+        self.time = time
+
+    @property
+    def backlog(self):
+        return self.visible + self.inflight
+
+    @property
+    def tasks(self):
+        """[seconds, cores] of the recently finished tasks of every worker."""
+        return [task for status in self.statuses.values() for task in status.tasks]
+
+    def fresh(self, stale):
+        return {worker: status for worker, status in self.statuses.items() if self.time - status.time <= stale}
+
+
+class ScalingPolicy:
+    """How many workers a queue needs.
+
+    The outstanding work is the backlog (visible plus in-flight messages) times the mean
+    core-seconds of recently finished tasks; the fleet should get through it within
+    `drain_seconds`, but never has fewer workers than the in-flight messages keep busy.
+    Until a task has finished, every task is assumed to take `default_seconds` on one core."""
+
+    def __init__(self, min_workers=0, max_workers=10, drain_seconds=600, default_seconds=60, cpus_per_worker=2,
+                 scale_out_cooldown=60, scale_in_cooldown=300):
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.drain_seconds = drain_seconds
+        self.default_seconds = default_seconds
+        self.cpus_per_worker = cpus_per_worker
+        self.scale_out_cooldown = scale_out_cooldown
+        self.scale_in_cooldown = scale_in_cooldown
+
+    def _clamp(self, workers):
+        return max(self.min_workers, min(self.max_workers, workers))
+
+    def desired(self, sample: FleetSample, stale):
+        if sample.backlog == 0:
+            return self._clamp(0)
+        tasks = sample.tasks
+        core_seconds = statistics.mean(s * c for s, c in tasks) if tasks else self.default_seconds
+        cores = statistics.mean(c for _, c in tasks) if tasks else 1
+        fresh = sample.fresh(stale)
+        cpus = statistics.mean(s.cpus for s in fresh.values()) if fresh else self.cpus_per_worker
+        by_deadline = math.ceil(sample.backlog * core_seconds / (cpus * self.drain_seconds))
+        # tasks already running keep their workers, however quickly the rest would drain
+        by_inflight = math.ceil(sample.inflight * min(cores, cpus) / cpus)
+        return self._clamp(max(by_deadline, by_inflight, 1))
+
+
+class Autoscaler:
+    """Sizes the tagged worker fleet of a task queue from its depth and the workers' statuses;
+    scale-in stops only workers that reported themselves idle."""
+    ACTIVE = ("pending", "running")
+
+    def __init__(self, launcher, s3handler, sqshandler, queue, bucket: str, policy: ScalingPolicy, launch=None,
+                 boot_grace=300, stale=None, pool: WarmPool = None, placement: SpotPlacement = None):
+        self._launcher = launcher
+        self._s3 = s3handler
+        self._sqs = sqshandler
+        self._queue = queue
+        self._bucket = bucket
+        self._policy = policy
+        self._launch = launch
+        self._pool = pool
+        self._placement = placement
+        self._lock = pool.lock if pool is not None else threading.RLock()
+        self._boot_grace = boot_grace
+        # a status older than this no longer says anything about the worker
+        self._stale = stale if stale else 3 * WorkerStatus.INTERVAL
+        self._last_out = None
+        self._last_in = None
+        self._logger = logging.getLogger(Autoscaler.__name__)
+
+    def _statuses(self):
+        statuses = dict()
+        with tempfile.TemporaryDirectory() as scratch:
+            for entry in self._s3.list_objects(self._bucket, WorkerStatus.PREFIX + "/"):
+                target = os.path.join(scratch, "status.json")
+                try:
+                    self._s3.download_file(self._bucket, entry["key"], target)
+                    with open(target) as f:
+                        status = WorkerStatus.from_json(json.load(f))
+                except (ClientError, ValueError, KeyError):
+                    self._logger.warning("Ignoring unreadable worker status %s", entry["key"])
+                    continue
+                statuses[status.worker] = status
+        return statuses
+
+    def sample(self, now=None):
+        visible, inflight = self._sqs.get_queue_depth(self._queue)
+        return FleetSample(visible, inflight, self._statuses(), time.time() if now is None else now)
+
+    @staticmethod
+    def _state(instance):
+        return instance.state['Name']
+
+    def _age(self, instance, now):
+        return now - instance.launch_time.timestamp()
+
+    def _idle_since(self, instance, sample: FleetSample):
+        """When the worker became idle, or None if it must not be stopped."""
+        status = sample.statuses.get(instance.id)
+        if status is None or sample.time - status.time > self._stale:
+            # booting, or a worker that stopped reporting: only the latter is fair game
+            if self._age(instance, sample.time) < self._boot_grace:
+                return None
+            return status.time if status else instance.launch_time.timestamp()
+        if status.busy or status.idle_since is None:
+            return None
+        return status.idle_since
+
+    def _cooled(self, last, cooldown, now):
+        return last is None or now - last >= cooldown
+
+    def _scale_out(self, count, stopped, now):
+        if self._pool is not None:
+            started = self._pool.take(count)
+        else:
+            started = stopped[:count]
+            for instance in started:
+                instance.start()
+            if started:
+                self._logger.info("Started %s stopped workers: %s", len(started), [i.id for i in started])
+        launched = []
+        if count > len(started) and self._pool is not None:
+            launched = self._pool.launch(count - len(started))
+        elif count > len(started) and self._launch is not None and self._placement is not None:
+            launched = self._placement.launch(self._launcher, count - len(started), **self._launch)
+        elif count > len(started) and self._launch is not None:
+            launched = self._launcher.launch_instance(num_inst=count - len(started), **self._launch)
+        if launched:
+            self._logger.info("Launched %s workers: %s", len(launched), [i.id for i in launched])
+        self._last_out = now
+        return [i.id for i in started] + [i.id for i in launched]
+
+    def _scale_in(self, count, active, sample: FleetSample):
+        idle = [(since, instance) for since, instance in ((self._idle_since(i, sample), i) for i in active)
+                if since is not None]
+        stopped = [instance for _, instance in sorted(idle, key=lambda pair: pair[0])[:count]]
+        for instance in stopped:
+            if getattr(instance, 'instance_lifecycle', None) == 'spot':
+                instance.terminate()
+            else:
+                instance.stop()
+        if stopped:
+            self._logger.info("Stopped %s idle workers: %s", len(stopped), [i.id for i in stopped])
+            self._last_in = sample.time
+        return [i.id for i in stopped]
+
+    def step(self, now=None):
+        """Samples once and scales; returns what it saw and did."""
+        sample = self.sample(now)
+        with self._lock:
+            return self._scale(sample)
+
+    def _scale(self, sample: FleetSample):
+        instances = [i for i in self._launcher.all_instances() if not WarmPool.warming(i)]
+        active = [i for i in instances if Autoscaler._state(i) in Autoscaler.ACTIVE]
+        stopped = [i for i in instances if Autoscaler._state(i) == "stopped"]
+        desired = self._policy.desired(sample, self._stale)
+        decision = {"time": sample.time, "visible": sample.visible, "inflight": sample.inflight,
+                    "active": len(active), "desired": desired, "started": [], "stopped": []}
+        last = max(filter(None, (self._last_out, self._last_in)), default=None)
+        if desired > len(active) and self._cooled(self._last_out, self._policy.scale_out_cooldown, sample.time):
+            decision["started"] = self._scale_out(desired - len(active), stopped, sample.time)
+        elif desired < len(active) and self._cooled(last, self._policy.scale_in_cooldown, sample.time):
+            decision["stopped"] = self._scale_in(len(active) - desired, active, sample)
+        return decision
+
+    def run(self, interval=30, steps=None):
+        while steps is None or steps > 0:
+            decision = self.step()
+            self._logger.info("Queue %s visible, %s in flight; %s active workers, %s wanted",
+                              decision["visible"], decision["inflight"], decision["active"], decision["desired"])
+            if steps is not None:
+                steps -= 1
+                if steps == 0:
+                    break
+            time.sleep(interval)
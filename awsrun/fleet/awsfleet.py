@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+from os import path
+import sys
+import time
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from aws import S3Handler, SqsHandler
+from aws.aws_ec2 import EC2Launcher, EC2InstTypes, EC2InstanceUtility, LaunchProfiles, SpotMarket, VPCManager
+from aws.aws_ssm import SSMHandler
+from common.resources import JsonLoader
+from common.configuration import AWSPathManager, AWSInfra, AWSTags
+from common.provision import Network, WorkerRoleResource
+from fleet.autoscaler import Autoscaler, ScalingPolicy
+from fleet.bake import ImageBaker
+from fleet.benchmark import BenchTable, TypeBenchmark
+from fleet.pool import WarmPool
+from fleet.readiness import ReadinessWaiter
+from fleet.spot import SpotPlacement
+
+
+def instance_type(name, region):
+    """The InstanceType of `name`, asking EC2 for types EC2InstTypes does not list."""
+    try:
+        return EC2InstTypes.by_name(name)
+    except KeyError:
+        found = SpotMarket(region).instance_types([name])
+        if not found:
+            raise
+        return found[0]
+
+
+def tag(text):
+    key, _, value = text.partition("=")
+    if not value:
+        raise argparse.ArgumentTypeError("expected key=value, got {0}".format(text))
+    return key, value
+
+
+if __name__ == '__main__':
+    aws_parser = argparse.ArgumentParser(description='Manages the fleet of awsrun workers',
+                                         epilog='Enjoy the program! :)')
+    # aws config
+    awscfg = aws_parser.add_mutually_exclusive_group(required=True)
+
+    awscfg.add_argument('--configurl',
+                        action='store_const',
+                        const="https://raw.githubusercontent.com/eec-ucd/eec289/main/config.aws",
+                        help='configuration url for the aws server')
+
+    awscfg.add_argument('--configfile',
+                        action='store_const',
+                        const='config.aws',
+                        help='configuration file for the aws server')
+
+    aws_parser.add_argument('--tag',
+                            type=tag,
+                            default=('awsrun', 'worker'),
+                            help='key=value tag of the fleet instances')
+
+    commands = aws_parser.add_subparsers(dest='command', required=True)
+
+    scale = commands.add_parser('scale', help='size the fleet to the task queue')
+    scale.add_argument('--min', type=int, default=0, help='fewest workers')
+    scale.add_argument('--max', type=int, default=10, help='most workers')
+    scale.add_argument('--drain', type=int, default=600, help='seconds the fleet should take to work off the queue')
+    scale.add_argument('--task-seconds', type=int, default=60,
+                       help='assumed task duration until workers have reported some')
+    scale.add_argument('--cpus', type=int, default=2, help='CPUs per worker until workers have reported some')
+    scale.add_argument('--out-cooldown', type=int, default=60, help='seconds between scale-outs')
+    scale.add_argument('--in-cooldown', type=int, default=300, help='seconds from any scaling to a scale-in')
+    scale.add_argument('--boot-grace', type=int, default=300,
+                       help='seconds a new worker may take to report before it counts as idle')
+    scale.add_argument('--interval', type=int, default=30, help='seconds between samples')
+    scale.add_argument('--once', action='store_true', help='sample and scale once, then exit')
+    # one scale process per queue, each with its own --tag
+    scale.add_argument('--queue', type=str, default=None, help='url of the task queue to size for (default: config)')
+    scale.add_argument('--profile', type=str, default='throughput',
+                       choices=[profile.name for profile in LaunchProfiles.all()],
+                       help='how new workers are placed; timing: no SMT, no burstable types, cluster placement')
+    # without these only stopped fleet instances are started
+    scale.add_argument('--ami', type=str, default=None, help='AMI name pattern new workers are launched from')
+    scale.add_argument('--instance-type', type=str, default=EC2InstTypes.medium().name, help='type of new workers')
+    scale.add_argument('--key-name', type=str, default=None, help='key pair of new workers')
+    scale.add_argument('--security-group', type=str, default=None, help='security group id of new workers')
+    scale.add_argument('--subnet', type=str, nargs='+', default=None,
+                       help='subnet id of new workers; with --spot, one per zone to pick from')
+    scale.add_argument('--userdata', type=str, default=None, help='file with the user data of new workers')
+    scale.add_argument('--warm-pool', type=int, default=0,
+                       help='provisioned workers kept stopped for fast scale-out (needs --ami)')
+    scale.add_argument('--setup-timeout', type=int, default=1800,
+                       help='seconds a warm pool worker may take to provision')
+    scale.add_argument('--pool-interval', type=int, default=60, help='seconds between warm pool passes')
+    scale.add_argument('--spot', action='store_true',
+                       help='launch spot workers of the cheapest type and zone for --ratio (needs --ami)')
+    scale.add_argument('--ratio', type=str, default='1:2', help='cores:GB of memory a job needs')
+    scale.add_argument('--types', type=str, nargs='+',
+                       default=['c5.large', 'c5.xlarge', 'c5.2xlarge', 'm5.large', 'm5.xlarge', 'm5.2xlarge',
+                                'r5.large', 'r5.xlarge'],
+                       help='instance types --spot picks from')
+    scale.add_argument('--max-price', type=float, default=None,
+                       help='highest hourly spot price (default: the on-demand price)')
+    scale.add_argument('--bench', type=str, nargs='?', const=BenchTable.DEFAULT, default=None,
+                       help='weigh --spot prices by the per-core speeds in this bench table')
+
+    bake = commands.add_parser('bake', help='build a new version of the worker AMI')
+    bake.add_argument('--template', type=str, default='awsrun-worker', help='AMI name; images are <template>.<version>')
+    bake.add_argument('--base-ami', type=str, required=True, help='image id the builder starts from (Ubuntu 20.04)')
+    bake.add_argument('--setup', type=str,
+                      default=path.join(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))),
+                                        'vm', 'vmsetup.sh'),
+                      help='setup script run as the builder\'s user data')
+    bake.add_argument('--instance-type', type=str, default=EC2InstTypes.medium().name, help='type of the builder')
+    bake.add_argument('--key-name', type=str, required=True, help='key pair of the builder')
+    bake.add_argument('--security-group', type=str, required=True, help='security group id of the builder')
+    bake.add_argument('--subnet', type=str, required=True, help='subnet id of the builder')
+    bake.add_argument('--setup-timeout', type=int, default=3600, help='seconds the bake may take')
+
+    bench = commands.add_parser('bench', help='measure perf per dollar of instance types')
+    bench.add_argument('--ami', type=str, default='awsrun-worker', help='AMI name pattern the instances run')
+    bench.add_argument('--types', type=str, nargs='+', required=True, help='instance types to measure')
+    bench.add_argument('--key-name', type=str, required=True, help='key pair of the instances')
+    bench.add_argument('--security-group', type=str, required=True, help='security group id of the instances')
+    bench.add_argument('--subnet', type=str, required=True, help='subnet id of the instances')
+    bench.add_argument('--profile', type=str, default='throughput',
+                       choices=[profile.name for profile in LaunchProfiles.all()],
+                       help='how the instances are placed; burstable types are skipped where it excludes them')
+    bench.add_argument('--fib', type=int, default=40, help='fib argument of a run')
+    bench.add_argument('--sustain', type=int, default=600,
+                       help='seconds of full load, long enough to spend the CPU credits of burstable types')
+    bench.add_argument('--timeout', type=int, default=3600, help='seconds the benchmark may take')
+    bench.add_argument('--table', type=str, default=BenchTable.DEFAULT, help='bench table to update')
+
+    endpoints = commands.add_parser('endpoints', help='route the VPC\'s S3 and SQS traffic through VPC endpoints')
+    endpoints.add_argument('--vpc', type=str, required=True, help='id or Name tag of the workers\' VPC')
+
+    env = commands.add_parser('env', help='stand up or tear down the course environment')
+    env.add_argument('action', choices=['apply', 'destroy'], help='build what is missing, or delete what exists')
+    env.add_argument('--plan', action='store_true', help='only show what would change')
+    env.add_argument('--network', type=str, default=None, help='Name of the workers\' VPC; no VPC without it')
+    env.add_argument('--cidr', type=str, default='10.0.0.0/16', help='address block of the VPC')
+    env.add_argument('--subnets', type=str, nargs='+', default=['10.0.0.0/24'], help='address blocks of the subnets')
+    env.add_argument('--zones', type=str, nargs='+', default=[], help='availability zones the subnets go round')
+    env.add_argument('--tenancy', type=str, default='default', choices=['default', 'dedicated'],
+                     help='tenancy of the VPC')
+    env.add_argument('--no-endpoints', action='store_true', help='leave S3 and SQS traffic on the internet gateway')
+    env.add_argument('--role', type=str, default=None, help='name of the workers\' IAM role and instance profile')
+    env.add_argument('--workers', type=int, default=8, help='steps run at once')
+
+    args = aws_parser.parse_args()
+
+    if args.command == 'scale' and args.ami and not (args.key_name and args.security_group and args.subnet):
+        aws_parser.error("--ami needs --key-name, --security-group and --subnet")
+
+    if args.command == 'scale' and args.warm_pool and not args.ami:
+        aws_parser.error("--warm-pool needs --ami")
+
+    if args.command == 'scale' and args.spot and not args.ami:
+        aws_parser.error("--spot needs --ami")
+
+    if args.command == 'scale' and args.spot and LaunchProfiles.by_name(args.profile).placement_group:
+        # a cluster placement group lives in one zone, and SMT off halves the cores spot sizing counts
+        aws_parser.error("--spot cannot be combined with --profile {0}".format(args.profile))
+
+    if args.command == 'scale' and args.spot and args.warm_pool:
+        # one-time spot instances terminate instead of stopping
+        aws_parser.error("--spot cannot be combined with --warm-pool")
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.configurl:
+        data = JsonLoader.load_url(args.configurl)
+
+    if args.configfile:
+        data = JsonLoader.load_file(args.configfile)
+
+    infra = AWSInfra.load(data)
+    aws_path_manager = AWSPathManager(infra)
+    region = aws_path_manager.server_path.path
+    launcher = EC2Launcher(args.tag, region)
+
+    if args.command == 'scale':
+        launch, pool, placement = None, None, None
+        if args.ami:
+            userdata = ''
+            if args.userdata:
+                with open(args.userdata) as f:
+                    userdata = f.read()
+            profile = LaunchProfiles.by_name(args.profile)
+            launch = {"key_name": args.key_name, "sg_id": args.security_group, "subnet_id": args.subnet[0],
+                      "instance_type": instance_type(args.instance_type, region), "userdata": userdata,
+                      "profile": profile}
+            if not profile.allows(launch["instance_type"]):
+                aws_parser.error("--profile {0} does not launch burstable {1}".format(args.profile,
+                                                                                     args.instance_type))
+            if args.spot:
+                placement = SpotPlacement(SpotMarket(region), args.ratio, args.types, args.subnet,
+                                          max_price=args.max_price,
+                                          speeds=BenchTable(args.bench).speeds() if args.bench else None)
+            if args.warm_pool:
+                pool = WarmPool(launcher, SSMHandler(region=region), args.warm_pool, args.ami, launch,
+                                args.setup_timeout)
+                launch = None
+            else:
+                launch["img_id"] = launcher.get_ami(args.ami)[0]['ImageId']
+        sqs = SqsHandler(region)
+        queue = sqs.get_queue_by_url(args.queue or aws_path_manager.taskq_path.path)
+        autoscaler = Autoscaler(launcher, S3Handler(region), sqs, queue,
+                                aws_path_manager.bucket_path.path,
+                                ScalingPolicy(args.min, args.max, args.drain, args.task_seconds, args.cpus,
+                                              args.out_cooldown, args.in_cooldown),
+                                launch=launch, boot_grace=args.boot_grace, pool=pool, placement=placement)
+        try:
+            if pool is not None:
+                if args.once:
+                    pool.replenish()
+                else:
+                    pool.start(args.pool_interval)
+            autoscaler.run(args.interval, 1 if args.once else None)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pool is not None:
+                pool.stop()
+
+    if args.command == 'bake':
+        with open(args.setup) as f:
+            setup_script = f.read()
+        # the builder carries its own tag, so the autoscaler never counts it as a worker
+        builder_tag = (args.tag[0], 'builder')
+        builder = EC2Launcher(builder_tag, region)
+        ssm = SSMHandler(region=region)
+        baker = ImageBaker(builder, ssm, ReadinessWaiter(EC2InstanceUtility(region, type_tag=builder_tag), ssm),
+                           {"key_name": args.key_name, "sg_id": args.security_group, "subnet_id": args.subnet,
+                            "instance_type": instance_type(args.instance_type, region)},
+                           args.setup_timeout)
+        image_id, name, versions = baker.bake(args.template, args.base_ami, setup_script)
+        print(" ====  {0}  ====\n".format(name))
+        print("{:<12} {}".format("image", image_id))
+        for key, value in sorted(versions.items()):
+            print("{:<12} {}".format(key, value))
+
+    if args.command == 'bench':
+        market = SpotMarket(region)
+        profile = LaunchProfiles.by_name(args.profile)
+        types = [t for t in market.instance_types(args.types) if profile.allows(t)]
+        # average spot price over the region's zones
+        prices = dict()
+        for (name, _), priced in market.prices(types).items():
+            prices.setdefault(name, []).append(priced.avg_price)
+        # the instances carry their own tag, so the autoscaler never counts them as workers
+        bench_tag = (args.tag[0], 'bench')
+        runner = EC2Launcher(bench_tag, region)
+        ssm = SSMHandler(region=region)
+        benchmark = TypeBenchmark(runner, ssm, ReadinessWaiter(EC2InstanceUtility(region, type_tag=bench_tag), ssm),
+                                  {"key_name": args.key_name, "sg_id": args.security_group, "subnet_id": args.subnet,
+                                   "img_id": runner.get_ami(args.ami)[0]['ImageId'], "profile": profile},
+                                  args.fib, args.sustain, args.timeout)
+        table = BenchTable(args.table)
+        results = benchmark.run(types)
+        for instance_type in types:
+            if instance_type.name in results:
+                price = prices.get(instance_type.name)
+                table.record(instance_type, results[instance_type.name], sum(price) / len(price) if price else None)
+        table.save()
+        print(" ====  fib({0}) runs per hour, per dollar at the average spot price  ====\n".format(args.fib))
+        print("{:<14} {:>5} {:>10} {:>10} {:>10} {:>10} {:>10} {:>9} {:>10}".format(
+            "type", "vcpu", "single", "parallel", "sustained", "MB/s", "$/h", "throttle", "per $"))
+        for name, entry in table.rows():
+            print("{:<14} {:>5} {:>10.0f} {:>10.0f} {:>10.0f} {:>10.0f} {:>10} {:>9} {:>10}".format(
+                name, entry["cpu"], entry["single"], entry["parallel"], entry["last"], entry["bandwidth"],
+                "{:.4f}".format(entry["price"]) if entry["price"] else "-", "yes" if entry["throttled"] else "no",
+                "{:.0f}".format(entry["per_dollar"]) if entry["per_dollar"] else "-"))
+        for name, reason in sorted(benchmark.failed.items()):
+            print("{:<14} failed: {}".format(name, reason))
+
+    if args.command == 'endpoints':
+        vpc_manager = VPCManager(region)
+        vpc_id = args.vpc if args.vpc.startswith('vpc-') else vpc_manager.get_vpc_id(args.vpc)
+        if vpc_id is None:
+            aws_parser.error("no VPC named {0}".format(args.vpc))
+        print(" ====  {0}  ====\n".format(vpc_id))
+        for service, endpoint_id in sorted(vpc_manager.create_endpoints(vpc_id).items()):
+            print("{:<12} {}".format(service, endpoint_id))
+
+    if args.command == 'env':
+        extra = []
+        if args.network:
+            extra += Network(args.network, args.cidr, args.subnets, args.zones, args.tenancy,
+                             not args.no_endpoints).resources()
+        if args.role:
+            # names, not urls: the queues may not exist yet
+            queues = [infra.get(tag).name for tag in (AWSTags.TASKS, AWSTags.REGISTRY) if infra.has(tag)]
+            extra.append(WorkerRoleResource(args.role, region, aws_path_manager.bucket_path.path, queues))
+        start = time.time()
+        plan = infra.plan(*extra, destroy=args.action == 'destroy', workers=args.workers)
+        print(" ====  {0} plan: {1} changes ({2:.1f} s)  ====\n".format(args.action, len(plan.changes),
+                                                                       time.time() - start))
+        for step in plan.steps:
+            print(step)
+        if not args.plan and plan.changes:
+            plan.apply()
+            print("\nApplied in {0:.1f} s".format(time.time() - start))
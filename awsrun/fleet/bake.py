@@ -0,0 +1,94 @@
+import logging
+import time
+
+from fleet.pool import WarmPool
+from fleet.readiness import ReadinessWaiter
+
+
+class ImageBaker:
+    """Bakes a worker AMI `<template>.<version>` with the toolchain preinstalled.
+
+    A builder instance is launched from `base_image` with the setup script (vm/vmsetup.sh)
+    as user data; once it is reachable through SSM and cloud-init is done, the tool
+    versions are read through SSM, the builder is stopped so the snapshot is consistent,
+    and the image is created with the versions as tags. The builder is terminated whatever happens. The launcher must tag
+    its instances differently from the fleet's, so the autoscaler never sees the builder.
+    The finished image is recorded in the launcher's AMIIndex, so the next launch on
+    this machine uses it without listing images."""
+    TEMPLATE = "awsrun:template"
+    VERSION = "awsrun:version"
+    PROBE = ["echo clang=$(PATH=$PATH:/root/opencilk/bin clang --version 2>/dev/null | head -n1)",
+             "echo perf=$(perf --version 2>/dev/null)",
+             "echo python=$(python3 --version 2>&1)",
+             "echo kernel=$(uname -r)",
+             "echo packages=$(pip3 freeze 2>/dev/null | sha1sum | cut -c1-12)"]
+    # EC2 tag values are limited to 256 characters
+    MAX_TAG = 256
+    POLL_INTERVAL = 15
+
+    def __init__(self, launcher, ssm, waiter: ReadinessWaiter, launch, setup_timeout=3600,
+                 poll_interval=POLL_INTERVAL):
+        self._launcher = launcher
+        self._ssm = ssm
+        self._waiter = waiter
+        # keyword arguments of EC2Launcher.launch_instance but the image, count and user data
+        self._launch = launch
+        self._setup_timeout = setup_timeout
+        self._poll_interval = poll_interval
+        self._logger = logging.getLogger(ImageBaker.__name__)
+
+    def _run(self, commands, inst_id, deadline):
+        """Runs commands through SSM and returns their stdout; raises RuntimeError if they fail."""
+        response = self._ssm.run_cmd_on_inst(commands, inst_id)
+        if response is None:
+            raise RuntimeError("Couldn't send {0} to {1}".format(commands[0], inst_id))
+        cmd_id = response["Command"]["CommandId"]
+        sent = time.time()
+        status = "Pending"
+        while status in WarmPool.PENDING:
+            # SSM takes a moment to know a command it has just accepted
+            self._wait(deadline, "{0} on {1}".format(commands[0], inst_id))
+            status = WarmPool.command_status(self._ssm, cmd_id, inst_id, sent)
+        if status != "Success":
+            raise RuntimeError("{0} on {1} ended with {2}".format(commands[0], inst_id, status))
+        return self._ssm.cmd_stdout(cmd_id, inst_id) or ""
+
+    def _wait(self, deadline, what):
+        if time.time() > deadline:
+            raise RuntimeError("Timed out waiting for " + what)
+        time.sleep(self._poll_interval)
+
+    @staticmethod
+    def versions(probe_output):
+        versions = dict()
+        for line in probe_output.splitlines():
+            key, _, value = line.partition("=")
+            if key.strip() and value.strip():
+                versions[key.strip()] = value.strip()[:ImageBaker.MAX_TAG]
+        return versions
+
+    def bake(self, template, base_image, setup_script):
+        """Returns (image id, name, versions)."""
+        version = self._launcher.next_version(template)
+        name = "{0}.{1}".format(template, version)
+        deadline = time.time() + self._setup_timeout
+        builder = self._launcher.launch_instance(img_id=base_image, num_inst=1, userdata=setup_script,
+                                                 **self._launch)[0]
+        self._logger.info("Baking %s on builder %s from %s", name, builder.id, base_image)
+        try:
+            if not list(self._waiter.wait([builder], timeout=max(0, int(deadline - time.time())))):
+                raise RuntimeError("Builder {0} did not get ready: {1}".format(builder.id,
+                                                                             self._waiter.failed[builder.id]))
+            self._run(WarmPool.READY, builder.id, deadline)
+            versions = ImageBaker.versions(self._run(ImageBaker.PROBE, builder.id, deadline))
+            builder.stop()
+            builder.wait_until_stopped()
+            tags = [(ImageBaker.TEMPLATE, template), (ImageBaker.VERSION, str(version)), ("Name", name)]
+            tags += [("awsrun:" + key, value) for key, value in sorted(versions.items())]
+            image_id = self._launcher.create_image(builder.id, name, *tags)
+            self._launcher.wait_for_image(image_id, template, version,
+                                          timeout=max(self._poll_interval, int(deadline - time.time())))
+        finally:
+            builder.terminate()
+        self._logger.info("Baked %s as %s: %s", name, image_id, versions)
+        return image_id, name, versions
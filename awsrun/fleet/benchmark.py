@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import time
+from os import path
+
+from fleet.pool import WarmPool
+from fleet.readiness import ReadinessWaiter
+
+
+class BenchTable:
+    """Measured performance of instance types, persisted so spot placement can use it.
+
+    One entry per type, from fleet/microbench.py: fib runs per hour on one core and on
+    all of them, triad memory bandwidth with every core streaming, and the all-core rate
+    over the first and the last fifth of a sustained run. `last` is what the type
+    delivers once any CPU credits are spent, so throughput and perf per dollar use it."""
+    DEFAULT = path.join(path.expanduser("~"), ".awsrun", "bench.json")
+    # a sustained rate this much below the initial one means the type throttles
+    THROTTLE = 0.1
+
+    def __init__(self, path=DEFAULT):
+        self._path = path
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return dict()
+
+    def save(self):
+        os.makedirs(path.dirname(self._path), exist_ok=True)
+        with open(self._path + ".tmp", "w") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(self._path + ".tmp", self._path)
+
+    def record(self, instance_type, result, price=None):
+        """Stores the microbench.py `result` of an InstanceType at `price` $/h."""
+        cpus = result["cpus"]
+        sustained = result["sustained"]
+        entry = {"cpu": instance_type.cpu, "ram": instance_type.ram, "fib": result["fib"],
+                 "single": 3600 / result["scaling"]["1"], "parallel": 3600 / result["scaling"][str(cpus)],
+                 "bandwidth": result["bandwidth"], "first": sustained["first"], "last": sustained["last"],
+                 "throttled": sustained["last"] < (1 - BenchTable.THROTTLE) * sustained["first"],
+                 "price": price, "time": time.time()}
+        entry["per_dollar"] = entry["last"] / price if price else None
+        self.entries[instance_type.name] = entry
+        return entry
+
+    def speeds(self):
+        """{type name: sustained throughput per vCPU relative to the mean of the table}."""
+        per_core = {name: entry["last"] / entry["cpu"] for name, entry in self.entries.items() if entry["last"] > 0}
+        if not per_core:
+            return dict()
+        mean = sum(per_core.values()) / len(per_core)
+        return {name: rate / mean for name, rate in per_core.items()}
+
+    def rows(self):
+        """Entries best perf per dollar first; unpriced ones last."""
+        return sorted(self.entries.items(), key=lambda item: -(item[1]["per_dollar"] or 0))
+
+
+class TypeBenchmark:
+    """Runs fleet/microbench.py on one instance of each candidate type at once.
+
+    The instances come from the worker AMI, so the toolchain is the one jobs get. Each
+    is sent the benchmark as soon as the ReadinessWaiter yields it; results are polled
+    until all commands are done or `timeout` runs out. Every instance is terminated
+    whatever happens. As with the image builder, the launcher must tag its instances
+    differently from the fleet's."""
+    ROOT = path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
+    # target under the instance's scratch directory -> source in this repository
+    SOURCES = [("fib/fib.c", path.join(ROOT, "test", "fib", "fib.c")),
+               ("cilktool/cilktool.h", path.join(ROOT, "test", "cilktool", "cilktool.h")),
+               ("bench/triad.c", path.join(ROOT, "test", "bench", "triad.c")),
+               ("microbench.py", path.join(ROOT, "awsrun", "fleet", "microbench.py"))]
+    EOF = "AWSRUN_EOF"
+    POLL_INTERVAL = 30
+
+    def __init__(self, launcher, ssm, waiter: ReadinessWaiter, launch, fib=40, sustain=600, timeout=3600,
+                 poll_interval=POLL_INTERVAL):
+        self._launcher = launcher
+        self._ssm = ssm
+        self._waiter = waiter
+        # keyword arguments of EC2Launcher.launch_instance but the type and count
+        self._launch = launch
+        self._fib = fib
+        self._sustain = sustain
+        self._timeout = timeout
+        self._poll_interval = poll_interval
+        # type name -> why it has no result
+        self.failed = dict()
+        self._logger = logging.getLogger(TypeBenchmark.__name__)
+
+    def commands(self):
+        """The shell lines that write the sources to a scratch directory and run the benchmark."""
+        lines = ["set -e", "ROOT=$(mktemp -d)", "mkdir -p $ROOT/fib $ROOT/cilktool $ROOT/bench"]
+        for target, source in TypeBenchmark.SOURCES:
+            with open(source) as f:
+                lines.append("cat > $ROOT/{0} <<'{1}'\n{2}\n{1}".format(target, TypeBenchmark.EOF, f.read().rstrip("\n")))
+        lines.append("python3 $ROOT/microbench.py --root $ROOT --fib {0} --sustain {1}".format(self._fib,
+                                                                                               self._sustain))
+        return lines
+
+    def run(self, instance_types):
+        """{type name: microbench.py result}; types that got none are in `failed`."""
+        self.failed = dict()
+        commands = self.commands()
+        deadline = time.time() + self._timeout
+        # instance id -> (type name, instance)
+        launched = dict()
+        # instance id -> (command id, time sent)
+        sent = dict()
+        results = dict()
+        try:
+            for instance_type in instance_types:
+                instance = self._launcher.launch_instance(instance_type=instance_type, num_inst=1, **self._launch)[0]
+                launched[instance.id] = (instance_type.name, instance)
+            self._logger.info("Benchmarking %s", {name: inst_id for inst_id, (name, _) in launched.items()})
+            for instance in self._waiter.wait([i for _, i in launched.values()],
+                                              timeout=max(0, int(deadline - time.time()))):
+                response = self._ssm.run_cmd_on_inst(commands, instance.id)
+                if response is None:
+                    self.failed[launched[instance.id][0]] = "couldn't send the benchmark"
+                else:
+                    sent[instance.id] = (response["Command"]["CommandId"], time.time())
+            for inst_id, reason in self._waiter.failed.items():
+                self.failed[launched[inst_id][0]] = reason
+            while sent:
+                # also gives SSM a moment to know the commands just sent
+                time.sleep(self._poll_interval)
+                for inst_id, (cmd_id, sent_at) in list(sent.items()):
+                    status = WarmPool.command_status(self._ssm, cmd_id, inst_id, sent_at)
+                    if status in WarmPool.PENDING:
+                        continue
+                    del sent[inst_id]
+                    name = launched[inst_id][0]
+                    try:
+                        if status != "Success":
+                            raise ValueError("benchmark ended with " + status)
+                        results[name] = json.loads((self._ssm.cmd_stdout(cmd_id, inst_id) or "").strip()
+                                                   .splitlines()[-1])
+                        self._logger.info("Benchmarked %s", name)
+                    except (ValueError, IndexError) as e:
+                        self.failed[name] = str(e) or "no output"
+                if sent and time.time() > deadline:
+                    for inst_id in sent:
+                        self.failed[launched[inst_id][0]] = "not done after {0} s".format(self._timeout)
+                    break
+        finally:
+            for _, instance in launched.values():
+                instance.terminate()
+        for name, reason in self.failed.items():
+            self._logger.warning("No benchmark of %s: %s", name, reason)
+        return results
@@ -0,0 +1,227 @@
+import itertools
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from aws.aws_ec2 import EC2Launcher, FleetSnapshot, LaunchProfile
+
+
+class LocalInstance:
+    """Stand-in for a boto3 EC2 Instance: id, state, launch_time, tags, start() and stop().
+
+    A started instance is `pending` for the launcher's boot_seconds before it is
+    `running`; on_start/on_stop let a test bring a local worker up and down with it."""
+
+    def __init__(self, launcher, instance_id, image_id, instance_type, tags):
+        self._launcher = launcher
+        self.id = instance_id
+        self.image_id = image_id
+        self.instance_type = instance_type
+        self.tags = tags
+        self.launch_time = datetime.now(timezone.utc)
+        self.instance_lifecycle = None
+        self._state = "pending"
+
+    @property
+    def state(self):
+        with self._launcher.lock:
+            if self._state == "pending" and time.time() - self.launch_time.timestamp() >= self._launcher.boot_seconds:
+                self._state = "running"
+            return {"Name": self._state}
+
+    def start(self):
+        with self._launcher.lock:
+            if self._state != "stopped":
+                return
+            self._state = "pending"
+            self.launch_time = datetime.now(timezone.utc)
+        self._launcher.started(self)
+
+    def stop(self):
+        with self._launcher.lock:
+            if self._state not in ("pending", "running"):
+                return
+            self._state = "stopped"
+        self._launcher.stopped(self)
+
+    def terminate(self):
+        with self._launcher.lock:
+            was = self._state
+            self._state = "terminated"
+        if was in ("pending", "running"):
+            self._launcher.stopped(self)
+
+    def reload(self):
+        pass
+
+    def wait_until_stopped(self):
+        pass
+
+
+class LocalLauncher:
+    """In-process stand-in for EC2Launcher with the calls the fleet code makes."""
+
+    def __init__(self, type_tag, boot_seconds=0.0, on_start=None, on_stop=None):
+        self._type_tag = type_tag
+        self.boot_seconds = boot_seconds
+        self._on_start = on_start
+        self._on_stop = on_stop
+        self._instances = []
+        # describe_images entries: {'Name': ..., 'ImageId': ...}
+        self.images = []
+        self._ids = itertools.count()
+        self.lock = threading.RLock()
+        # create_instances calls
+        self.launches = 0
+
+    def started(self, instance: LocalInstance):
+        if self._on_start:
+            self._on_start(instance)
+
+    def stopped(self, instance: LocalInstance):
+        if self._on_stop:
+            self._on_stop(instance)
+
+    def launch_instance(self, key_name, sg_id, subnet_id, img_id, instance_type, num_inst, userdata='',
+                        spot=False, max_price=None, profile=None):
+        if profile is not None:
+            profile.request(instance_type)
+        with self.lock:
+            self.launches += 1
+            instances = [LocalInstance(self, "i-{0:017x}".format(next(self._ids)), img_id,
+                                       getattr(instance_type, "name", instance_type),
+                                       [{'Key': self._type_tag[0], 'Value': self._type_tag[1]}])
+                         for _ in range(num_inst)]
+            for instance in instances:
+                instance.subnet_id = subnet_id
+                instance.instance_lifecycle = 'spot' if spot else None
+                if profile is not None:
+                    instance.tags.append({'Key': LaunchProfile.TAG, 'Value': profile.name})
+            self._instances.extend(instances)
+        for instance in instances:
+            self.started(instance)
+        return instances
+
+    def register_image(self, name, tags=()):
+        image_id = "ami-{0}".format(uuid.uuid4().hex[:17])
+        self.images.append({'Name': name, 'ImageId': image_id,
+                            'Tags': [{'Key': key, 'Value': value} for key, value in tags]})
+        return image_id
+
+    def get_ami(self, template_name, refresh=False):
+        return EC2Launcher.latest_image(self.images, template_name)
+
+    def next_version(self, template_name):
+        try:
+            return EC2Launcher.latest_image(self.images, template_name)[1] + 1
+        except KeyError:
+            return 1
+
+    def create_image(self, inst_id, name, *tags: tuple):
+        return self.register_image(name, tags)
+
+    def wait_for_image(self, image_id, template_name, version, timeout=3600):
+        return next(image for image in self.images if image['ImageId'] == image_id)
+
+    def tag_instance(self, inst_id, *tags: tuple):
+        instance = self.get_instance(inst_id)
+        with self.lock:
+            keys = [t[0] for t in tags]
+            instance.tags = [t for t in instance.tags if t['Key'] not in keys] + \
+                            [{'Key': key, 'Value': value} for key, value in tags]
+
+    def untag_instance(self, inst_id, *keys):
+        instance = self.get_instance(inst_id)
+        with self.lock:
+            instance.tags = [t for t in instance.tags if t['Key'] not in keys]
+
+    def get_instances(self, inst_ids):
+        with self.lock:
+            return [i for i in self._instances if i.id in inst_ids]
+
+    def get_instance(self, inst_id):
+        instances = self.get_instances([inst_id])
+        return instances[0] if instances else None
+
+    def all_instances(self):
+        with self.lock:
+            return list(self._instances)
+
+
+class LocalInstanceUtility:
+    """Stand-in for EC2InstanceUtility.snapshot(): status checks pass once an instance has
+    been running for check_seconds."""
+
+    def __init__(self, launcher: LocalLauncher, check_seconds=0.0):
+        self._launcher = launcher
+        self._check_seconds = check_seconds
+        # snapshots taken, i.e. describe_instance_status sweeps
+        self.sweeps = 0
+
+    def snapshot(self, refresh=False):
+        self.sweeps += 1
+        now = time.time()
+        statuses = dict()
+        for instance in self._launcher.all_instances():
+            state = instance.state['Name']
+            check = 'passed' if state == "running" and now - instance.launch_time.timestamp() >= self._check_seconds \
+                else 'initializing'
+            details = {'Status': 'ok' if check == 'passed' else 'initializing',
+                       'Details': [{'Name': 'reachability', 'Status': check}]}
+            statuses[instance.id] = {'InstanceId': instance.id, 'InstanceState': {'Name': state},
+                                     'InstanceStatus': details, 'SystemStatus': details}
+        return FleetSnapshot(statuses, now)
+
+
+class LocalSSM:
+    """Stand-in for the SSMHandler calls: agents register once their instance has been
+    running for register_seconds, and a command succeeds once it has been running for
+    setup_seconds, the way `cloud-init status --wait` returns once the user data is done.
+    Like SSM right after send_command, the first poll of a command finds no invocation."""
+
+    def __init__(self, launcher: LocalLauncher, setup_seconds=0.0, stdout="", register_seconds=0.0):
+        self._launcher = launcher
+        self._setup_seconds = setup_seconds
+        self._stdout = stdout
+        self._register_seconds = register_seconds
+        self._commands = dict()
+        # commands whose invocation SSM knows by now
+        self._known = set()
+
+    def instance_information(self):
+        now = time.time()
+        return [{'InstanceId': i.id, 'PingStatus': 'Online'} for i in self._launcher.all_instances()
+                if i.state['Name'] == "running" and now - i.launch_time.timestamp() >= self._register_seconds]
+
+    def run_cmd_on_inst(self, cmd_list, inst_id):
+        instance = self._launcher.get_instance(inst_id)
+        if instance is None or instance.state['Name'] != "running":
+            return None
+        cmd_id = str(uuid.uuid4())
+        self._commands[cmd_id] = instance
+        return {"Command": {"CommandId": cmd_id, "InstanceIds": [inst_id]}}
+
+    def _status(self, cmd_id):
+        instance = self._commands[cmd_id]
+        if instance.state['Name'] != "running":
+            return "Failed"
+        if time.time() - instance.launch_time.timestamp() < self._setup_seconds:
+            return "InProgress"
+        return "Success"
+
+    def invocation_status(self, cmd_id, inst_id):
+        if cmd_id not in self._commands:
+            return None
+        if cmd_id not in self._known:
+            self._known.add(cmd_id)
+            return None
+        return self._status(cmd_id)
+
+    def cmd_status(self, cmd_id, inst_id):
+        # SSMHandler.cmd_status reports InvocationDoesNotExist as a failure
+        status = self.invocation_status(cmd_id, inst_id)
+        return "Failed" if status is None else status
+
+    def cmd_stdout(self, cmd_id, inst_id):
+        return self._stdout if cmd_id in self._known and self._status(cmd_id) == "Success" else None
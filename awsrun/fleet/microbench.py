@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Microbenchmarks run on a candidate instance; prints one JSON line.
+
+Not imported by awsrun: TypeBenchmark ships this file, test/fib and test/bench to the
+instance through SSM and reads the line back. Python 3 standard library only."""
+import argparse
+import json
+import os
+import subprocess
+import time
+
+
+def build(compiler, source, output, *flags):
+    subprocess.run([compiler, "-O3", "-o", output, source] + list(flags), check=True)
+    return output
+
+
+def timed(cmd, workers=None):
+    env = dict(os.environ)
+    if workers is not None:
+        env["CILK_NWORKERS"] = str(workers)
+    start = time.perf_counter()
+    subprocess.run(cmd, env=env, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def scaling(fib, n, cpus):
+    """Seconds of fib(n) at 1, 2, 4, ... workers and at one worker per CPU."""
+    workers, counts = 1, []
+    while workers < cpus:
+        counts.append(workers)
+        workers *= 2
+    counts.append(cpus)
+    return {str(count): timed([fib, str(n)], count) for count in counts}
+
+
+def bandwidth(triad, copies, size):
+    """Aggregate triad MB/s with one copy per CPU, i.e. what concurrent jobs share."""
+    procs = [subprocess.Popen([triad, str(size)], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+             for _ in range(copies)]
+    return sum(float(proc.communicate()[0]) for proc in procs)
+
+
+def sustained(fib, n, cpus, seconds):
+    """fib(n) runs per hour with every CPU busy, over the first and the last fifth of
+    `seconds`; burstable types that run out of CPU credits fall off between the two."""
+    runs = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        runs.append((time.perf_counter() - start, timed([fib, str(n)], cpus)))
+    window = seconds / 5
+
+    def rate(runs):
+        return 3600 * len(runs) / sum(duration for _, duration in runs) if runs else 0.0
+
+    return {"first": rate([r for r in runs if r[0] < window]),
+            "last": rate([r for r in runs if r[0] >= seconds - window]), "runs": len(runs)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks this instance for awsrun')
+    parser.add_argument('--root', type=str, default=os.path.dirname(os.path.abspath(__file__)),
+                        help='directory holding fib/, cilktool/ and bench/')
+    parser.add_argument('--clang', type=str, default='/root/opencilk/bin/clang', help='OpenCilk clang')
+    parser.add_argument('--fib', type=int, default=40, help='fib argument of a run')
+    parser.add_argument('--sustain', type=int, default=600, help='seconds of full load')
+    parser.add_argument('--triad-size', type=int, default=1 << 22, help='doubles per triad array')
+    args = parser.parse_args()
+
+    cpus = os.cpu_count()
+    fib = build(args.clang, os.path.join(args.root, "fib", "fib.c"), os.path.join(args.root, "fib", "fib"),
+                "-fopencilk")
+    triad = build(args.clang, os.path.join(args.root, "bench", "triad.c"), os.path.join(args.root, "bench", "triad"))
+    timed([fib, "20"], cpus)
+
+    print(json.dumps({"cpus": cpus, "fib": args.fib, "scaling": scaling(fib, args.fib, cpus),
+                      "bandwidth": bandwidth(triad, cpus, args.triad_size),
+                      "sustained": sustained(fib, args.fib, cpus, args.sustain)}, separators=(',', ':')))
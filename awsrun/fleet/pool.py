@@ -0,0 +1,169 @@
+import logging
+import threading
+import time
+
+from aws.aws_ec2 import EC2InstanceUtility
+
+
+class WarmPool:
+    """Keeps `size` provisioned workers stopped, so scaling out is a start, not a first boot."""
+    TAG = "awsrun-pool"
+    WARMING = "warming"
+    READY = ["cloud-init status --wait"]
+    # SSM command states that are not final yet
+    PENDING = ("Pending", "InProgress", "Delayed")
+    # seconds SSM may answer InvocationDoesNotExist for a command it has just accepted
+    UNKNOWN_GRACE = 30
+
+    def __init__(self, launcher, ssm, size, template, launch, setup_timeout=1800):
+        self._launcher = launcher
+        self._ssm = ssm
+        self._size = size
+        self._template = template
+        # keyword arguments of EC2Launcher.launch_instance but the image and count
+        self._launch = launch
+        self._setup_timeout = setup_timeout
+        self._image = None
+        # instance id -> (readiness command id, time sent)
+        self._checks = dict()
+        self._thread = None
+        self._done = threading.Event()
+        self.lock = threading.RLock()
+        self._logger = logging.getLogger(WarmPool.__name__)
+
+    @staticmethod
+    def command_status(ssm, cmd_id, inst_id, sent, grace=UNKNOWN_GRACE):
+        """SSM status of a command sent at `sent`; "Pending" while SSM doesn't know it yet, up to `grace` s."""
+        status = ssm.invocation_status(cmd_id, inst_id)
+        if status is None:
+            return "Pending" if time.time() - sent < grace else "Failed"
+        return status
+
+    @staticmethod
+    def warming(instance):
+        return EC2InstanceUtility.get_tag_value(instance, WarmPool.TAG) == WarmPool.WARMING
+
+    @staticmethod
+    def _state(instance):
+        return instance.state['Name']
+
+    @property
+    def image_id(self):
+        if self._image is None:
+            self._image = self._launcher.get_ami(self._template)[0]['ImageId']
+        return self._image
+
+    def _refresh_image(self):
+        image = self._launcher.get_ami(self._template)[0]['ImageId']
+        if self._image is not None and image != self._image:
+            self._logger.info("Worker image changed from %s to %s", self._image, image)
+        self._image = image
+        return image
+
+    def launch(self, count, warming=False):
+        """Launches `count` workers from the current image; warming ones join the pool once provisioned."""
+        with self.lock:
+            instances = self._launcher.launch_instance(img_id=self.image_id, num_inst=count, **self._launch)
+            if warming:
+                for instance in instances:
+                    self._launcher.tag_instance(instance.id, (WarmPool.TAG, WarmPool.WARMING))
+        return instances
+
+    def warm(self, instances=None):
+        """Stopped, provisioned workers built from the current image."""
+        instances = self._launcher.all_instances() if instances is None else instances
+        return [i for i in instances if WarmPool._state(i) == "stopped" and not WarmPool.warming(i)
+                and i.image_id == self.image_id]
+
+    def take(self, count):
+        """Starts up to `count` warm workers; returns them."""
+        with self.lock:
+            taken = self.warm()[:count]
+            for instance in taken:
+                instance.start()
+        if taken:
+            self._logger.info("Started %s warm workers: %s", len(taken), [i.id for i in taken])
+        return taken
+
+    def _terminate(self, instance, reason):
+        self._logger.info("Terminating %s: %s", instance.id, reason)
+        self._checks.pop(instance.id, None)
+        instance.terminate()
+
+    def _provision(self, instance, now):
+        """Moves a warming instance along; returns False once it has left the pool for good."""
+        state = WarmPool._state(instance)
+        if state in ("shutting-down", "terminated"):
+            self._checks.pop(instance.id, None)
+            return False
+        if now - instance.launch_time.timestamp() > self._setup_timeout:
+            self._terminate(instance, "not provisioned after {0} s".format(self._setup_timeout))
+            return False
+        if state != "running":
+            return True
+        if instance.id not in self._checks:
+            # None until the SSM agent of the new instance has registered
+            response = self._ssm.run_cmd_on_inst(WarmPool.READY, instance.id)
+            if response is not None:
+                self._checks[instance.id] = (response["Command"]["CommandId"], time.time())
+            return True
+        cmd_id, sent = self._checks[instance.id]
+        status = WarmPool.command_status(self._ssm, cmd_id, instance.id, sent)
+        if status in WarmPool.PENDING:
+            return True
+        if status != "Success":
+            self._terminate(instance, "provisioning ended with {0}".format(status))
+            return False
+        del self._checks[instance.id]
+        instance.stop()
+        self._launcher.untag_instance(instance.id, WarmPool.TAG)
+        self._logger.info("Worker %s is provisioned and warm", instance.id)
+        return True
+
+    def replenish(self, now=None):
+        """One pass: provision, refresh and top up the pool; returns counts of what it did."""
+        now = time.time() if now is None else now
+        with self.lock:
+            image = self._refresh_image()
+            instances = self._launcher.all_instances()
+            warming = [i for i in instances if WarmPool.warming(i) and self._provision(i, now)]
+            # warming instances may have just been stopped and untagged
+            instances = self._launcher.all_instances()
+            pooled = [i for i in instances if WarmPool._state(i) in ("stopping", "stopped")
+                      and not WarmPool.warming(i)]
+            outdated = [i for i in pooled if WarmPool._state(i) == "stopped" and i.image_id != image]
+            for instance in outdated:
+                self._terminate(instance, "built from an older image")
+            current = [i for i in pooled if i.image_id == image]
+            warming = [i for i in instances if WarmPool.warming(i)
+                       and WarmPool._state(i) not in ("shutting-down", "terminated")]
+            surplus = [i for i in current if WarmPool._state(i) == "stopped"][:max(0, len(current) - self._size)]
+            for instance in surplus:
+                self._terminate(instance, "warm pool is full")
+            deficit = self._size - (len(current) - len(surplus)) - len(warming)
+            if deficit > 0:
+                launched = self.launch(deficit, warming=True)
+                self._logger.info("Launched %s workers into the warm pool: %s", len(launched),
+                                  [i.id for i in launched])
+        return {"warm": len(current) - len(surplus), "warming": len(warming) + max(0, deficit),
+                "outdated": len(outdated), "surplus": len(surplus), "launched": max(0, deficit)}
+
+    def _serve(self, interval):
+        while not self._done.is_set():
+            try:
+                self.replenish()
+            except Exception:
+                self._logger.exception("Warm pool pass failed")
+            self._done.wait(interval)
+
+    def start(self, interval=60):
+        self._done.clear()
+        self._thread = threading.Thread(target=self._serve, args=(interval,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
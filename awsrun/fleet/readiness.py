@@ -0,0 +1,67 @@
+import logging
+import time
+
+from aws.aws_ec2 import EC2InstanceUtility, InstanceState
+
+
+class ReadinessWaiter:
+    """Waits for many instances at once and yields each the moment it is usable; the ones
+    that never get there land in `failed` with the reason."""
+    BACKOFF = 1.5
+    GONE = (InstanceState.status(InstanceState.SHUTTING), InstanceState.status(InstanceState.TERMINATED),
+            InstanceState.status(InstanceState.STOPPING), InstanceState.status(InstanceState.STOPPED))
+
+    def __init__(self, ec2: EC2InstanceUtility, ssm=None, min_interval=2.0, max_interval=15.0):
+        self._ec2 = ec2
+        self._ssm = ssm
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        # instance id -> why it never got ready
+        self.failed = dict()
+        self._logger = logging.getLogger(ReadinessWaiter.__name__)
+
+    def _online(self):
+        return {info['InstanceId'] for info in self._ssm.instance_information() if info.get('PingStatus') == 'Online'}
+
+    def poll(self, inst_ids):
+        """One round: (ready ids, {failed id: reason})."""
+        snapshot = self._ec2.snapshot(refresh=True)
+        passed, failed = [], dict()
+        for inst_id in inst_ids:
+            state = snapshot.state(inst_id)
+            checks = (snapshot.check(inst_id), snapshot.system_check(inst_id))
+            if state in ReadinessWaiter.GONE:
+                failed[inst_id] = "instance is " + state
+            elif 'failed' in checks:
+                failed[inst_id] = "status check failed"
+            elif state == InstanceState.status(InstanceState.RUNNING) and checks == ('passed', 'passed'):
+                passed.append(inst_id)
+        if passed and self._ssm is not None:
+            online = self._online()
+            passed = [inst_id for inst_id in passed if inst_id in online]
+        return passed, failed
+
+    def wait(self, instances, timeout=900):
+        """Yields the instances in the order they get ready."""
+        pending = {instance.id: instance for instance in instances}
+        self.failed = dict()
+        deadline = time.time() + timeout
+        interval = self._min_interval
+        while pending:
+            ready, failed = self.poll(list(pending))
+            for inst_id, reason in failed.items():
+                self._logger.warning("Instance %s will not get ready: %s", inst_id, reason)
+                self.failed[inst_id] = reason
+                del pending[inst_id]
+            for inst_id in ready:
+                yield pending.pop(inst_id)
+            if not pending:
+                break
+            now = time.time()
+            if now >= deadline:
+                for inst_id in pending:
+                    self.failed[inst_id] = "not ready after {0} s".format(timeout)
+                self._logger.warning("Gave up waiting for %s", list(pending))
+                break
+            interval = self._min_interval if ready else min(self._max_interval, interval * ReadinessWaiter.BACKOFF)
+            time.sleep(min(interval, deadline - now))
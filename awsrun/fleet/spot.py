@@ -0,0 +1,49 @@
+import logging
+import time
+
+from aws.aws_ec2 import SpotMarket
+
+
+class SpotPlacement:
+    """Launches workers as spot instances of the cheapest type and zone for a job shape.
+
+    `ratio` is the `cores:GB` a job needs; among the candidate types and the zones of
+    `subnets`, the one with the lowest average spot price per job that fits (over the
+    last `hours`) wins. The choice is reconsidered every `refresh` seconds, and each
+    launch falls back to on-demand capacity of the same type when spot has none. With
+    `speeds` from a BenchTable, the price per job is weighed by how fast each type's
+    cores actually are instead of assuming all vCPUs are equal."""
+
+    def __init__(self, market: SpotMarket, ratio, candidates, subnets, refresh=3600, hours=24, max_price=None,
+                 speeds=None):
+        self._market = market
+        self._ratio = ratio
+        self._candidates = candidates
+        self._subnets = subnets
+        self._refresh = refresh
+        self._hours = hours
+        self._max_price = max_price
+        self._speeds = speeds
+        self._choice = None
+        self._chosen = None
+        self._logger = logging.getLogger(SpotPlacement.__name__)
+
+    def choose(self, now=None):
+        """(InstanceType with its zone and average price, subnet id)."""
+        now = time.time() if now is None else now
+        if self._choice is None or now - self._chosen > self._refresh:
+            zones = self._market.zones(self._subnets)
+            book = self._market.prices(self._market.instance_types(self._candidates), list(zones), self._hours)
+            cheapest = SpotMarket.cheapest(book, self._ratio, self._speeds)
+            if cheapest is None:
+                raise RuntimeError("None of {0} fits a {1} job".format(", ".join(self._candidates), self._ratio))
+            self._choice, self._chosen = (cheapest, zones[cheapest.zone]), now
+            self._logger.info("Cheapest for %s: %s in %s at $%.4f/h (%.4f per job)", self._ratio, cheapest.name,
+                              cheapest.zone, cheapest.avg_price, cheapest.metric_cost)
+        return self._choice
+
+    def launch(self, launcher, num_inst, **launch):
+        """EC2Launcher.launch_instance with the chosen type and subnet in place of the given ones."""
+        instance_type, subnet_id = self.choose()
+        launch = dict(launch, instance_type=instance_type, subnet_id=subnet_id)
+        return launcher.launch_instance(num_inst=num_inst, spot=True, max_price=self._max_price, **launch)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+import argparse
+from os import path
+import sys
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from common.resources import JsonLoader
+from common.configuration import AWSPathManager, AWSInfra
+from submit.datasets import DatasetRegistry
+
+
+if __name__ == '__main__':
+    aws_parser = argparse.ArgumentParser(description='Registers datasets your awsrun submissions can reference',
+                                         epilog='Enjoy the program! :)')
+    # aws config
+    awscfg = aws_parser.add_mutually_exclusive_group(required=True)
+
+    awscfg.add_argument('--configurl',
+                        action='store_const',
+                        const="https://raw.githubusercontent.com/eec-ucd/eec289/main/config.aws",
+                        help='configuration url for the aws server')
+
+    awscfg.add_argument('--configfile',
+                        action='store_const',
+                        const='config.aws',
+                        help='configuration file for the aws server')
+
+    commands = aws_parser.add_subparsers(dest='command', required=True)
+
+    register = commands.add_parser('register', help='upload a file or folder as a new dataset version')
+    register.add_argument('name', type=str, help='dataset name')
+    register.add_argument('path', type=str, help='file or folder to upload')
+    register.add_argument('--version',
+                          type=str,
+                          default=None,
+                          help='version label (default: content hash)')
+
+    listing = commands.add_parser('list', help='list datasets, or the versions of one')
+    listing.add_argument('name', type=str, nargs='?', default=None, help='dataset name')
+
+    args = aws_parser.parse_args()
+
+    if args.configurl:
+        data = JsonLoader.load_url(args.configurl)
+
+    if args.configfile:
+        data = JsonLoader.load_file(args.configfile)
+
+    registry = DatasetRegistry(AWSPathManager(AWSInfra.load(data)))
+
+    if args.command == 'register':
+        ref = registry.register(args.name, args.path, args.version)
+        print("Use it with: awsrun.py --dataset {0} ... (files appear under {1}/)".format(ref, ref.mount))
+    elif args.name:
+        print(" ====  {0}  ====\n".format(args.name))
+        for version, modified, size in registry.versions(args.name):
+            print("{:<16} {:%Y-%m-%d %H:%M} {:>12,} bytes".format(version, modified, size))
+    else:
+        for name in registry.datasets():
+            print(name)
@@ -8,8 +8,13 @@ sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
 
 from common.resources import JsonLoader
 from common.configuration import CmdConfig, WSConfig, AWSPathManager, AWSInfra
-from common.protocol import IOTask
+from common.protocol import IOTask, IOBatch
 from submit.tasks import AWSIssuer
+from submit.history import PerfHistory
+from submit.suite import SuiteManifest
+from submit.datasets import DatasetRegistry
+from submit.modes import ScalingMode, CilkscaleMode, PerfStatMode, ProfileMode, BenchmarkMode, ResourcesMode, \
+    BuildMode
 
 
 class CoreRange:
@@ -40,6 +45,28 @@ class CoreRange:
         return value
 
 
+class WorkerCounts:
+    def __init__(self, core_range: CoreRange):
+        self.imax = core_range.imax
+
+    def __call__(self, arg):
+        try:
+            values = list(map(int, filter(None, arg.split(','))))
+        except ValueError:
+            raise argparse.ArgumentTypeError("Must be a comma separated list of integers")
+
+        if not values or any(map(lambda v: v <= 0, values)):
+            raise argparse.ArgumentTypeError("Worker counts can only be positive")
+
+        if max(values) > self.imax:
+            raise argparse.ArgumentTypeError(f"Worker counts must be <= {self.imax}")
+
+        if 1 not in values:
+            raise argparse.ArgumentTypeError("The sweep needs 1 worker as its serial baseline")
+
+        return values
+
+
 if __name__ == '__main__':
     aws_parser = argparse.ArgumentParser(description='Runs your program on AWS',
                                          epilog='Enjoy the program! :)')
@@ -76,10 +103,48 @@ if __name__ == '__main__':
                             default="",
                             help='performance')
 
+    core_range = CoreRange(1, 8)
     aws_parser.add_argument('--core',
-                            type=CoreRange(1, 8),
+                            type=core_range,
                             default=1,
                             help='is this a multicore run')
+
+    aws_parser.add_argument('--scaling',
+                            type=WorkerCounts(core_range),
+                            default=None,
+                            help='strong-scaling sweep over CILK_NWORKERS, e.g. 1,2,4,8')
+
+    aws_parser.add_argument('--cilkscale',
+                            action='store_true',
+                            help='collect work/span analysis (binary built with CILKSCALE=1)')
+
+    aws_parser.add_argument('--perf-events',
+                            type=lambda s: list(filter(None, s.split(','))),
+                            default=None,
+                            help='hardware counters for perf stat, e.g. cycles,instructions,cache-misses')
+
+    aws_parser.add_argument('--profile',
+                            type=int,
+                            nargs='?',
+                            const=20,
+                            default=None,
+                            help='sample with perf record and report the top N hot functions (default 20)')
+
+    aws_parser.add_argument('--build',
+                            type=str,
+                            nargs='?',
+                            const='',
+                            default=None,
+                            help='ship sources and build them on the worker with make [target] before running')
+
+    aws_parser.add_argument('--build-dir',
+                            type=str,
+                            default='.',
+                            help='folder holding the Makefile for --build')
+
+    aws_parser.add_argument('--benchmark',
+                            action='store_true',
+                            help='run on isolated cores and report a noise estimate')
     # workspace config
     aws_parser.add_argument('--prefix',
                             type=str,
@@ -91,31 +156,108 @@ if __name__ == '__main__':
                             default="",
                             help='environment variables')
 
+    aws_parser.add_argument('--dataset',
+                            type=str,
+                            action='append',
+                            default=[],
+                            help='registered dataset (name or name@version) linked under datasets/<name>; repeatable')
+
+    aws_parser.add_argument('--history',
+                            type=str,
+                            default=PerfHistory.DEFAULT,
+                            help='performance history file ("" to disable)')
+
     # task config
-    aws_parser.add_argument('--cmd',
-                            nargs='+',
-                            required=True,
-                            help='command to run (executable with arguments)')
+    taskcfg = aws_parser.add_mutually_exclusive_group(required=True)
+
+    taskcfg.add_argument('--cmd',
+                         nargs='+',
+                         action='append',
+                         help='command to run (executable with arguments); repeat to batch several commands')
+
+    taskcfg.add_argument('--suite',
+                         type=str,
+                         help='JSON manifest of tests with expected outputs, run in parallel on the worker')
+
+    aws_parser.add_argument('--concurrent',
+                            action='store_true',
+                            help='run batched commands concurrently, each on its own --core cores')
 
     args = aws_parser.parse_args()
 
+    if args.suite:
+        try:
+            args.suite = SuiteManifest.load(args.suite)
+        except (OSError, ValueError, RuntimeError) as e:
+            aws_parser.error(str(e))
+
+    if (args.suite or len(args.cmd) > 1) and (args.scaling or args.cilkscale or args.perf_events or args.profile
+                                              or args.build is not None):
+        aws_parser.error("--scaling, --cilkscale, --perf-events, --profile and --build take a single --cmd")
+
     if args.configurl:
         data = JsonLoader.load_url(args.configurl)
 
     if args.configfile:
         data = JsonLoader.load_file(args.configfile)
 
+    modes = []
+    cores = args.core
+    timeout = args.timeout
+    if args.scaling:
+        modes.append(ScalingMode(args.scaling))
+        cores = core_range.imax if max(args.scaling) > core_range.imin else core_range.imin
+        # the timeout applies to every run of the sweep
+        timeout = args.timeout * len(args.scaling)
+    if args.cilkscale:
+        modes.append(CilkscaleMode(args.scaling if args.scaling else [1, 2, 4, core_range.imax]))
+    if args.perf_events:
+        modes.append(PerfStatMode(args.perf_events))
+    if args.profile:
+        modes.append(ProfileMode(args.profile))
+    if args.benchmark:
+        modes.append(BenchmarkMode())
+    # always requested; the report is skipped for workers that don't produce it
+    modes.append(ResourcesMode())
+    if args.build is not None:
+        # outermost, so the build runs once and before any other wrapper
+        modes.append(BuildMode(args.build, args.build_dir))
+
+    shells = [reduce(list.__add__, map(lambda s: s.split(' '), cmd)) for cmd in args.cmd] if args.cmd else []
+    # a batch has no single command to compare runs of
+    record = PerfHistory(args.history).track(shells[0], cores) if args.history and len(shells) == 1 else None
+    for mode in filter(lambda m: isinstance(m, BuildMode), modes):
+        shells = list(map(mode.locate, shells))
+    for mode in modes:
+        shells = list(map(mode.wrap, shells))
+
     aws_path_manager = AWSPathManager(AWSInfra.load(data))
-    cmd_config = CmdConfig.new(cmd=reduce(list.__add__, map(lambda s: s.split(' '), args.cmd)),
-                               timeout=args.timeout,
-                               cores=args.core,
-                               depfile=args.deps,
-                               env=list(filter(None, args.env.split(';'))))
+    try:
+        datasets = list(map(DatasetRegistry(aws_path_manager).resolve, args.dataset))
+    except RuntimeError as e:
+        aws_parser.error(str(e))
+    env = list(filter(None, args.env.split(';'))) + sum(map(lambda m: m.env, modes), [])
+    cmd_configs = [CmdConfig.new(cmd=shell,
+                                 timeout=timeout,
+                                 cores=cores,
+                                 depfile=args.deps,
+                                 env=env,
+                                 datasets=datasets)
+                   for shell in shells]
 
     ws_config = WSConfig.new(args.prefix)
 
-    issuer = AWSIssuer(aws_path_manager)
+    issuer = AWSIssuer(aws_path_manager, *modes, record=record)
 
-    task = IOTask.new(cmd_config, ws_config, args.workfolder, args.perf)
+    artifacts = sum(map(lambda m: m.artifacts, modes), [])
+    if args.suite:
+        # the tests are packed onto every core a task can ask for
+        task = args.suite.task(ws_config, args.workfolder, timeout, core_range.imax, args.deps, env, artifacts,
+                               benchmark=args.benchmark, datasets=datasets)
+    elif len(cmd_configs) == 1:
+        task = IOTask.new(cmd_configs[0], ws_config, args.workfolder, args.perf, artifacts, benchmark=args.benchmark)
+    else:
+        task = IOBatch.new(cmd_configs, ws_config, args.workfolder, args.perf, artifacts, benchmark=args.benchmark,
+                           concurrent=args.concurrent)
 
     issuer.issue(task)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import argparse
+import statistics
+from os import path
+import sys
+from functools import reduce
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from submit.history import PerfHistory
+
+
+def select(trend, prefix, default):
+    if not prefix:
+        return default
+    matches = [entry for entry in trend if entry[0] and entry[0].startswith(prefix)]
+    if not matches:
+        raise SystemExit("No submission with bundle {} in the history".format(prefix))
+    return matches[-1]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares your submissions recorded by awsrun',
+                                     epilog='Enjoy the program! :)')
+
+    parser.add_argument('--history',
+                        type=str,
+                        default=PerfHistory.DEFAULT,
+                        help='performance history file')
+
+    parser.add_argument('--metric',
+                        type=str,
+                        default='resources.wall_seconds',
+                        help='metric to compare, e.g. scaling.seconds.p8 or perf.ipc; the default is the run time '
+                             'the worker measured, turnaround also counts the queue wait and transfers')
+
+    parser.add_argument('--core',
+                        type=int,
+                        default=None,
+                        help='only submissions with this many cores')
+
+    parser.add_argument('--baseline',
+                        type=str,
+                        default=None,
+                        help='bundle hash (prefix) to compare against; defaults to the previous bundle')
+
+    parser.add_argument('--candidate',
+                        type=str,
+                        default=None,
+                        help='bundle hash (prefix) to evaluate; defaults to the latest bundle')
+
+    parser.add_argument('--alpha',
+                        type=float,
+                        default=0.05,
+                        help='significance level')
+
+    parser.add_argument('--cmd',
+                        nargs='+',
+                        required=True,
+                        help='command as it was submitted (executable with arguments)')
+
+    args = parser.parse_args()
+
+    history = PerfHistory(args.history)
+    runs = history.runs(reduce(list.__add__, map(lambda s: s.split(' '), args.cmd)), args.core)
+    trend = PerfHistory.trend(runs, args.metric)
+    if not trend:
+        raise SystemExit("No recorded '{}' for this command".format(args.metric))
+
+    print(" ====   TREND ({})   ====\n".format(args.metric))
+    print("{:<10} {:<20} {:>4} {:>14} {:>14}".format("bundle", "first seen", "n", "median", "min"))
+    for bundle, first, samples in trend:
+        print("{:<10} {:<20} {:>4} {:>14.6g} {:>14.6g}".format((bundle or "-")[:8], first, len(samples),
+                                                               statistics.median(samples), min(samples)))
+    print()
+
+    candidate = select(trend, args.candidate, trend[-1])
+    earlier = [entry for entry in trend if entry is not candidate]
+    baseline = select(trend, args.baseline, earlier[-1] if earlier else None)
+    if baseline is None:
+        raise SystemExit("Only one bundle recorded; nothing to compare against")
+
+    change, p, verdict = PerfHistory.compare(baseline[2], candidate[2], args.metric, args.alpha)
+    print(" ====   COMPARE   ====\n")
+    print("baseline  {} (n={})".format((baseline[0] or "-")[:8], len(baseline[2])))
+    print("candidate {} (n={})".format((candidate[0] or "-")[:8], len(candidate[2])))
+    print("median change {:+.2f}%, Mann-Whitney p = {:.4f}: {}".format(100 * change, p, verdict))
+    if min(len(baseline[2]), len(candidate[2])) < 3:
+        print("(fewer than 3 runs on one side; resubmit to gain statistical power)")
@@ -0,0 +1,66 @@
+import os
+import tempfile
+
+from aws import S3Handler
+from common.commands import Compress, Upload
+from common.configuration import AWSPathManager, DatasetRef
+from common.resources import File, Folder, S3Path
+from submit.history import PerfHistory
+
+
+class DatasetRegistry:
+    """Datasets uploaded once to the bucket and referenced by name from later submissions.
+
+    A version is immutable; by default it is named after the content hash, so registering
+    unchanged data again uploads nothing. Workers keep extracted versions in a read-only
+    cache and link them into the task workspace under datasets/<name>."""
+
+    def __init__(self, aws_path_manager: AWSPathManager):
+        self._aws_path_manager = aws_path_manager
+        self._s3 = S3Handler(aws_path_manager.server_path.path)
+
+    @property
+    def _bucket(self):
+        return self._aws_path_manager.bucket_path.path
+
+    def versions(self, name):
+        """[(version, last modified, size)] of a dataset, oldest first."""
+        prefix = "/".join([DatasetRef.PREFIX, name, ""])
+        objects = [o for o in self._s3.list_objects(self._bucket, prefix) if o["key"].endswith(".tar")]
+        return [(o["key"][len(prefix):-len(".tar")], o["last_modified"], o["size"])
+                for o in sorted(objects, key=lambda o: o["last_modified"])]
+
+    def datasets(self):
+        prefix = DatasetRef.PREFIX + "/"
+        return sorted({o["key"][len(prefix):].split("/")[0] for o in self._s3.list_objects(self._bucket, prefix)})
+
+    def resolve(self, spec: str):
+        """name@version as given, or the most recently registered version of name."""
+        ref = DatasetRef.parse(spec)
+        if ref.version:
+            if not self._s3.object_exists(self._bucket, ref.key):
+                raise RuntimeError("Dataset {0} is not registered".format(ref))
+            return ref
+        versions = self.versions(ref.name)
+        if not versions:
+            raise RuntimeError("Dataset {0} is not registered".format(ref.name))
+        return DatasetRef(ref.name, versions[-1][0])
+
+    def register(self, name, path, version=None):
+        path = os.path.normpath(os.path.abspath(path))
+        if os.path.isdir(path):
+            root, members = path, sorted(os.listdir(path))
+        else:
+            root, members = os.path.split(path)
+            members = [members]
+        with tempfile.TemporaryDirectory() as scratch:
+            tarball = Compress(File(os.path.join(scratch, name + ".tar")), *map(File, members),
+                               root=Folder(root)).execute()
+            ref = DatasetRef(name, version if version else PerfHistory.bundle_hash(tarball.path)[:12])
+            if self._s3.object_exists(self._bucket, ref.key):
+                print("Dataset {0} is already registered".format(ref))
+                return ref
+            Upload(self._aws_path_manager.server_path, self._aws_path_manager.bucket_path,
+                   S3Path(tarball.path, ref.key)).execute()
+        print("Registered dataset {0}".format(ref))
+        return ref
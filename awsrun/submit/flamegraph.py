@@ -0,0 +1,92 @@
+import html
+import zlib
+
+
+class FoldedStacks:
+    """Folded call stacks ("root;caller;callee count" per line) as produced on the worker."""
+
+    def __init__(self, stacks: dict):
+        self._stacks = stacks
+
+    @staticmethod
+    def load(path):
+        stacks = dict()
+        with open(path) as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                if stack and count.isdigit():
+                    stacks[stack] = stacks.get(stack, 0) + int(count)
+        return FoldedStacks(stacks)
+
+    @property
+    def total(self):
+        return sum(self._stacks.values())
+
+    def hot_functions(self, top=20):
+        """[(function, self samples, inclusive samples)] ordered by self samples."""
+        own = dict()
+        inclusive = dict()
+        for stack, count in self._stacks.items():
+            frames = stack.split(";")
+            # the root frame is the process name, not a function
+            frames = frames[1:] if len(frames) > 1 else frames
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+            for frame in set(frames):
+                inclusive[frame] = inclusive.get(frame, 0) + count
+        ranked = sorted(own.items(), key=lambda i: i[1], reverse=True)[:top]
+        return [(frame, count, inclusive[frame]) for frame, count in ranked]
+
+    def _tree(self):
+        root = {"name": "all", "value": 0, "children": dict()}
+        for stack, count in self._stacks.items():
+            node = root
+            node["value"] += count
+            for frame in stack.split(";"):
+                node = node["children"].setdefault(frame, {"name": frame, "value": 0, "children": dict()})
+                node["value"] += count
+        return root
+
+    @staticmethod
+    def _color(name):
+        # stable warm palette so the same function keeps its color across renders
+        h = zlib.crc32(name.encode())
+        return "rgb({},{},{})".format(205 + h % 50, 80 + (h >> 8) % 130, 40 + (h >> 16) % 50)
+
+    def svg(self, path, title="Flame Graph", width=1200, frame_height=16, min_width=0.1):
+        root = self._tree()
+        rects = []
+
+        def layout(node, x, depth):
+            w = width * node["value"] / root["value"]
+            if w < min_width:
+                return depth
+            rects.append((x, depth, w, node))
+            deepest = depth
+            for child in sorted(node["children"].values(), key=lambda c: c["name"]):
+                deepest = max(deepest, layout(child, x, depth + 1))
+                x += width * child["value"] / root["value"]
+            return deepest
+
+        depth = layout(root, 0.0, 0) if root["value"] else 0
+        height = (depth + 1) * frame_height + 40
+        with open(path, "w") as f:
+            f.write('<?xml version="1.0" standalone="no"?>\n')
+            f.write('<svg version="1.1" width="{0}" height="{1}" xmlns="http://www.w3.org/2000/svg" '
+                    'font-family="Verdana" font-size="11">\n'.format(width, height))
+            f.write('<text x="{0}" y="20" text-anchor="middle" font-size="16">{1}</text>\n'
+                    .format(width / 2, html.escape(title)))
+            for x, d, w, node in rects:
+                y = height - (d + 1) * frame_height - 4
+                label = "{0} ({1} samples, {2:.2f}%)".format(node["name"], node["value"],
+                                                            100.0 * node["value"] / root["value"])
+                f.write('<g><title>{0}</title>'.format(html.escape(label)))
+                f.write('<rect x="{0:.2f}" y="{1}" width="{2:.2f}" height="{3}" fill="{4}" rx="2"/>'
+                        .format(x, y, w, frame_height - 1, FoldedStacks._color(node["name"])))
+                chars = int(w / 7)
+                if chars >= 3:
+                    text = node["name"] if len(node["name"]) <= chars else node["name"][:chars - 2] + ".."
+                    f.write('<text x="{0:.2f}" y="{1}">{2}</text>'.format(x + 3, y + frame_height - 5,
+                                                                          html.escape(text)))
+                f.write('</g>\n')
+            f.write('</svg>\n')
+        return path
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import math
+import os
+import statistics
+import tarfile
+from datetime import datetime
+
+from common.resources import Folder
+
+
+def mann_whitney(baseline, candidate):
+    """Two-sided Mann-Whitney U test; returns (U of the candidate, p-value).
+
+    Small samples without ties use the exact null distribution, everything else the
+    tie-corrected normal approximation with continuity correction."""
+    n1, n2 = len(candidate), len(baseline)
+    pooled = sorted([(v, 0) for v in candidate] + [(v, 1) for v in baseline])
+    ranks = [0.0] * len(pooled)
+    ties = 0
+    i = 0
+    while i < len(pooled):
+        j = i
+        while j + 1 < len(pooled) and pooled[j + 1][0] == pooled[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        t = j - i + 1
+        ties += t ** 3 - t
+        i = j + 1
+    u = sum(r for r, (_, group) in zip(ranks, pooled) if group == 0) - n1 * (n1 + 1) / 2
+
+    if ties == 0 and n1 + n2 <= 20:
+        # counts[k] = number of rank arrangements giving U == k (Mann & Whitney recurrence)
+        counts = _u_distribution(n1, n2)
+        total = sum(counts)
+        lower = sum(counts[:int(min(u, n1 * n2 - u)) + 1])
+        return u, min(1.0, 2 * lower / total)
+
+    n = n1 + n2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))))
+    if sigma == 0:
+        return u, 1.0
+    delta = u - n1 * n2 / 2
+    z = (abs(delta) - 0.5) / sigma if abs(delta) >= 0.5 else 0.0
+    return u, math.erfc(z / math.sqrt(2))
+
+
+def _u_distribution(n1, n2):
+    table = {(0, 0): [1]}
+
+    def counts(a, b):
+        if (a, b) not in table:
+            dist = [0] * (a * b + 1)
+            if a > 0:
+                # largest value comes from the first sample: it beats all b of the second
+                for k, c in enumerate(counts(a - 1, b)):
+                    dist[k + b] += c
+            if b > 0:
+                for k, c in enumerate(counts(a, b - 1)):
+                    dist[k] += c
+            table[(a, b)] = dist
+        return table[(a, b)]
+
+    return counts(n1, n2)
+
+
+class PerfRecord:
+    """One submission: its key (command, arguments, cores, bundle hash) and measured metrics."""
+
+    def __init__(self, history, command, cores):
+        self._history = history
+        self.command = command[0] if command else ""
+        self.args = list(command[1:])
+        self.cores = cores
+        self.bundle = None
+        self.metrics = dict()
+
+    @property
+    def history(self):
+        return self._history
+
+    def add(self, metrics: dict):
+        self.metrics.update(metrics)
+
+    def to_json(self):
+        return {"time": datetime.now().isoformat(timespec="seconds"), "command": self.command, "args": self.args,
+                "cores": self.cores, "bundle": self.bundle, "metrics": self.metrics}
+
+    def save(self):
+        return self._history.append(self)
+
+
+class PerfHistory:
+    """Append-only JSON-lines store of every submission's results on this machine."""
+    DEFAULT = os.path.join(os.path.expanduser("~"), ".awsrun", "history.jsonl")
+    # metrics where a larger value is the better one; everything else is a cost
+    HIGHER_IS_BETTER = ("ipc", "speedup", "efficiency", "parallelism")
+
+    def __init__(self, path=DEFAULT):
+        self._path = path
+
+    @property
+    def path(self):
+        return self._path
+
+    def track(self, command, cores):
+        return PerfRecord(self, command, cores)
+
+    def append(self, record: PerfRecord):
+        Folder(os.path.dirname(self._path)).create()
+        with open(self._path, "a") as f:
+            f.write(json.dumps(record.to_json()) + "\n")
+        return record
+
+    def runs(self, command, cores=None):
+        if not os.path.exists(self._path):
+            return []
+        with open(self._path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        return [r for r in records
+                if [r["command"]] + r["args"] == command and (cores is None or r["cores"] == cores)]
+
+    @staticmethod
+    def bundle_hash(tarpath):
+        """Content hash of the input bundle; member names and bytes only, so re-tarring is stable."""
+        digest = hashlib.sha256()
+        with tarfile.open(tarpath, "r") as tarball:
+            for member in sorted(tarball.getmembers(), key=lambda m: m.name):
+                digest.update(member.name.encode())
+                if member.isfile():
+                    digest.update(tarball.extractfile(member).read())
+        return digest.hexdigest()
+
+    @staticmethod
+    def lower_is_better(metric):
+        return not any(map(lambda m: m in metric, PerfHistory.HIGHER_IS_BETTER))
+
+    @staticmethod
+    def trend(runs, metric):
+        """[(bundle, first seen, samples)] in submission order."""
+        bundles = dict()
+        for run in runs:
+            if metric in run["metrics"]:
+                bundles.setdefault(run["bundle"], (run["time"], []))[1].append(run["metrics"][metric])
+        return [(bundle, first, samples) for bundle, (first, samples) in bundles.items()]
+
+    @staticmethod
+    def compare(baseline, candidate, metric, alpha=0.05):
+        """Returns (relative change of the median, p-value, verdict)."""
+        _, p = mann_whitney(baseline, candidate)
+        base, cand = statistics.median(baseline), statistics.median(candidate)
+        change = (cand - base) / base if base else float("inf")
+        if p >= alpha or cand == base:
+            verdict = "no significant change"
+        elif (cand < base) == PerfHistory.lower_is_better(metric):
+            verdict = "improvement"
+        else:
+            verdict = "regression"
+        return change, p, verdict
@@ -0,0 +1,559 @@
+import csv
+import json
+import os
+import re
+import stat
+from abc import ABC, abstractmethod
+
+from common.resources import File, Folder
+from submit.flamegraph import FoldedStacks
+
+
+class DriverScript:
+    """Shell script generated next to the submission and shipped in the input bundle."""
+    FOLDER = ".awsrun"
+
+    def __init__(self, name, body):
+        self._file = Folder.cwd().join(Folder(DriverScript.FOLDER)).join(File(name))
+        self._body = body
+
+    @property
+    def path(self):
+        return self._file.path
+
+    def create(self):
+        Folder(self._file.parent).create()
+        with open(self.path, "w") as f:
+            f.write("#!/bin/bash\n")
+            f.write(self._body)
+        os.chmod(self.path, os.stat(self.path).st_mode | stat.S_IXUSR)
+        return self
+
+    def remove(self):
+        if self._file.exists():
+            self._file.remove()
+        if os.path.isdir(self._file.parent) and not os.listdir(self._file.parent):
+            os.rmdir(self._file.parent)
+
+
+class RunMode(ABC):
+    """Rewrites the submitted command before it is issued and interprets the
+    artifacts it produced once the output tarball comes back."""
+
+    @property
+    def artifacts(self):
+        return []
+
+    @property
+    def env(self):
+        return []
+
+    @abstractmethod
+    def wrap(self, shell: list) -> list:
+        pass
+
+    @abstractmethod
+    def report(self, folder: Folder):
+        pass
+
+    def metrics(self, folder: Folder) -> dict:
+        """Flat name -> value pairs recorded in the performance history."""
+        return {}
+
+    @property
+    def inputs(self):
+        """Files shipped in the input bundle besides the command arguments and deps file."""
+        return []
+
+    @property
+    def products(self):
+        """Local files the worker produces itself; never shipped even if they exist."""
+        return []
+
+    def clean(self):
+        pass
+
+    @staticmethod
+    def _header(title):
+        print(" ====  {0}  ====\n".format(title))
+
+
+class ScalingMode(RunMode):
+    """Strong-scaling sweep: the same command once per worker count, on one instance."""
+    RESULTS = "scaling.csv"
+
+    def __init__(self, workers):
+        self._workers = sorted(set(workers))
+        self._script = DriverScript("scaling.sh", ScalingMode._body(self._workers))
+
+    @staticmethod
+    def _body(workers):
+        return ("out={out}\n"
+                "echo \"workers,seconds,status\" > $out\n"
+                # pin within the CPU set the worker gave this task
+                "cpus=($(python3 -c 'import os; print(*sorted(os.sched_getaffinity(0)))'))\n"
+                "for p in {workers}; do\n"
+                "  echo \"====  CILK_NWORKERS=$p  ====\"\n"
+                "  pin=\"\"\n"
+                "  if command -v taskset > /dev/null && [ $p -le ${{#cpus[@]}} ]; then\n"
+                "    pin=\"taskset -c $(IFS=,; echo \"${{cpus[*]:0:$p}}\")\"\n"
+                "  fi\n"
+                "  start=$(date +%s.%N)\n"
+                "  CILK_NWORKERS=$p $pin \"$@\"\n"
+                "  status=$?\n"
+                "  end=$(date +%s.%N)\n"
+                "  echo \"$p,$(awk -v s=$start -v e=$end 'BEGIN {{ printf \"%.6f\", e - s }}'),$status\" >> $out\n"
+                "done\n").format(out=ScalingMode.RESULTS, workers=" ".join(map(str, workers)))
+
+    @property
+    def artifacts(self):
+        return [ScalingMode.RESULTS]
+
+    @property
+    def workers(self):
+        return self._workers
+
+    def wrap(self, shell: list) -> list:
+        return ["bash", self._script.create().path] + shell
+
+    @staticmethod
+    def _rows(timings):
+        """Speedup, parallel efficiency and Karp-Flatt serial fraction against the 1-worker run."""
+        serial = timings[1]
+        rows = []
+        for p in sorted(timings):
+            speedup = serial / timings[p] if timings[p] > 0 else float("inf")
+            efficiency = speedup / p
+            karp_flatt = (1 / speedup - 1 / p) / (1 - 1 / p) if p > 1 else None
+            rows.append((p, timings[p], speedup, efficiency, karp_flatt))
+        return rows
+
+    @staticmethod
+    def _load(folder: Folder):
+        results = folder.join(File(ScalingMode.RESULTS))
+        with open(results.path) as f:
+            records = list(csv.DictReader(f))
+        failed = [r["workers"] for r in records if int(r["status"]) != 0]
+        timings = {int(r["workers"]): float(r["seconds"]) for r in records if int(r["status"]) == 0}
+        return timings, failed
+
+    def metrics(self, folder: Folder) -> dict:
+        timings, _ = ScalingMode._load(folder)
+        if 1 not in timings:
+            return {}
+        metrics = dict()
+        for p, seconds, speedup, _, _ in ScalingMode._rows(timings):
+            metrics["scaling.seconds.p{}".format(p)] = seconds
+            metrics["scaling.speedup.p{}".format(p)] = speedup
+        return metrics
+
+    def report(self, folder: Folder):
+        timings, failed = ScalingMode._load(folder)
+
+        self._header(" SCALING ")
+        if 1 not in timings:
+            print("The 1-worker baseline did not complete; no speedup can be derived.\n")
+            return
+        print("{:>8} {:>12} {:>9} {:>11} {:>11}".format("workers", "time (s)", "speedup", "efficiency", "karp-flatt"))
+        for p, seconds, speedup, efficiency, karp_flatt in ScalingMode._rows(timings):
+            print("{:>8} {:>12.4f} {:>9.2f} {:>10.1f}% {:>11}".format(
+                p, seconds, speedup, 100 * efficiency, "-" if karp_flatt is None else "{:.4f}".format(karp_flatt)))
+        if failed:
+            print("\nRuns with non-zero exit status (excluded): {}".format(", ".join(failed)))
+        print()
+
+    def clean(self):
+        self._script.remove()
+
+
+class CilkscaleMode(RunMode):
+    """Work/span analysis of a binary built with CILKSCALE=1 (see test/cilktool/cilkutils.mk)."""
+    RESULTS = "cilkscale.csv"
+
+    def __init__(self, cores=(1, 2, 4, 8)):
+        self._cores = cores
+
+    @property
+    def artifacts(self):
+        return [CilkscaleMode.RESULTS]
+
+    @property
+    def env(self):
+        return ["CILKSCALE_OUT={}".format(CilkscaleMode.RESULTS)]
+
+    def wrap(self, shell: list) -> list:
+        return shell
+
+    @staticmethod
+    def _column(record, prefix):
+        for key, value in record.items():
+            if key is not None and key.strip().startswith(prefix):
+                return float(value)
+        raise KeyError(prefix)
+
+    @staticmethod
+    def regions(path):
+        """(tag, work, span, parallelism, burdened span, burdened parallelism) per measured region."""
+        with open(path) as f:
+            records = list(csv.DictReader(f))
+        regions = []
+        for record in records:
+            tag = record.get("tag", "").strip() or "<program>"
+            regions.append((tag,
+                            CilkscaleMode._column(record, "work"),
+                            CilkscaleMode._column(record, "span"),
+                            CilkscaleMode._column(record, "parallelism"),
+                            CilkscaleMode._column(record, "burdened_span"),
+                            CilkscaleMode._column(record, "burdened_parallelism")))
+        return regions
+
+    @staticmethod
+    def predicted_speedup(work, span, burdened_span, cores):
+        """(lower, upper) speedup bounds on P cores.
+
+        The upper bound is the work/span law, min(P, T_1/T_inf); the lower bound is the
+        greedy-scheduler guarantee T_P <= T_1/P + burdened T_inf."""
+        upper = min(cores, work / span) if span > 0 else float(cores)
+        if cores == 1:
+            return 1.0, 1.0
+        lower = min(upper, work / (work / cores + burdened_span))
+        return lower, upper
+
+    def metrics(self, folder: Folder) -> dict:
+        metrics = dict()
+        for tag, work, span, parallelism, _, burdened in CilkscaleMode.regions(
+                folder.join(File(CilkscaleMode.RESULTS)).path):
+            metrics["cilkscale.work.{}".format(tag)] = work
+            metrics["cilkscale.span.{}".format(tag)] = span
+            metrics["cilkscale.parallelism.{}".format(tag)] = parallelism
+            metrics["cilkscale.burdened_parallelism.{}".format(tag)] = burdened
+        return metrics
+
+    def report(self, folder: Folder):
+        regions = CilkscaleMode.regions(folder.join(File(CilkscaleMode.RESULTS)).path)
+
+        self._header(" CILKSCALE ")
+        print("{:<24} {:>12} {:>12} {:>12} {:>12}".format("region", "work (s)", "span (s)", "parallelism",
+                                                           "burdened"))
+        for tag, work, span, parallelism, _, burdened in regions:
+            print("{:<24} {:>12.6f} {:>12.6f} {:>12.2f} {:>12.2f}".format(tag[:24], work, span, parallelism,
+                                                                         burdened))
+
+        print("\nPredicted speedup (lower - upper bound)")
+        print("{:<24} ".format("region") + " ".join(map(lambda p: "{:>14}".format("P={}".format(p)), self._cores)))
+        for tag, work, span, _, burdened_span, _ in regions:
+            cells = map(lambda p: "{:>14}".format("{:.2f} - {:.2f}".format(
+                *CilkscaleMode.predicted_speedup(work, span, burdened_span, p))), self._cores)
+            print("{:<24} ".format(tag[:24]) + " ".join(cells))
+        print()
+
+
+class PerfStatMode(RunMode):
+    """Hardware counters collected by wrapping the command with `perf stat`."""
+    RESULTS = "perfstat.csv"
+    SUMMARY = "perfstat.json"
+    # derived metric -> (numerator, denominator, scale)
+    DERIVED = {
+        "ipc": ("instructions", "cycles", 1),
+        "cache_miss_rate": ("cache-misses", "cache-references", 1),
+        "cache_mpki": ("cache-misses", "instructions", 1000),
+        "branch_miss_rate": ("branch-misses", "branches", 1),
+        "l1d_miss_rate": ("L1-dcache-load-misses", "L1-dcache-loads", 1),
+        "llc_miss_rate": ("LLC-load-misses", "LLC-loads", 1),
+    }
+
+    def __init__(self, events):
+        self._events = events
+
+    @property
+    def artifacts(self):
+        return [PerfStatMode.RESULTS]
+
+    def wrap(self, shell: list) -> list:
+        # single-token options so CmdConfig.normalize never mistakes a stale local result for an input
+        return ["perf", "stat", "-x,", "--output={}".format(PerfStatMode.RESULTS),
+                "--event={}".format(",".join(self._events)), "--"] + shell
+
+    @staticmethod
+    def counters(path):
+        """Parses `perf stat -x,` output: value,unit,event,run time,percent measured[,metric,metric unit]."""
+        counters = {}
+        with open(path) as f:
+            for row in csv.reader(filter(lambda l: l.strip() and not l.startswith("#"), f)):
+                if len(row) < 5:
+                    continue
+                value, unit, event, run_time, enabled = row[:5]
+                try:
+                    count = float(value)
+                except ValueError:
+                    # <not counted> / <not supported>
+                    counters[event] = {"value": None, "status": value.strip("<>")}
+                    continue
+                enabled = float(enabled) if enabled else 100.0
+                counters[event] = {"value": count,
+                                   "unit": unit,
+                                   "run_time": float(run_time) if run_time else None,
+                                   "enabled": enabled,
+                                   # perf already extrapolates multiplexed counts by this factor
+                                   "scaling": 100.0 / enabled if enabled > 0 else None}
+        return counters
+
+    @staticmethod
+    def derive(counters):
+        values = {event.split(":")[0]: c["value"] for event, c in counters.items() if c["value"] is not None}
+        derived = {}
+        for metric, (num, den, scale) in PerfStatMode.DERIVED.items():
+            if num in values and values.get(den):
+                derived[metric] = scale * values[num] / values[den]
+        return derived
+
+    def metrics(self, folder: Folder) -> dict:
+        counters = PerfStatMode.counters(folder.join(File(PerfStatMode.RESULTS)).path)
+        metrics = {"perf.{}".format(event): c["value"] for event, c in counters.items() if c["value"] is not None}
+        metrics.update({"perf.{}".format(m): v for m, v in PerfStatMode.derive(counters).items()})
+        return metrics
+
+    def report(self, folder: Folder):
+        counters = PerfStatMode.counters(folder.join(File(PerfStatMode.RESULTS)).path)
+        derived = PerfStatMode.derive(counters)
+        with open(folder.join(File(PerfStatMode.SUMMARY)).path, "w") as f:
+            json.dump({"counters": counters, "derived": derived}, f, indent=2)
+
+        self._header(" PERF STAT ")
+        for event, counter in counters.items():
+            if counter["value"] is None:
+                print("{:<32} {:>20}".format(event, counter["status"]))
+            else:
+                print("{:<32} {:>20,.0f}   (measured {:.1f}%, x{:.2f})".format(event, counter["value"],
+                                                                            counter["enabled"], counter["scaling"]))
+        if derived:
+            print()
+        for metric, value in derived.items():
+            print("{:<32} {:>20.4f}".format(metric, value))
+        print("\nCounters saved to {}\n".format(PerfStatMode.SUMMARY))
+
+
+class ProfileMode(RunMode):
+    """Sampled profile: perf record on the worker, folded there, rendered locally."""
+    RESULTS = "profile.folded"
+    FLAMEGRAPH = "profile.svg"
+    # stackcollapse for the default `perf script` layout: a header line per sample, one frame per
+    # indented line (innermost first) and a blank line between samples
+    FOLD = ("/^[^ \\t]/ { comm = $1; stack = \"\"; next }\n"
+            "/^[ \\t]+[0-9a-f]+ / { fn = $2; sub(/\\+0x[0-9a-f]+$/, \"\", fn);"
+            " stack = (stack == \"\") ? fn : fn \";\" stack; next }\n"
+            "/^[ \\t]*$/ { if (comm != \"\") counts[(stack == \"\") ? comm : comm \";\" stack]++;"
+            " comm = \"\"; stack = \"\" }\n"
+            "END { if (comm != \"\") counts[(stack == \"\") ? comm : comm \";\" stack]++;"
+            " for (s in counts) print s, counts[s] }\n")
+
+    def __init__(self, top=20, frequency=499):
+        self._top = top
+        self._script = DriverScript("profile.sh", ProfileMode._body(frequency))
+
+    @staticmethod
+    def _body(frequency):
+        return ("perf record --quiet -F {freq} --call-graph dwarf -o perf.data -- \"$@\"\n"
+                "status=$?\n"
+                "perf script -i perf.data 2> /dev/null | awk '{fold}' > {out}\n"
+                "rm -f perf.data\n"
+                "exit $status\n").format(freq=frequency, fold=ProfileMode.FOLD, out=ProfileMode.RESULTS)
+
+    @property
+    def artifacts(self):
+        return [ProfileMode.RESULTS]
+
+    def wrap(self, shell: list) -> list:
+        return ["bash", self._script.create().path] + shell
+
+    def report(self, folder: Folder):
+        stacks = FoldedStacks.load(folder.join(File(ProfileMode.RESULTS)).path)
+        total = stacks.total
+
+        self._header(" PROFILE ")
+        if not total:
+            print("No samples were collected.\n")
+            return
+        print("{:>8} {:>8}  {}".format("self %", "total %", "function"))
+        for frame, own, inclusive in stacks.hot_functions(self._top):
+            print("{:>7.2f}% {:>7.2f}%  {}".format(100.0 * own / total, 100.0 * inclusive / total, frame))
+        svg = stacks.svg(folder.join(File(ProfileMode.FLAMEGRAPH)).path, title="{} samples".format(total))
+        print("\nFlame graph written to {}\n".format(svg))
+
+    def clean(self):
+        self._script.remove()
+
+
+class BenchmarkMode(RunMode):
+    """Low-noise run: isolated cores on the worker plus a calibration-based noise estimate."""
+    RESULTS = "noise.json"
+
+    @property
+    def artifacts(self):
+        return [BenchmarkMode.RESULTS]
+
+    def wrap(self, shell: list) -> list:
+        # the worker does the isolation, the command runs unchanged
+        return shell
+
+    @staticmethod
+    def _load(folder: Folder):
+        with open(folder.join(File(BenchmarkMode.RESULTS)).path) as f:
+            return json.load(f)
+
+    def metrics(self, folder: Folder) -> dict:
+        noise = BenchmarkMode._load(folder)
+        return {"noise.cv": noise["cv"], "noise.drift": noise["drift"]}
+
+    def report(self, folder: Folder):
+        noise = BenchmarkMode._load(folder)
+        self._header(" NOISE ")
+        print("CPUs         {}".format(",".join(map(str, noise["cpus"]))))
+        print("governor     {}".format(noise["governor"]))
+        for phase in ("before", "after"):
+            summary = noise[phase]
+            if summary["samples"]:
+                print("{:<12} {:.3f} ms +- {:.2f}%".format(phase, 1000 * summary["mean"], 100 * summary["cv"]))
+        print("noise (cv)   {:.2f}%".format(100 * noise["cv"]))
+        print("drift        {:+.2f}%".format(100 * noise["drift"]))
+        print("\nTiming differences below about {:.1f}% are within the noise.\n".format(
+            200 * max(noise["cv"], abs(noise["drift"]))))
+
+
+class ResourcesMode(RunMode):
+    """Resource accounting the worker keeps for every task (its cgroup, or getrusage without one)."""
+    RESULTS = "resources.json"
+
+    @property
+    def artifacts(self):
+        return [ResourcesMode.RESULTS]
+
+    def wrap(self, shell: list) -> list:
+        return shell
+
+    @staticmethod
+    def _load(folder: Folder):
+        with open(folder.join(File(ResourcesMode.RESULTS)).path) as f:
+            return json.load(f)
+
+    def metrics(self, folder: Folder) -> dict:
+        usage = ResourcesMode._load(folder)["usage"]
+        return {"resources.{}".format(k): v for k, v in usage.items() if isinstance(v, (int, float))}
+
+    @staticmethod
+    def _mb(value):
+        return "{:.1f} MB".format(value / (1024 * 1024)) if value is not None else "n/a"
+
+    def report(self, folder: Folder):
+        resources = ResourcesMode._load(folder)
+        limits, usage = resources["limits"], resources["usage"]
+        self._header(" RESOURCES ")
+        if resources["cgroup"] is None:
+            print("No cgroup limits on the worker ({}); usage from getrusage\n".format(resources["reason"]))
+        else:
+            print("limits       {} cores, {}, {} pids\n".format(limits["cores"],
+                                                           ResourcesMode._mb(limits["memory_bytes"]), limits["pids"]))
+        print("wall time    {:.2f} s".format(usage["wall_seconds"]))
+        print("CPU time     {:.2f} s (user {:.2f} s, system {:.2f} s, {:.2f} CPUs busy)".format(
+            usage["cpu_seconds"], usage["user_seconds"], usage["system_seconds"], usage["cpu_utilization"]))
+        print("peak memory  {}".format(ResourcesMode._mb(usage["peak_memory_bytes"])))
+        print("I/O          {} read, {} written".format(ResourcesMode._mb(usage["io_read_bytes"]),
+                                                     ResourcesMode._mb(usage["io_write_bytes"])))
+        if "throttled_periods" in usage:
+            print("throttled    {} of {} periods ({:.2f} s)".format(usage["throttled_periods"], usage["periods"],
+                                                                usage["throttled_seconds"]))
+            print("memory cap   hit {} times, {} OOM kills".format(usage["memory_max_events"], usage["oom_kills"]))
+            if usage["throttled_periods"]:
+                print("\nThe task used more CPU than its {} cores and was throttled.".format(limits["cores"]))
+            if usage["oom_kills"] or usage["memory_max_events"]:
+                print("\nThe task ran into its memory cap; rerun with more cores or use less memory.")
+        print()
+
+
+class BuildMode(RunMode):
+    """Builds the submission on the worker with its OpenCilk toolchain before running it.
+
+    Only sources are shipped: files with a source suffix under the build folder plus
+    whatever its makefiles `include` and its sources `#include "..."` from elsewhere
+    (e.g. ../cilktool/cilkutils.mk). The worker runs `make -B` with the compilers
+    wrapped in ccache, whose cache is shared by all tasks, so rebuilding unchanged
+    translation units costs a cache lookup."""
+    LOG = "build.log"
+    SUFFIXES = (".c", ".cc", ".cpp", ".cxx", ".h", ".hh", ".hpp", ".mk")
+    MAKEFILES = ("Makefile", "makefile", "GNUmakefile")
+    MAKE_INCLUDE = re.compile(r"^\s*-?include\s+(.+)$")
+    C_INCLUDE = re.compile(r'^\s*#\s*include\s+"([^"]+)"')
+
+    def __init__(self, target="", folder="."):
+        self._folder = os.path.abspath(folder)
+        self._products = []
+        self._script = DriverScript("build.sh", BuildMode._body(target))
+
+    @staticmethod
+    def _body(target):
+        return ("if command -v ccache > /dev/null; then cc=\"ccache clang\"; cxx=\"ccache clang++\";"
+                " else cc=clang; cxx=clang++; fi\n"
+                # -B: a stale binary or object uploaded by mistake is never reused; ccache keeps it cheap
+                "make -B -C \"$AWSRUN_BUILD_DIR\" CC=\"$cc\" CXX=\"$cxx\" {target} > {log} 2>&1\n"
+                "status=$?\n"
+                "if [ $status -ne 0 ]; then echo \"Build failed with status $status, see {log}\" >&2;"
+                " exit $status; fi\n"
+                "exec \"$@\"\n").format(target=target, log=BuildMode.LOG)
+
+    @property
+    def artifacts(self):
+        return [BuildMode.LOG]
+
+    @property
+    def env(self):
+        # workspace-relative, the way CmdConfig.relativize maps client paths on the worker
+        return ["AWSRUN_BUILD_DIR=." + self._folder]
+
+    @property
+    def products(self):
+        return self._products
+
+    def locate(self, shell: list) -> list:
+        """Makes the executable an absolute client path even though it may not exist yet."""
+        if shell and os.path.sep in shell[0]:
+            shell = [os.path.abspath(shell[0])] + shell[1:]
+            self._products.append(shell[0])
+        return shell
+
+    def _includes(self, path):
+        pattern = BuildMode.C_INCLUDE if not path.endswith(".mk") \
+            and os.path.basename(path) not in BuildMode.MAKEFILES else BuildMode.MAKE_INCLUDE
+        # make resolves includes from where it runs, the preprocessor from the including file
+        base = self._folder if pattern is BuildMode.MAKE_INCLUDE else os.path.dirname(path)
+        with open(path, errors="replace") as f:
+            for line in f:
+                match = pattern.match(line)
+                if match:
+                    for name in match.group(1).split():
+                        if "$" not in name:
+                            yield os.path.normpath(os.path.join(base, name))
+
+    @property
+    def inputs(self):
+        pending = []
+        for path, folders, files in os.walk(self._folder):
+            folders[:] = [f for f in folders if not f.startswith(".")]
+            pending.extend(os.path.join(path, name) for name in files
+                           if name in BuildMode.MAKEFILES or name.endswith(BuildMode.SUFFIXES))
+        found = set()
+        while pending:
+            path = pending.pop()
+            if path in found or not os.path.isfile(path):
+                continue
+            found.add(path)
+            pending.extend(self._includes(path))
+        return [File(path) for path in sorted(found)]
+
+    def wrap(self, shell: list) -> list:
+        return ["bash", self._script.create().path] + shell
+
+    def report(self, folder: Folder):
+        File.new(folder.join(File(BuildMode.LOG))).content(header=" BUILD ")
+
+    def clean(self):
+        self._script.remove()
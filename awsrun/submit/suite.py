@@ -0,0 +1,58 @@
+import json
+import os
+
+from common.configuration import CmdConfig, WSConfig
+from common.protocol import IOSuite
+
+
+class SuiteManifest:
+    """Test suite manifest: a JSON file of the form
+
+        {"tests": [{"name": "too-many-args", "cmd": "test/argtest/args a b",
+                    "stderr": "test/argtest/stderr", "exitcode": 0}]}
+
+    `cmd` is required; `stdout`/`stderr` name golden files (relative to the current
+    folder, they are uploaded with the submission), `exitcode` the expected status, and
+    `timeout`/`cores` override the submission's defaults for that test."""
+    EXPECTED = ("stdout", "stderr", "exitcode")
+
+    def __init__(self, tests):
+        self._tests = tests
+
+    @staticmethod
+    def load(path):
+        with open(path) as f:
+            manifest = json.load(f)
+        tests = manifest.get("tests", []) if isinstance(manifest, dict) else manifest
+        if not tests:
+            raise RuntimeError("No tests in suite manifest {0}".format(path))
+        for index, test in enumerate(tests):
+            if "cmd" not in test:
+                raise RuntimeError("Test {0} of {1} has no cmd".format(test.get("name", index), path))
+            for stream in ("stdout", "stderr"):
+                if stream in test and not os.path.isfile(test[stream]):
+                    raise RuntimeError("Expected {0} file {1} not found".format(stream, test[stream]))
+        return SuiteManifest(tests)
+
+    def __len__(self):
+        return len(self._tests)
+
+    @property
+    def names(self):
+        return [test.get("name", "test{0}".format(index)) for index, test in enumerate(self._tests)]
+
+    def task(self, wsconfig: WSConfig, localwd, timeout, cores, depfile, env, artifacts=None, benchmark=False,
+             datasets=None):
+        """Builds the IOSuite; `cores` is the core budget the tests are packed onto."""
+        commands = []
+        for test in self._tests:
+            shell = test["cmd"].split() if isinstance(test["cmd"], str) else list(test["cmd"])
+            commands.append(CmdConfig.new(cmd=shell,
+                                          timeout=test.get("timeout", timeout),
+                                          cores=test.get("cores", 1),
+                                          depfile=depfile,
+                                          env=env + test.get("env", []),
+                                          datasets=datasets))
+        expected = [{k: test[k] for k in SuiteManifest.EXPECTED if k in test} for test in self._tests]
+        return IOSuite.new(commands, wsconfig, localwd, "", self.names, expected, cores,
+                           (artifacts if artifacts else []) + [IOSuite.REPORT], benchmark)
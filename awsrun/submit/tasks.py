@@ -4,8 +4,10 @@ from abc import ABC, abstractmethod
 
 from common.commands import Compress, Upload, SendMsg, Download, Decompress
 from common.configuration import AWSPathManager
-from common.protocol import IOTask, AWSMsg, AWSIDRegistration
+from common.protocol import IOTask, IOBatch, IOSuite, AWSMsg, AWSIDRegistration
 from common.resources import Folder, File, OSPath
+from submit.history import PerfHistory, PerfRecord
+from submit.modes import RunMode
 from multipledispatch import dispatch
 
 
@@ -16,20 +18,36 @@ class Issuer(ABC):
 
 
 class AWSIssuer(Issuer):
-    def __init__(self, aws_path_manager: AWSPathManager):
+    def __init__(self, aws_path_manager: AWSPathManager, *modes: RunMode, record: PerfRecord = None):
         self._aws_path_manager = aws_path_manager
+        self._modes = modes
+        self._record = record
 
     @staticmethod
     def dependencies(task: IOTask):
         deps = []
         cwd = Folder.cwd()
-        deps.extend(map(lambda f: cwd.relative(f),
-                        map(lambda p: OSPath.new(p), filter(lambda arg: os.path.exists(arg), task.command.shell))))
+        for command in task.commands:
+            deps.extend(map(lambda f: cwd.relative(f),
+                            map(lambda p: OSPath.new(p), filter(lambda arg: os.path.exists(arg), command.shell))))
+        deps.extend(map(lambda f: cwd.relative(f), map(OSPath.new, filter(os.path.exists, task.inputs))))
+        # every command of a batch reads the same dependency file
         deps.extend(map(lambda f: cwd.relative(f), task.command.deps))
-        return deps
+        # batched commands often share their executable
+        return list({dep.path: dep for dep in deps}.values())
+
+    def _bundle(self, task: IOTask):
+        cwd = Folder.cwd()
+        deps = AWSIssuer.dependencies(task)
+        for mode in self._modes:
+            deps.extend(map(lambda f: cwd.relative(f), mode.inputs))
+        products = set(os.path.realpath(p) for mode in self._modes for p in mode.products)
+        return list({dep.path: dep for dep in deps if dep.path not in products}.values())
 
     def _operands(self, task: IOTask):
-        resources = Compress(task.workspace.input, *AWSIssuer.dependencies(task)).execute()
+        resources = Compress(task.workspace.input, *self._bundle(task)).execute()
+        if self._record:
+            self._record.bundle = PerfHistory.bundle_hash(resources.path)
         uploaded = Upload(self._aws_path_manager.server_path, self._aws_path_manager.bucket_path, resources).execute()
         # Echo status back to user.
         print("Resources {0} is transfered\n".format(uploaded.path))
@@ -43,10 +61,44 @@ class AWSIssuer(Issuer):
             os.remove(task.workspace.local_input)
         if os.path.exists(task.workspace.local_output):
             os.remove(task.workspace.local_output)
+        for mode in self._modes:
+            mode.clean()
+
+    @staticmethod
+    def _artifacts(cwd: Folder, retrieved: File, task: IOTask):
+        returned = []
+        for artifact in task.artifacts:
+            try:
+                Decompress(cwd, retrieved, File(artifact)).execute()
+            except KeyError:
+                print("Artifact {0} was not returned by the worker".format(artifact))
+            else:
+                returned.append(artifact)
+        return returned
+
+    @staticmethod
+    def _commands(cwd: Folder, retrieved: File, task: IOBatch):
+        for index, command in enumerate(task.commands):
+            folder = IOBatch.output_folder(index)
+            reports = [File(os.path.join(folder, name)) for name in ('stdout', 'stderr', 'exitcode')]
+            target = Decompress(cwd, retrieved, *reports).execute()
+            with open(target.join(reports[2]).path) as f:
+                status = f.read().strip()
+            print(" ====  {0}: {1} (exit {2})  ====\n".format(folder, " ".join(command.shell), status))
+            File.new(target.relative(reports[0])).content(header=" STDOUT {0} ".format(folder))
+            File.new(target.relative(reports[1])).content(header=" STDERR {0} ".format(folder))
+
+    def _report(self, cwd: Folder, returned):
+        for mode in self._modes:
+            if all(map(lambda a: a in returned, mode.artifacts)):
+                mode.report(cwd)
+                if self._record:
+                    self._record.add(mode.metrics(cwd))
 
     def _output(self, task: IOTask):
+        issued = time.time()
         retrieved = Download(self._aws_path_manager.server_path, self._aws_path_manager.bucket_path, task.workspace.output,
-                             task.command.timeout).execute()
+                             task.timeout).execute()
         if retrieved:
             cwd = Folder(os.path.normpath(os.getcwd()))
             # files to extract
@@ -56,12 +108,22 @@ class AWSIssuer(Issuer):
             # report
             File.new(target.relative(stdout_report)).content(header=" STDOUT ")
             File.new(target.relative(stderr_report)).content(header=" STDERR ")
+            # a suite's stdout already is its report
+            if isinstance(task, IOBatch) and not isinstance(task, IOSuite):
+                AWSIssuer._commands(cwd, retrieved, task)
             #
             if task.perf_file:
                 lwd_submission = Folder(task.lwd).join(task.workspace.root).create()
                 Decompress(lwd_submission, File(task.workspace.local_input)).execute()
                 Decompress(lwd_submission, retrieved, File(task.perf_file)).execute()
                 Decompress(cwd, retrieved, File(task.perf_file)).execute()
+            if self._record:
+                # end to end, queue wait and transfers included; the worker's own run time is resources.wall_seconds
+                self._record.add({"turnaround": time.time() - issued})
+            self._report(cwd, AWSIssuer._artifacts(cwd, retrieved, task))
+            if self._record:
+                self._record.save()
+                print("Results recorded in {0}".format(self._record.history.path))
             print("Task executed successfully")
         else:
             print("failed to retrieve, re-submit the job!!!")
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+import os
+from os import path
+import signal
+import socket
+import sys
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from aws import S3Handler, SqsHandler
+from aws.aws_ec2 import EC2InstanceUtility
+from common.resources import JsonLoader, Folder
+from common.configuration import AWSPathManager, AWSInfra
+from worker.tasks import AWSWorker
+from worker.scheduler import CoreScheduler
+from worker.cache import InputCache
+from worker.cgroup import CgroupLimits
+
+
+if __name__ == '__main__':
+    aws_parser = argparse.ArgumentParser(description='Serves awsrun submissions from the task queue',
+                                         epilog='Enjoy the program! :)')
+    # aws config
+    awscfg = aws_parser.add_mutually_exclusive_group(required=True)
+
+    awscfg.add_argument('--configurl',
+                        action='store_const',
+                        const="https://raw.githubusercontent.com/eec-ucd/eec289/main/config.aws",
+                        help='configuration url for the aws server')
+
+    awscfg.add_argument('--configfile',
+                        action='store_const',
+                        const='config.aws',
+                        help='configuration file for the aws server')
+
+    aws_parser.add_argument('--workfolder',
+                            type=str,
+                            default="/tmp/awsrun-worker",
+                            help='folder the task workspaces are created in')
+
+    aws_parser.add_argument('--cpus',
+                            type=int,
+                            default=len(os.sched_getaffinity(0)),
+                            help='number of CPUs tasks are packed onto')
+
+    aws_parser.add_argument('--wait',
+                            type=int,
+                            default=20,
+                            help='long-poll wait time in seconds')
+
+    aws_parser.add_argument('--prefetch',
+                            type=int,
+                            default=None,
+                            help='tasks received and staged ahead of free cores (default: one per CPU)')
+
+    aws_parser.add_argument('--cache-size',
+                            type=int,
+                            default=2048,
+                            help='input cache capacity in MB (0 disables the cache)')
+
+    aws_parser.add_argument('--dataset-cache-size',
+                            type=int,
+                            default=20480,
+                            help='dataset cache capacity in MB')
+
+    aws_parser.add_argument('--ccache-size',
+                            type=str,
+                            default='5G',
+                            help='size of the compile cache shared by --build tasks')
+
+    aws_parser.add_argument('--cgroup-root',
+                            type=str,
+                            default=CgroupLimits.ROOT,
+                            help='cgroup v2 directory the task cgroups are created in ("" disables limits)')
+
+    aws_parser.add_argument('--memory-per-core',
+                            type=int,
+                            default=None,
+                            help='task memory cap in MB per requested core (default: memory / CPUs)')
+
+    aws_parser.add_argument('--pids-max',
+                            type=int,
+                            default=4096,
+                            help='maximum number of processes and threads per task')
+
+    aws_parser.add_argument('--worker-id',
+                            type=str,
+                            default=None,
+                            help='name the worker reports its status under (default: EC2 instance id or host name)')
+
+    aws_parser.add_argument('--max-tasks',
+                            type=int,
+                            default=None,
+                            help='exit after this many tasks')
+
+    args = aws_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    # inherited by every task; see TaskExecution._environment for the per-task settings
+    os.environ.setdefault('CCACHE_DIR', Folder(args.workfolder).join(Folder('ccache')).create().path)
+    os.environ.setdefault('CCACHE_MAXSIZE', args.ccache_size)
+
+    if args.configurl:
+        data = JsonLoader.load_url(args.configurl)
+
+    if args.configfile:
+        data = JsonLoader.load_file(args.configfile)
+
+    aws_path_manager = AWSPathManager(AWSInfra.load(data))
+    sqs = SqsHandler(aws_path_manager.server_path.path)
+    worker = AWSWorker(S3Handler(aws_path_manager.server_path.path),
+                       sqs,
+                       sqs.get_queue_by_url(aws_path_manager.taskq_path.path),
+                       aws_path_manager.bucket_path.path,
+                       Folder(args.workfolder),
+                       scheduler=CoreScheduler(sorted(os.sched_getaffinity(0))[:args.cpus]),
+                       wait_time=args.wait,
+                       prefetch=args.prefetch,
+                       cache=InputCache(Folder(args.workfolder).join(Folder('cache')), args.cache_size)
+                       if args.cache_size > 0 else None,
+                       limits=CgroupLimits(args.cgroup_root, args.memory_per_core, args.pids_max, args.cpus)
+                       if args.cgroup_root else None,
+                       datasets=InputCache(Folder(args.workfolder).join(Folder('datasets')), args.dataset_cache_size),
+                       worker_id=args.worker_id if args.worker_id
+                       else EC2InstanceUtility.local_instance_id() or socket.gethostname())
+    # stopping the instance (autoscaler scale-in) hands staged tasks back and finishes running ones
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    try:
+        worker.serve(args.max_tasks)
+    except KeyboardInterrupt:
+        worker.stop()
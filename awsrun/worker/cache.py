@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import shutil
+import stat
+import threading
+import time
+
+from common.commands import Decompress
+from common.resources import Folder, File
+
+
+class InputCache:
+    """Extracted input bundles on the worker's disk, keyed by the object's ETag (or, for
+    the dataset cache, by the immutable dataset version).
+
+    Workspaces are hardlinked from an entry instead of re-extracted. Cached files are
+    made read-only and their size/mtime recorded, so an entry a task managed to modify
+    anyway is detected and fetched again. Entries are evicted least recently used once
+    the cache exceeds its capacity; entries pinned by staged or running tasks are kept.
+    Bookkeeping is locked, downloads are not, so release() never waits on a fetch."""
+    INDEX = "index.json"
+
+    def __init__(self, root: Folder, capacity_mb=2048):
+        self._root = root.create()
+        self._capacity = capacity_mb * 1024 * 1024
+        self._pins = dict()
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger(InputCache.__name__)
+        index = self._root.join(File(InputCache.INDEX))
+        if index.exists():
+            with open(index.path) as f:
+                self._index = json.load(f)
+        else:
+            self._index = dict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self):
+        return sum(entry["size"] for entry in self._index.values())
+
+    def _entry(self, key):
+        return self._root.join(Folder(key))
+
+    def _save(self):
+        with open(self._root.join(File(InputCache.INDEX)).path, "w") as f:
+            json.dump(self._index, f)
+
+    @staticmethod
+    def _manifest(folder: Folder):
+        manifest = dict()
+        for path, _, files in os.walk(folder.path):
+            for name in files:
+                full = os.path.join(path, name)
+                st = os.lstat(full)
+                if stat.S_ISREG(st.st_mode):
+                    os.chmod(full, stat.S_IMODE(st.st_mode) & ~0o222)
+                    manifest[os.path.relpath(full, folder.path)] = [st.st_size, st.st_mtime_ns]
+        return manifest
+
+    def _intact(self, key):
+        entry = self._entry(key)
+        for rel, (size, mtime) in self._index[key]["files"].items():
+            try:
+                st = os.lstat(os.path.join(entry.path, rel))
+            except FileNotFoundError:
+                return False
+            if st.st_size != size or st.st_mtime_ns != mtime:
+                return False
+        return True
+
+    def _discard(self, key):
+        self._index.pop(key, None)
+        entry = self._entry(key)
+        if entry.exists():
+            entry.remove()
+
+    def _populate(self, key, download):
+        tarball = self._root.join(File(key + ".tar"))
+        staging = self._root.join(Folder(key + ".partial"))
+        if staging.exists():
+            staging.remove()
+        download(tarball.path)
+        Decompress(staging, tarball).execute()
+        tarball.remove()
+        return staging, InputCache._manifest(staging)
+
+    def _evict(self):
+        total = self.size
+        for key in sorted(self._index, key=lambda k: self._index[k]["used"]):
+            if total <= self._capacity:
+                break
+            if self._pins.get(key):
+                continue
+            total -= self._index[key]["size"]
+            self._logger.info("Evicting cached input %s", key)
+            self._discard(key)
+
+    def acquire(self, key, download):
+        """Pins and returns the extracted tree for key; download(path) fetches the tarball on a miss.
+
+        Expected to be called from one fetching thread at a time."""
+        with self._lock:
+            if key in self._index and self._intact(key):
+                self.hits += 1
+                self._index[key]["used"] = time.time()
+                self._pins[key] = self._pins.get(key, 0) + 1
+                self._save()
+                return self._entry(key)
+            self.misses += 1
+            self._discard(key)
+        staging, files = self._populate(key, download)
+        with self._lock:
+            os.rename(os.path.normpath(staging.path), os.path.normpath(self._entry(key).path))
+            self._index[key] = {"size": sum(size for size, _ in files.values()), "used": time.time(),
+                                "files": files}
+            self._pins[key] = self._pins.get(key, 0) + 1
+            self._evict()
+            self._save()
+            return self._entry(key)
+
+    def release(self, key):
+        with self._lock:
+            if self._pins.get(key, 0) > 1:
+                self._pins[key] -= 1
+            else:
+                self._pins.pop(key, None)
+
+    @staticmethod
+    def link(source: Folder, target: Folder):
+        """Materializes a workspace from a cached tree with hardlinks (no data is copied)."""
+        shutil.copytree(os.path.normpath(source.path), os.path.normpath(target.path), symlinks=True,
+                        copy_function=os.link, dirs_exist_ok=True)
+        return target
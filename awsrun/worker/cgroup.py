@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import resource
+import time
+
+from common.resources import Folder, File
+
+
+class CgroupLimits:
+    """Worker-wide settings for the per-task cgroups (cgroup v2 only).
+
+    memory_per_core_mb is scaled by the cores a task asks for; None splits the machine's
+    memory evenly over its CPUs. An empty root disables cgroups altogether."""
+    ROOT = "/sys/fs/cgroup/awsrun"
+
+    def __init__(self, root=ROOT, memory_per_core_mb=None, pids=4096, cpus=None):
+        self.root = root
+        cpus = cpus if cpus else len(os.sched_getaffinity(0))
+        if memory_per_core_mb is None:
+            memory_per_core_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (cpus * 1024 * 1024)
+        self.memory_per_core_mb = memory_per_core_mb
+        self.pids = pids
+
+    def task(self, name, cores):
+        return TaskCgroup(self.root, name, cores, self.memory_per_core_mb * cores, self.pids)
+
+
+class TaskCgroup:
+    """One task's cgroup: CPU quota of `cores` CPUs, a memory cap without swap and a pids limit.
+
+    The task joins it from its preexec function, so everything it spawns is accounted and
+    limited too. Where the worker cannot create cgroups (cgroup v1 hosts, no delegation)
+    the task runs unconfined and usage falls back to getrusage() of the pool process."""
+    RESULTS = "resources.json"
+    MOUNT = "/sys/fs/cgroup"
+    CONTROLLERS = ("cpu", "memory", "pids", "io")
+    PERIOD_US = 100000
+
+    def __init__(self, root, name, cores, memory_mb, pids):
+        self._root = root
+        self._path = os.path.join(root, name) if root else None
+        self._limits = {"cores": cores, "memory_bytes": memory_mb * 1024 * 1024 if memory_mb else None,
+                        "pids": pids}
+        self._created = False
+        self._reason = None if root else "disabled"
+        self._rusage = None
+        self._logger = logging.getLogger(TaskCgroup.__name__)
+
+    @property
+    def active(self):
+        return self._created
+
+    def _write(self, name, value, path=None):
+        with open(os.path.join(path if path else self._path, name), "w") as f:
+            f.write(str(value))
+
+    def _read(self, name):
+        try:
+            with open(os.path.join(self._path, name)) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    @staticmethod
+    def _keyed(text):
+        """Parses flat keyed files (cpu.stat, memory.events): `key value` per line."""
+        values = {}
+        for line in (text or "").splitlines():
+            key, _, value = line.partition(" ")
+            if value.strip().isdigit():
+                values[key] = int(value)
+        return values
+
+    def _delegate(self):
+        """Enables the controllers from the mount point down to the worker's subtree."""
+        with open(os.path.join(TaskCgroup.MOUNT, "cgroup.controllers")) as f:
+            available = f.read().split()
+        wanted = " ".join("+" + c for c in TaskCgroup.CONTROLLERS if c in available)
+        os.makedirs(self._root, exist_ok=True)
+        parent = os.path.dirname(os.path.normpath(self._root))
+        for path in (parent, self._root):
+            self._write("cgroup.subtree_control", wanted, path)
+
+    def create(self):
+        self._rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        if self._path is None:
+            return self
+        try:
+            self._delegate()
+            os.makedirs(self._path, exist_ok=True)
+            cores = self._limits["cores"]
+            self._write("cpu.max", "{0} {1}".format(cores * TaskCgroup.PERIOD_US, TaskCgroup.PERIOD_US))
+            self._write("memory.max", self._limits["memory_bytes"])
+            self._write("pids.max", self._limits["pids"])
+            self._created = True
+            self._optional()
+        except OSError as e:
+            # no cgroup2 mount, v1 hierarchy, or not delegated to this user
+            self._reason = "{0}: {1}".format(e.__class__.__name__, e.strerror or e)
+            self._logger.warning("Running without cgroup limits: %s", self._reason)
+            self.remove()
+        return self
+
+    def _optional(self):
+        # a capped task should fail fast rather than thrash its neighbours through swap, and an
+        # OOM kill takes the whole task down; both files depend on the kernel and its config
+        for name, value in (("memory.swap.max", 0), ("memory.oom.group", 1)):
+            try:
+                self._write(name, value)
+            except OSError:
+                pass
+
+    def attach(self):
+        """Moves the calling process into the cgroup; meant for the task's preexec function."""
+        if self._created:
+            self._write("cgroup.procs", 0)
+
+    def kill(self):
+        """Kills every process left in the cgroup, including ones that left the task's session."""
+        if self._created:
+            try:
+                self._write("cgroup.kill", 1)
+            except OSError:
+                # cgroup.kill needs Linux 5.14; the caller's killpg covers the session
+                pass
+
+    def _io(self):
+        read, written = 0, 0
+        for line in (self._read("io.stat") or "").splitlines():
+            fields = dict(f.split("=", 1) for f in line.split()[1:] if "=" in f)
+            read += int(fields.get("rbytes", 0))
+            written += int(fields.get("wbytes", 0))
+        return read, written
+
+    def usage(self):
+        if not self._created:
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            before = self._rusage if self._rusage else after
+            # ru_maxrss is the largest child the pool process ever waited for (an upper bound)
+            return {"source": "rusage",
+                    "cpu_seconds": (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime),
+                    "user_seconds": after.ru_utime - before.ru_utime,
+                    "system_seconds": after.ru_stime - before.ru_stime,
+                    "peak_memory_bytes": after.ru_maxrss * 1024,
+                    "io_read_bytes": (after.ru_inblock - before.ru_inblock) * 512,
+                    "io_write_bytes": (after.ru_oublock - before.ru_oublock) * 512}
+        cpu = TaskCgroup._keyed(self._read("cpu.stat"))
+        events = TaskCgroup._keyed(self._read("memory.events"))
+        # memory.peak needs Linux 5.19
+        peak = self._read("memory.peak") or self._read("memory.current")
+        pids = self._read("pids.peak")
+        read, written = self._io()
+        return {"source": "cgroup",
+                "cpu_seconds": cpu.get("usage_usec", 0) / 1e6,
+                "user_seconds": cpu.get("user_usec", 0) / 1e6,
+                "system_seconds": cpu.get("system_usec", 0) / 1e6,
+                "throttled_periods": cpu.get("nr_throttled", 0),
+                "periods": cpu.get("nr_periods", 0),
+                "throttled_seconds": cpu.get("throttled_usec", 0) / 1e6,
+                "peak_memory_bytes": int(peak) if peak else None,
+                "memory_high_events": events.get("high", 0),
+                "memory_max_events": events.get("max", 0),
+                "oom_kills": events.get("oom_kill", 0),
+                "peak_pids": int(pids) if pids else None,
+                "io_read_bytes": read,
+                "io_write_bytes": written}
+
+    def save(self, workspace: Folder, seconds):
+        usage = self.usage()
+        usage["wall_seconds"] = seconds
+        usage["cpu_utilization"] = usage["cpu_seconds"] / seconds if seconds > 0 else 0.0
+        with open(workspace.create().join(File(TaskCgroup.RESULTS)).path, "w") as f:
+            json.dump({"cgroup": self._path if self._created else None, "reason": self._reason,
+                       "limits": self._limits, "usage": usage}, f, indent=2)
+
+    def remove(self):
+        if self._path is None or not os.path.isdir(self._path):
+            return
+        # the directory can only go once the killed processes are reaped
+        for _ in range(50):
+            try:
+                os.rmdir(self._path)
+                return
+            except OSError:
+                time.sleep(0.02)
+        self._logger.warning("Couldn't remove cgroup %s", self._path)
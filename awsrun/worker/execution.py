@@ -0,0 +1,269 @@
+import os
+import signal
+import subprocess
+import time
+import traceback
+
+from common.commands import Compress, Decompress
+from common.configuration import CmdConfig
+from common.protocol import IOTask, IOBatch, IOSuite, AWSMsg
+from common.resources import File, Folder
+from worker.cache import InputCache
+from worker.cgroup import CgroupLimits, TaskCgroup
+from worker.noise import NoiseProbe
+from worker.scheduler import CoreScheduler
+from worker.suite import SuiteReport
+
+
+class CommandRun:
+    """One command of a task, with its stdout/stderr/exitcode written to its own folder."""
+
+    def __init__(self, command: CmdConfig, outputs: Folder):
+        self.command = command
+        self.outputs = outputs
+        self.status = None
+        self.timed_out = False
+        self.seconds = 0.0
+        self._process = None
+        self._started = None
+        self._stdout = None
+        self._stderr = None
+
+    def _output(self, name):
+        return self.outputs.join(File(name)).path
+
+    def start(self, cwd: Folder, env, preexec):
+        self.command.relativize()
+        self.outputs.create()
+        self._stdout = open(self._output(TaskExecution.STDOUT), "w")
+        self._stderr = open(self._output(TaskExecution.STDERR), "w")
+        self._started = time.time()
+        try:
+            # own session so a timeout takes down everything the command spawned
+            self._process = subprocess.Popen(self.command.shell, cwd=cwd.path, env=env, stdout=self._stdout,
+                                             stderr=self._stderr, start_new_session=True, preexec_fn=preexec)
+        except (OSError, subprocess.SubprocessError) as e:
+            self._stderr.write("Failed to start {0}: {1}\n".format(self.command.shell[0], e))
+            self._finish(127)
+        return self
+
+    def _finish(self, status):
+        self.status = status
+        self.seconds = time.time() - self._started
+        self._stdout.close()
+        self._stderr.close()
+        with open(self._output(TaskExecution.EXITCODE), "w") as f:
+            f.write("{0}\n".format(status))
+
+    def poll(self):
+        """True once the command is done; kills it when it runs past its timeout."""
+        if self.status is not None:
+            return True
+        status = self._process.poll()
+        if status is None:
+            if time.time() - self._started < self.command.timeout:
+                return False
+            os.killpg(self._process.pid, signal.SIGKILL)
+            status = self._process.wait()
+            self.timed_out = True
+            self._stderr.write("\nTask timed out after {0} seconds\n".format(self.command.timeout))
+        self._finish(status)
+        return True
+
+    def wait(self):
+        while not self.poll():
+            try:
+                self._process.wait(timeout=max(0.0, self._started + self.command.timeout - time.time()))
+            except subprocess.TimeoutExpired:
+                pass
+        return self
+
+
+class TaskExecution:
+    """Runs one IOTask in its own workspace under the worker root and packs its _out.tar.
+
+    The commands of an IOBatch run back-to-back, or concurrently on disjoint subsets of
+    the task's CPUs, each with its own stdout/stderr/exitcode folder; the top-level
+    stdout then lists every command's status and time. For an IOSuite it is the
+    pass/fail report instead (see SuiteReport)."""
+    STDOUT = "stdout"
+    STDERR = "stderr"
+    EXITCODE = "exitcode"
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, task: IOTask, root: Folder, cpus=None, source: Folder = None, limits: CgroupLimits = None,
+                 datasets=None):
+        self._task = task
+        self._root = root
+        self._cpus = cpus
+        # already extracted input tree (see InputCache); the _in.tar is used otherwise
+        self._source = source
+        self._limits = limits
+        # workspace-relative mount point -> extracted dataset in the worker's dataset cache
+        self._datasets = datasets if datasets else {}
+        self._cgroup = None
+        self._batch = isinstance(task, IOBatch)
+
+    @property
+    def workspace(self):
+        return self._root.join(self._task.workspace.root)
+
+    @property
+    def input(self):
+        return self._root.join(File(self._task.workspace.local_input))
+
+    @property
+    def output(self):
+        return self._root.join(File(self._task.workspace.local_output))
+
+    def _environment(self, command: CmdConfig, cpus):
+        env = dict(os.environ)
+        for var in command.env_vars:
+            key, _, value = var.partition("=")
+            env[key] = value
+        if cpus:
+            # size the Cilk runtime to the CPU set unless the task asks otherwise
+            env.setdefault("CILK_NWORKERS", str(len(cpus)))
+        # paths below the workspace are hashed relative to it, so the shared compile cache
+        # hits across tasks even though every task has its own workspace
+        env["CCACHE_BASEDIR"] = self.workspace.path
+        env.setdefault("CCACHE_NOHASHDIR", "1")
+        return env
+
+    def _confine(self, cpus):
+        if cpus:
+            os.sched_setaffinity(0, cpus)
+        self._cgroup.attach()
+
+    def _task_cgroup(self):
+        name = self._task.workspace.root.name
+        if self._limits:
+            return self._limits.task(name, self._task.cores)
+        return TaskCgroup(None, name, self._task.cores, None, None)
+
+    def _outputs(self, index):
+        if self._batch:
+            return self.workspace.join(Folder(IOBatch.output_folder(index)))
+        return self.workspace
+
+    def _mount(self):
+        for mount, path in self._datasets.items():
+            link = os.path.join(self.workspace.path, mount)
+            os.makedirs(os.path.dirname(link), exist_ok=True)
+            # symlinked, not copied: datasets are read-only and may be many GB
+            os.symlink(path, link)
+
+    def stage(self):
+        if self._source is not None:
+            InputCache.link(self._source, self.workspace)
+        else:
+            Decompress(self.workspace, self.input).execute()
+        self._mount()
+        return self.workspace
+
+    def _start(self, run: CommandRun, cpus):
+        return run.start(self.workspace, self._environment(run.command, cpus), lambda: self._confine(cpus))
+
+    def _run_sequential(self, runs):
+        for run in runs:
+            self._start(run, self._cpus[:run.command.cores] if self._cpus else None).wait()
+
+    def _run_concurrent(self, runs):
+        # the task's CPUs are packed the same way the worker packs tasks onto the machine
+        scheduler = CoreScheduler(self._cpus if self._cpus else None)
+        for index, run in enumerate(runs):
+            scheduler.submit(index, run.command.cores, run.command.timeout)
+        active = dict()
+        while scheduler.waiting or active:
+            for index, cpus in scheduler.schedule():
+                active[index] = self._start(runs[index], cpus)
+            for index in [index for index, run in active.items() if run.poll()]:
+                scheduler.release(index)
+                del active[index]
+            time.sleep(TaskExecution.POLL_INTERVAL)
+
+    def _summarize(self, runs):
+        with open(self.workspace.join(File(TaskExecution.STDOUT)).path, "w") as f:
+            for index, run in enumerate(runs):
+                f.write("{0:<6} exit {1:<4} {2:>8.2f} s{3}  {4}\n".format(
+                    IOBatch.output_folder(index), run.status, run.seconds, " (timed out)" if run.timed_out else "",
+                    " ".join(run.command.shell)))
+        open(self.workspace.join(File(TaskExecution.STDERR)).path, "a").close()
+        failed = [run.status for run in runs if run.status != 0]
+        return failed[0] if failed else 0
+
+    def _grade(self, runs):
+        report = SuiteReport(self._task, self.workspace)
+        for name, run, expected in zip(self._task.names, runs, self._task.expected):
+            report.check(name, run, expected)
+        report.write(self.workspace.join(File(TaskExecution.STDOUT)))
+        open(self.workspace.join(File(TaskExecution.STDERR)).path, "a").close()
+        return 0 if report.failed == 0 else 1
+
+    def run(self):
+        workspace = self.workspace.create()
+        runs = [CommandRun(command, self._outputs(index)) for index, command in enumerate(self._task.commands)]
+        self._cgroup = self._task_cgroup().create()
+        start = time.time()
+        try:
+            if self._task.concurrent:
+                self._run_concurrent(runs)
+            else:
+                self._run_sequential(runs)
+        finally:
+            # also takes down whatever escaped the commands' sessions
+            self._cgroup.kill()
+            self._cgroup.save(workspace, time.time() - start)
+            self._cgroup.remove()
+        if isinstance(self._task, IOSuite):
+            status = self._grade(runs)
+        elif self._batch:
+            status = self._summarize(runs)
+        else:
+            status = runs[0].status
+        return status, any(run.timed_out for run in runs)
+
+    def pack(self, status):
+        workspace = self.workspace.create()
+        with open(workspace.join(File(TaskExecution.EXITCODE)).path, "w") as f:
+            f.write("{0}\n".format(status))
+        members = [TaskExecution.STDOUT, TaskExecution.STDERR, TaskExecution.EXITCODE]
+        # a suite only returns its report, the diffs carry what matters about failed tests
+        if self._batch and not isinstance(self._task, IOSuite):
+            for index in range(len(self._task.commands)):
+                members.extend(os.path.join(IOBatch.output_folder(index), member) for member in members[:3])
+        if self._task.perf_file:
+            members.append(self._task.perf_file)
+        members.extend(self._task.artifacts)
+        return Compress(self.output, *map(File, members), root=workspace).execute()
+
+    def clean(self):
+        if self.workspace.exists():
+            self.workspace.remove()
+        for tar in (self.input, self.output):
+            if tar.exists():
+                tar.remove()
+
+    def execute(self):
+        start = time.time()
+        status, timed_out = None, False
+        try:
+            self.stage()
+            if self._task.benchmark:
+                with NoiseProbe(self._cpus) as probe:
+                    status, timed_out = self.run()
+                probe.save(self.workspace)
+            else:
+                status, timed_out = self.run()
+        except Exception:
+            with open(self.workspace.create().join(File(TaskExecution.STDERR)).path, "a") as stderr:
+                stderr.write("Worker failed to execute the task:\n{0}".format(traceback.format_exc()))
+        self.pack(status)
+        return {"status": status, "timed_out": timed_out, "seconds": time.time() - start,
+                "output": self.output.path}
+
+
+def execute(body: str, root: str, cpus=None, source: str = None, limits: CgroupLimits = None, datasets=None):
+    """Pool entry point: takes the raw message body so the task itself never crosses processes."""
+    return TaskExecution(AWSMsg.load(body), Folder(root), cpus, Folder(source) if source else None,
+                         limits, datasets).execute()
@@ -0,0 +1,174 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from collections import deque
+
+from botocore.exceptions import ClientError
+
+from common.resources import Folder
+
+
+class LocalBucket:
+    """Folder-backed stand-in for S3Handler, one sub-folder per bucket."""
+
+    def __init__(self, root: Folder):
+        self._root = root.create()
+
+    def _object(self, bucket_name, object_key):
+        return os.path.join(self._root.path, bucket_name, object_key)
+
+    def bucket_exists(self, bucket_name):
+        return os.path.isdir(os.path.join(self._root.path, bucket_name))
+
+    def object_exists(self, bucket_name, object_key):
+        return os.path.exists(self._object(bucket_name, object_key))
+
+    def object_etag(self, bucket_name, object_key):
+        source = self._object(bucket_name, object_key)
+        if not os.path.exists(source):
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+        # single-part S3 ETags are the MD5 of the content
+        digest = hashlib.md5()
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def list_objects(self, bucket_name, prefix=""):
+        folder = os.path.join(self._root.path, bucket_name)
+        objects = []
+        for path, _, files in os.walk(folder):
+            for name in files:
+                key = os.path.relpath(os.path.join(path, name), folder)
+                if key.startswith(prefix):
+                    st = os.stat(os.path.join(path, name))
+                    objects.append({"key": key, "size": st.st_size,
+                                    "last_modified": datetime.fromtimestamp(st.st_mtime, timezone.utc)})
+        return sorted(objects, key=lambda o: o["key"])
+
+    def upload_file(self, local_file_path, bucket_name, object_key, file_size_mb=None, sse_key=None, metadata=None):
+        target = self._object(bucket_name, object_key)
+        Folder(os.path.dirname(target)).create()
+        shutil.copyfile(local_file_path, target)
+        return {}
+
+    def upload_bucket_private(self, local_file_path, bucket_name, object_key, file_size_mb=None):
+        return self.upload_file(local_file_path, bucket_name, object_key, file_size_mb)
+
+    def download_file(self, bucket_name, object_key, target_path, file_size_mb=None, sse_key=None):
+        source = self._object(bucket_name, object_key)
+        if not os.path.exists(source):
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+        Folder(os.path.dirname(target_path)).create()
+        shutil.copyfile(source, target_path)
+
+
+class LocalMessage:
+    """One delivery of a message; every receive hands out a new receipt handle, like SQS."""
+
+    def __init__(self, queue, body, message_attributes=None, message_id=None, receipt_handle=None, received=0):
+        self._queue = queue
+        self.body = body
+        self.message_attributes = message_attributes or {}
+        self.message_id = message_id if message_id else str(uuid.uuid4())
+        self.receipt_handle = receipt_handle
+        self.attributes = {"ApproximateReceiveCount": str(received)}
+
+    def deliver(self):
+        return LocalMessage(self._queue, self.body, self.message_attributes, self.message_id, str(uuid.uuid4()),
+                            int(self.attributes["ApproximateReceiveCount"]) + 1)
+
+    def delete(self):
+        self._queue.delete_message(self)
+
+    def change_visibility(self, VisibilityTimeout):
+        self._queue.change_message_visibility(self, VisibilityTimeout)
+
+
+class LocalQueue:
+    """In-process stand-in for an SQS queue together with the SqsHandler calls on it.
+
+    Received messages stay in flight until deleted; they become visible again once their
+    visibility timeout lapses, like on SQS."""
+
+    def __init__(self, visibility_timeout=30):
+        self._visible = deque()
+        self._inflight = dict()
+        self._visibility_timeout = visibility_timeout
+        self._cond = threading.Condition()
+        self.url = "local://{0}".format(uuid.uuid4())
+        # deliveries, including redeliveries after a lapsed visibility timeout
+        self.received = 0
+
+    @property
+    def attributes(self):
+        with self._cond:
+            self._expire()
+            return {"ApproximateNumberOfMessages": str(len(self._visible)),
+                    "ApproximateNumberOfMessagesNotVisible": str(len(self._inflight)),
+                    "VisibilityTimeout": str(self._visibility_timeout)}
+
+    def _expire(self):
+        now = time.time()
+        for handle, (message, deadline) in list(self._inflight.items()):
+            if deadline <= now:
+                del self._inflight[handle]
+                self._visible.appendleft(message)
+
+    def send_message(self, queue, message_body, message_attributes={}):
+        with self._cond:
+            message = LocalMessage(self, message_body, message_attributes)
+            self._visible.append(message)
+            self._cond.notify_all()
+        return {"MessageId": message.message_id}
+
+    def receive_messages(self, queue, max_number, wait_time=None, attribute_names=None):
+        deadline = time.time() + (wait_time or 0)
+        with self._cond:
+            self._expire()
+            while not self._visible and time.time() < deadline:
+                self._cond.wait(max(0.0, min(0.1, deadline - time.time())))
+                self._expire()
+            messages = []
+            while self._visible and len(messages) < max_number:
+                message = self._visible.popleft().deliver()
+                self._inflight[message.receipt_handle] = (message, time.time() + self._visibility_timeout)
+                messages.append(message)
+            self.received += len(messages)
+            return messages
+
+    def change_message_visibility(self, message, visibility_timeout):
+        with self._cond:
+            if message.receipt_handle in self._inflight:
+                self._inflight[message.receipt_handle] = (message, time.time() + visibility_timeout)
+                if visibility_timeout == 0:
+                    self._expire()
+                    self._cond.notify_all()
+
+    def change_message_visibility_batch(self, queue, messages, visibility_timeout):
+        for message in messages:
+            self.change_message_visibility(message, visibility_timeout)
+        return {"Successful": [{"Id": str(ind)} for ind in range(len(messages))]}
+
+    def delete_message(self, message):
+        # a stale receipt handle (visibility lapsed) deletes nothing
+        with self._cond:
+            self._inflight.pop(message.receipt_handle, None)
+
+    def delete_messages(self, queue, messages):
+        for message in messages:
+            self.delete_message(message)
+        return {"Successful": [{"Id": str(ind)} for ind in range(len(messages))]}
+
+    @staticmethod
+    def get_message_cnt(queue):
+        return int(queue.attributes['ApproximateNumberOfMessages'])
+
+    @staticmethod
+    def get_queue_depth(queue):
+        attributes = queue.attributes
+        return int(attributes['ApproximateNumberOfMessages']), int(attributes['ApproximateNumberOfMessagesNotVisible'])
@@ -0,0 +1,107 @@
+import json
+import os
+import statistics
+import time
+
+from common.resources import Folder, File
+
+
+class NoiseProbe:
+    """Quiets the CPUs of a benchmark task and estimates how noisy they were.
+
+    The frequency governor of every CPU is switched to `performance` where the worker is
+    allowed to (it is restored afterwards), and a fixed calibration loop is timed on each
+    CPU before and after the task. The spread of the loop times (coefficient of
+    variation) and the shift between the two rounds (drift) go to noise.json next to the
+    task's results, so a change smaller than the noise can be told apart from a speedup."""
+    RESULTS = "noise.json"
+    GOVERNOR = "/sys/devices/system/cpu/cpu{0}/cpufreq/scaling_governor"
+    # about 5 ms of interpreter work per sample on current hardware
+    ITERATIONS = 100000
+
+    def __init__(self, cpus, samples=10):
+        self._cpus = sorted(cpus) if cpus else sorted(os.sched_getaffinity(0))
+        self._samples = samples
+        self._governors = dict()
+        self._governor = None
+        self._before = []
+        self._after = []
+
+    @staticmethod
+    def _loop():
+        start = time.perf_counter()
+        acc = 0
+        for i in range(NoiseProbe.ITERATIONS):
+            acc += i * i
+        return time.perf_counter() - start
+
+    def _calibrate(self):
+        affinity = os.sched_getaffinity(0)
+        samples = []
+        try:
+            for cpu in self._cpus:
+                os.sched_setaffinity(0, [cpu])
+                # first pass warms up the cache and lets the clock ramp
+                NoiseProbe._loop()
+                samples.extend(NoiseProbe._loop() for _ in range(self._samples))
+        finally:
+            os.sched_setaffinity(0, affinity)
+        return samples
+
+    def _set_governors(self, governor):
+        for cpu in self._cpus:
+            current = None
+            try:
+                with open(NoiseProbe.GOVERNOR.format(cpu)) as f:
+                    current = f.read().strip()
+                if current != governor:
+                    with open(NoiseProbe.GOVERNOR.format(cpu), "w") as f:
+                        f.write(governor)
+                    self._governors[cpu] = current
+            except FileNotFoundError:
+                # no cpufreq driver (most virtual machines): the hypervisor decides
+                return "unavailable"
+            except PermissionError:
+                return "unchanged ({0})".format(current) if current else "unchanged"
+        return governor
+
+    def _restore_governors(self):
+        for cpu, governor in self._governors.items():
+            try:
+                with open(NoiseProbe.GOVERNOR.format(cpu), "w") as f:
+                    f.write(governor)
+            except OSError:
+                pass
+        self._governors.clear()
+
+    def __enter__(self):
+        self._governor = self._set_governors("performance")
+        self._before = self._calibrate()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self._after = self._calibrate()
+        finally:
+            self._restore_governors()
+
+    @staticmethod
+    def summary(samples):
+        if not samples:
+            return {"samples": 0}
+        mean = statistics.mean(samples)
+        stdev = statistics.stdev(samples) if len(samples) > 1 else 0.0
+        return {"samples": len(samples), "mean": mean, "min": min(samples), "max": max(samples),
+                "stdev": stdev, "cv": stdev / mean if mean > 0 else 0.0}
+
+    def to_json(self):
+        before = NoiseProbe.summary(self._before)
+        after = NoiseProbe.summary(self._after)
+        overall = NoiseProbe.summary(self._before + self._after)
+        drift = (after["mean"] - before["mean"]) / before["mean"] if self._before and self._after else 0.0
+        return {"cpus": self._cpus, "governor": self._governor, "before": before, "after": after,
+                "cv": overall.get("cv", 0.0), "drift": drift}
+
+    def save(self, workspace: Folder):
+        with open(workspace.create().join(File(NoiseProbe.RESULTS)).path, "w") as f:
+            json.dump(self.to_json(), f, indent=2)
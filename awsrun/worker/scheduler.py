@@ -0,0 +1,135 @@
+import os
+import time
+from collections import deque
+
+
+class CoreRequest:
+    def __init__(self, key, cores, runtime, isolated=False):
+        self.key = key
+        self.cores = cores
+        # upper bound on how long the task holds its cores; the task timeout guarantees it
+        self.runtime = runtime
+        # whole physical cores: SMT siblings are reserved but left idle
+        self.isolated = isolated
+
+
+def smt_siblings(cpu):
+    try:
+        with open("/sys/devices/system/cpu/cpu{0}/topology/thread_siblings_list".format(cpu)) as f:
+            listing = f.read().strip()
+    except OSError:
+        return (cpu,)
+    siblings = []
+    for part in listing.split(","):
+        first, _, last = part.partition("-")
+        siblings.extend(range(int(first), int(last if last else first) + 1))
+    return tuple(sorted(siblings))
+
+
+class CoreScheduler:
+    """Packs tasks onto disjoint CPU sets of one machine.
+
+    Requests start in arrival order while they fit. Once the head request does not fit it
+    gets a reservation at the earliest time enough cores are released (its shadow time),
+    and later requests are backfilled only if they end before that time or use cores the
+    head will not need (EASY backfilling).
+
+    Isolated requests (low-noise benchmarks) get whole physical cores, taken from the top
+    of the CPU range away from CPU 0 and its interrupt load, with their SMT siblings
+    reserved so no other task shares the core."""
+
+    def __init__(self, cpus=None, topology=smt_siblings):
+        self._cpus = sorted(cpus if cpus is not None else os.sched_getaffinity(0))
+        self._free = set(self._cpus)
+        self._running = dict()
+        self._waiting = deque()
+        self._cores = dict()
+        for cpu in self._cpus:
+            self._cores.setdefault(tuple(c for c in topology(cpu) if c in self._cpus), None)
+
+    @property
+    def capacity(self):
+        return len(self._cpus)
+
+    @property
+    def free(self):
+        return len(self._free)
+
+    @property
+    def waiting(self):
+        return len(self._waiting)
+
+    @property
+    def running(self):
+        return len(self._running)
+
+    def submit(self, key, cores, runtime, isolated=False):
+        # a request larger than the machine gets the whole machine rather than starving
+        limit = len(self._cores) if isolated else self.capacity
+        self._waiting.append(CoreRequest(key, max(1, min(cores, limit)), runtime, isolated))
+
+    def cancel(self, key):
+        self._waiting = deque(r for r in self._waiting if r.key != key)
+
+    def release(self, key):
+        cpus, _ = self._running.pop(key)
+        self._free.update(cpus)
+
+    def _free_cores(self):
+        return [core for core in self._cores if all(c in self._free for c in core)]
+
+    def _fits(self, request: CoreRequest):
+        if request.isolated:
+            return request.cores <= len(self._free_cores())
+        return request.cores <= len(self._free)
+
+    def _footprint(self, request: CoreRequest):
+        if request.isolated:
+            return request.cores * max(map(len, self._cores))
+        return request.cores
+
+    def _start(self, request: CoreRequest, now):
+        if request.isolated:
+            cores = sorted(self._free_cores(), reverse=True)[:request.cores]
+            reserved = [c for core in cores for c in core]
+            cpus = sorted(core[0] for core in cores)
+        else:
+            reserved = cpus = sorted(self._free)[:request.cores]
+        self._free.difference_update(reserved)
+        self._running[request.key] = (reserved, now + request.runtime)
+        return request.key, cpus
+
+    def _shadow(self, head: CoreRequest, now):
+        """(shadow time, cores left over for others at that time) for the blocked head request."""
+        available = len(self._free)
+        shadow = now
+        needed = self._footprint(head)
+        for end, cores in sorted((end, len(cpus)) for cpus, end in self._running.values()):
+            if available >= needed:
+                break
+            available += cores
+            shadow = end
+        return shadow, available - needed
+
+    def schedule(self, now=None):
+        """Starts whatever can start now; returns [(key, cpus)]."""
+        now = time.time() if now is None else now
+        started = []
+        while self._waiting and self._fits(self._waiting[0]):
+            started.append(self._start(self._waiting.popleft(), now))
+        if not self._waiting:
+            return started
+
+        shadow, extra = self._shadow(self._waiting[0], now)
+        for request in list(self._waiting)[1:]:
+            if not self._fits(request):
+                continue
+            if now + request.runtime <= shadow:
+                started.append(self._start(request, now))
+            elif self._footprint(request) <= extra:
+                extra -= self._footprint(request)
+                started.append(self._start(request, now))
+            else:
+                continue
+            self._waiting.remove(request)
+        return started
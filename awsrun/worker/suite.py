@@ -0,0 +1,75 @@
+import difflib
+import json
+import os
+
+from common.protocol import IOSuite
+from common.resources import Folder, File
+
+
+class SuiteReport:
+    """Compares the outputs of an IOSuite's tests with their expected files.
+
+    Passing tests are reported by name only; a failing test gets the unified diff of
+    every stream that differs, cut to MAX_DIFF lines so one broken test cannot bury the
+    rest of the report."""
+    MAX_DIFF = 40
+
+    def __init__(self, suite: IOSuite, workspace: Folder):
+        self._suite = suite
+        self._workspace = workspace
+        self._results = []
+
+    @staticmethod
+    def _read(path):
+        with open(path, errors="replace") as f:
+            return f.read()
+
+    def _diff(self, stream, expected_path, actual_path):
+        try:
+            expected = SuiteReport._read(os.path.join(self._workspace.path, expected_path))
+        except FileNotFoundError:
+            return ["expected {0} file {1} is missing from the submission".format(stream, expected_path)]
+        actual = SuiteReport._read(actual_path)
+        if expected == actual:
+            return []
+        diff = list(difflib.unified_diff(expected.splitlines(), actual.splitlines(),
+                                         "expected/" + stream, "actual/" + stream, lineterm=""))
+        if not diff:
+            # only trailing newlines differ
+            diff = ["{0} differs in trailing whitespace".format(stream)]
+        if len(diff) > SuiteReport.MAX_DIFF:
+            diff = diff[:SuiteReport.MAX_DIFF] + ["... {0} more lines".format(len(diff) - SuiteReport.MAX_DIFF)]
+        return diff
+
+    def check(self, name, run, expected):
+        """run is the finished CommandRun of the test, expected its entry of IOSuite.expected."""
+        failures = []
+        if run.timed_out:
+            failures.append("timed out after {0} seconds".format(run.command.timeout))
+        elif "exitcode" in expected and run.status != expected["exitcode"]:
+            failures.append("exit code {0}, expected {1}".format(run.status, expected["exitcode"]))
+        for stream in ("stdout", "stderr"):
+            if stream in expected:
+                failures.extend(self._diff(stream, expected[stream], run.outputs.join(File(stream)).path))
+        self._results.append({"name": name, "passed": not failures, "status": run.status,
+                              "timed_out": run.timed_out, "seconds": run.seconds, "failures": failures})
+
+    @property
+    def passed(self):
+        return sum(result["passed"] for result in self._results)
+
+    @property
+    def failed(self):
+        return len(self._results) - self.passed
+
+    def write(self, stdout: File):
+        with open(stdout.path, "w") as f:
+            for result in self._results:
+                f.write("{0:<4} {1:<32} {2:>8.2f} s\n".format("PASS" if result["passed"] else "FAIL", result["name"],
+                                                             result["seconds"]))
+            for result in filter(lambda r: not r["passed"], self._results):
+                f.write("\n---- {0} ----\n".format(result["name"]))
+                f.write("\n".join(result["failures"]) + "\n")
+            f.write("\n{0} passed, {1} failed\n".format(self.passed, self.failed))
+        with open(self._workspace.join(File(IOSuite.REPORT)).path, "w") as f:
+            json.dump({"passed": self.passed, "failed": self.failed, "tests": self._results}, f, indent=2)
@@ -0,0 +1,314 @@
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from botocore.exceptions import ClientError
+
+from aws import get_file_size
+from common.configuration import WorkerStatus
+from common.protocol import AWSMsg, IOTask
+from common.resources import Folder, File
+from worker.execution import TaskExecution, execute
+from worker.scheduler import CoreScheduler
+from worker.cache import InputCache
+from worker.cgroup import CgroupLimits
+
+
+class WorkerStats:
+    def __init__(self):
+        self.started = time.time()
+        self.received = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.busy = 0.0
+        self.extended = 0
+
+    @property
+    def throughput(self):
+        elapsed = time.time() - self.started
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+    def to_json(self):
+        return {"received": self.received, "completed": self.completed, "failed": self.failed,
+                "timed_out": self.timed_out, "busy_seconds": self.busy, "visibility_extensions": self.extended,
+                "elapsed_seconds": time.time() - self.started, "tasks_per_second": self.throughput}
+
+
+class InFlight:
+    """A received message the worker owns until it is deleted or handed back."""
+
+    def __init__(self, message, visibility):
+        self.message = message
+        self.task = None
+        self.source = None
+        # [(DatasetRef, cached Folder)] pinned in the dataset cache
+        self.datasets = []
+        self.deadline = time.time() + visibility
+
+    @property
+    def key(self):
+        return self.message.message_id
+
+
+class Worker(ABC):
+    @abstractmethod
+    def serve(self, max_tasks=None):
+        pass
+
+
+class AWSWorker(Worker):
+    """Long-polls the task queue and runs IOTasks in a bounded process pool, packed onto
+    disjoint CPU sets by a CoreScheduler."""
+    # SQS caps batch calls and a single receive at 10 messages
+    BATCH = 10
+    # finished messages are deleted at the latest this many seconds after completion
+    FLUSH_INTERVAL = 1.0
+    # finished tasks reported in the status
+    RECENT = 20
+
+    def __init__(self, s3handler, sqshandler, queue, bucket: str, root: Folder, scheduler: CoreScheduler = None,
+                 wait_time=20, prefetch=None, cache: InputCache = None, visibility=None, limits: CgroupLimits = None,
+                 datasets: InputCache = None, worker_id=None):
+        self._s3 = s3handler
+        self._sqs = sqshandler
+        self._queue = queue
+        self._bucket = bucket
+        self._root = root.create()
+        self._scheduler = scheduler if scheduler else CoreScheduler()
+        self._prefetch = prefetch if prefetch else self._scheduler.capacity
+        self._cache = cache
+        # registered dataset versions never change, so one cache entry serves every task using it
+        self._datasets = datasets if datasets else InputCache(self._root.join(Folder("datasets")))
+        self._limits = limits
+        self._wait_time = wait_time
+        self._visibility = visibility if visibility else int(queue.attributes.get('VisibilityTimeout', 30))
+        self._held = dict()
+        self._fetching = dict()
+        self._staged = dict()
+        self._running = dict()
+        self._finished = []
+        self._flushed = time.time()
+        self._stopped = False
+        self._stats = WorkerStats()
+        self._worker_id = worker_id
+        self._recent = deque(maxlen=AWSWorker.RECENT)
+        self._idle_since = time.time()
+        self._reported = None
+        self._logger = logging.getLogger(AWSWorker.__name__)
+
+    @property
+    def stats(self):
+        return self._stats
+
+    def stop(self):
+        self._stopped = True
+
+    def _receive(self, max_number, wait_time):
+        return self._sqs.receive_messages(self._queue, min(max_number, AWSWorker.BATCH), wait_time=wait_time,
+                                          attribute_names=['All'])
+
+    def _batches(self, flights):
+        for i in range(0, len(flights), AWSWorker.BATCH):
+            yield flights[i:i + AWSWorker.BATCH]
+
+    def _fetch_input(self, task: IOTask):
+        """Returns the cached input tree, or None when the _in.tar was downloaded for extraction."""
+        key = task.workspace.input.key
+        if self._cache is None:
+            self._s3.download_file(self._bucket, key, self._root.join(File(task.workspace.local_input)).path)
+            return None
+        return self._cache.acquire(self._s3.object_etag(self._bucket, key),
+                                   lambda path: self._s3.download_file(self._bucket, key, path))
+
+    def _fetch_datasets(self, task: IOTask):
+        refs = {str(ref): ref for command in task.commands for ref in command.datasets}
+        fetched = []
+        try:
+            for ref in refs.values():
+                fetched.append((ref, self._datasets.acquire(
+                    str(ref), lambda path, key=ref.key: self._s3.download_file(self._bucket, key, path))))
+        except Exception:
+            self._release_datasets(fetched)
+            raise
+        return fetched
+
+    def _release_datasets(self, datasets):
+        for ref, _ in datasets:
+            self._datasets.release(str(ref))
+
+    def _fetch(self, task: IOTask):
+        datasets = self._fetch_datasets(task)
+        try:
+            return self._fetch_input(task), datasets
+        except Exception:
+            self._release_datasets(datasets)
+            raise
+
+    def _publish(self, task: IOTask, output: File):
+        self._s3.upload_bucket_private(output.path, self._bucket, task.workspace.output.key,
+                                       get_file_size(output.path))
+
+    def _heartbeat(self):
+        """Extends the visibility of every held message whose timeout is within a third of lapsing."""
+        now = time.time()
+        due = [f for f in self._held.values() if f.deadline - now < self._visibility / 3]
+        for batch in self._batches(due):
+            self._sqs.change_message_visibility_batch(self._queue, [f.message for f in batch], self._visibility)
+            for flight in batch:
+                flight.deadline = now + self._visibility
+            self._stats.extended += len(batch)
+
+    def _report(self, force=False):
+        if self._worker_id is None:
+            return
+        now = time.time()
+        busy = bool(self._held)
+        if busy:
+            self._idle_since = None
+        elif self._idle_since is None:
+            self._idle_since = now
+        if not force and self._reported is not None and self._reported[0] == busy \
+                and now - self._reported[1] < WorkerStatus.INTERVAL:
+            return
+        status = WorkerStatus(self._worker_id, self._scheduler.capacity, len(self._held), self._idle_since,
+                              list(self._recent), now)
+        target = self._root.join(File("status.json"))
+        with open(target.path, "w") as f:
+            json.dump(status.to_json(), f)
+        try:
+            self._s3.upload_bucket_private(target.path, self._bucket, status.key, get_file_size(target.path))
+        except ClientError:
+            # the next report tries again; a stale status only makes the autoscaler more careful
+            self._logger.exception("Couldn't upload the worker status")
+        self._reported = (busy, now)
+
+    def _forget(self, flight: InFlight):
+        self._held.pop(flight.key, None)
+        self._finished.append(flight)
+
+    def _flush(self, force=False):
+        if not self._finished:
+            return
+        if not force and len(self._finished) < AWSWorker.BATCH \
+                and time.time() - self._flushed < AWSWorker.FLUSH_INTERVAL:
+            return
+        for batch in self._batches(self._finished):
+            self._sqs.delete_messages(self._queue, [f.message for f in batch])
+        self._finished = []
+        self._flushed = time.time()
+
+    def _hand_back(self):
+        """Makes messages that were received but never started visible again right away."""
+        flights = list(self._staged.values())
+        for batch in self._batches(flights):
+            self._sqs.change_message_visibility_batch(self._queue, [f.message for f in batch], 0)
+        for flight in flights:
+            self._held.pop(flight.key, None)
+            self._scheduler.cancel(flight.key)
+            if flight.source is not None:
+                self._cache.release(flight.source.name)
+            self._release_datasets(flight.datasets)
+        self._staged.clear()
+
+    def _prefetch_task(self, fetcher, message):
+        self._stats.received += 1
+        flight = InFlight(message, self._visibility)
+        try:
+            flight.task = AWSMsg.load(message.body)
+        except Exception:
+            self._logger.exception("Dropping malformed message %s", message.message_id)
+            self._stats.failed += 1
+            self._finished.append(flight)
+            return
+        self._held[flight.key] = flight
+        self._fetching[fetcher.submit(self._fetch, flight.task)] = flight
+
+    def _stage(self, future):
+        flight = self._fetching.pop(future)
+        try:
+            flight.source, flight.datasets = future.result()
+        except Exception:
+            # missing or corrupt input: give the message up; it becomes visible again and is retried
+            # until its input is fixed or it is dead-lettered
+            self._logger.exception("Couldn't stage the input of message %s", flight.key)
+            self._held.pop(flight.key, None)
+            self._stats.failed += 1
+            return
+        self._staged[flight.key] = flight
+        self._scheduler.submit(flight.key, flight.task.cores, flight.task.timeout,
+                               isolated=flight.task.benchmark)
+
+    def _dispatch(self, pool):
+        for key, cpus in self._scheduler.schedule():
+            flight = self._staged.pop(key)
+            source = flight.source.path if flight.source else None
+            datasets = {ref.mount: folder.path for ref, folder in flight.datasets}
+            self._running[pool.submit(execute, flight.message.body, self._root.path, cpus, source,
+                                      self._limits, datasets)] = flight
+
+    def _complete(self, future):
+        flight = self._running.pop(future)
+        task = flight.task
+        self._scheduler.release(flight.key)
+        if flight.source is not None:
+            self._cache.release(flight.source.name)
+        self._release_datasets(flight.datasets)
+        try:
+            result = future.result()
+            self._publish(task, File(result["output"]))
+        except Exception:
+            self._logger.exception("Task of message %s failed", flight.key)
+            self._held.pop(flight.key, None)
+            self._stats.failed += 1
+            return
+        finally:
+            TaskExecution(task, self._root).clean()
+        self._forget(flight)
+        self._recent.append([result["seconds"], task.cores])
+        self._stats.completed += 1
+        self._stats.busy += result["seconds"]
+        self._stats.timed_out += int(result["timed_out"])
+        self._logger.info("Task %s finished with status %s in %.2fs", task.workspace.root.name,
+                          result["status"], result["seconds"])
+
+    def serve(self, max_tasks=None):
+        """Runs until stop() or until max_tasks messages were handled; returns the stats."""
+        with ProcessPoolExecutor(max_workers=self._scheduler.capacity) as pool, \
+                ThreadPoolExecutor(max_workers=1) as fetcher:
+            # a single fetching thread: S3 transfers are multipart-parallel already and the
+            # boto3 resource behind the handler is not meant to be shared across threads
+            while not self._stopped or self._running or self._fetching:
+                self._heartbeat()
+                self._report()
+                handled = self._stats.received
+                room = self._prefetch - len(self._fetching) - len(self._staged)
+                if max_tasks is not None:
+                    room = min(room, max_tasks - handled)
+                if room > 0 and not self._stopped:
+                    # only block on the queue when the worker holds nothing
+                    for message in self._receive(room, 0 if self._held else self._wait_time):
+                        self._prefetch_task(fetcher, message)
+                elif max_tasks is not None and handled >= max_tasks and not self._held:
+                    break
+                if self._stopped:
+                    self._hand_back()
+                else:
+                    self._dispatch(pool)
+                waiting = list(self._running) + list(self._fetching)
+                if waiting:
+                    done, _ = wait(waiting, timeout=AWSWorker.FLUSH_INTERVAL, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future in self._fetching:
+                            self._stage(future)
+                        else:
+                            self._complete(future)
+                self._flush()
+            self._hand_back()
+            self._flush(force=True)
+            self._report(force=True)
+        self._logger.info("Worker stats: %s", self._stats.to_json())
+        return self._stats
@@ -0,0 +1,61 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+// STREAM-style triad a = b + s * c over arrays larger than the last-level cache;
+// prints the best of `reps` passes in MB/s
+static double now() {
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return ts.tv_sec + ts.tv_nsec * 1e-9;
+}
+
+int main(int argc, char* argv[]) {
+  size_t n = 1 << 22;
+  int reps = 10;
+
+  if (argc > 1) {
+    n = strtoull(argv[1], NULL, 10);
+  }
+  if (argc > 2) {
+    reps = atoi(argv[2]);
+  }
+
+  double *a = malloc(n * sizeof(double));
+  double *b = malloc(n * sizeof(double));
+  double *c = malloc(n * sizeof(double));
+  if (!a || !b || !c) {
+    fprintf(stderr, "out of memory\n");
+    return 1;
+  }
+  for (size_t i = 0; i < n; i++) {
+    a[i] = 0.0;
+    b[i] = 1.0;
+    c[i] = 2.0;
+  }
+
+  double best = 1e30;
+  for (int r = 0; r < reps; r++) {
+    double start = now();
+    for (size_t i = 0; i < n; i++) {
+      a[i] = b[i] + 3.0 * c[i];
+    }
+    double elapsed = now() - start;
+    if (elapsed < best) {
+      best = elapsed;
+    }
+  }
+
+  // keeps the stores from being optimized away
+  double check = 0.0;
+  for (size_t i = 0; i < n; i += 4096) {
+    check += a[i];
+  }
+  fprintf(stderr, "check %f\n", check);
+
+  printf("%.1f\n", 3.0 * n * sizeof(double) / best / 1e6);
+  free(a);
+  free(b);
+  free(c);
+  return 0;
+}
@@ -0,0 +1,131 @@
+"""Autoscaler.step and the SSM polling of the fleet code against the stand-ins of fleet.local and worker.local;
+run with python -m pytest test/test_autoscaler.py."""
+import json
+import sys
+import time
+from os import path
+
+sys.path.append(path.join(path.dirname(path.dirname(path.abspath(__file__))), "awsrun"))
+
+from common.configuration import WorkerStatus
+from common.resources import Folder
+from fleet.autoscaler import Autoscaler, ScalingPolicy
+from fleet.bake import ImageBaker
+from fleet.local import LocalInstanceUtility, LocalLauncher, LocalSSM
+from fleet.pool import WarmPool
+from fleet.readiness import ReadinessWaiter
+from worker.local import LocalBucket, LocalQueue
+
+BUCKET = "awsrun-test"
+TAG = ("awsrun", "worker")
+LAUNCH = {"key_name": "key", "sg_id": "sg-1", "subnet_id": "subnet-1", "img_id": "ami-1", "instance_type": "c5.large"}
+
+
+class Fleet:
+    def __init__(self, tmp_path, **policy):
+        self.tmp_path = tmp_path
+        self.launcher = LocalLauncher(TAG)
+        self.bucket = LocalBucket(Folder(str(tmp_path / "s3")))
+        Folder(str(tmp_path / "s3" / BUCKET)).create()
+        self.queue = LocalQueue()
+        # one task of 60 core-seconds per message, two CPUs a worker, drained within a minute
+        settings = dict(max_workers=3, drain_seconds=60, default_seconds=60, cpus_per_worker=2,
+                        scale_out_cooldown=60, scale_in_cooldown=300)
+        settings.update(policy)
+        self.autoscaler = Autoscaler(self.launcher, self.bucket, self.queue, self.queue, BUCKET,
+                                     ScalingPolicy(**settings), launch=LAUNCH, boot_grace=1000)
+
+    def send(self, count):
+        for _ in range(count):
+            self.queue.send_message(self.queue, "{}")
+
+    def drain(self):
+        messages = self.queue.receive_messages(self.queue, 10)
+        while messages:
+            self.queue.delete_messages(self.queue, messages)
+            messages = self.queue.receive_messages(self.queue, 10)
+
+    def report(self, instance, held, idle_since, when):
+        status = WorkerStatus(instance.id, 2, held, idle_since, [], when)
+        source = self.tmp_path / "status.json"
+        source.write_text(json.dumps(status.to_json()))
+        self.bucket.upload_file(str(source), BUCKET, status.key)
+
+    def running(self):
+        return [i.id for i in self.launcher.all_instances() if i.state['Name'] in Autoscaler.ACTIVE]
+
+
+def test_scales_out_to_max(tmp_path):
+    fleet = Fleet(tmp_path)
+    fleet.send(100)
+
+    decision = fleet.autoscaler.step()
+
+    assert decision["desired"] == 3
+    assert len(decision["started"]) == 3
+    assert len(fleet.running()) == 3
+
+
+def test_scale_out_waits_for_its_cooldown(tmp_path):
+    fleet = Fleet(tmp_path)
+    start = time.time()
+    fleet.send(1)
+    assert len(fleet.autoscaler.step(start)["started"]) == 1
+
+    fleet.send(5)
+    assert fleet.autoscaler.step(start + 10)["started"] == []
+    assert len(fleet.autoscaler.step(start + 61)["started"]) == 2
+    assert len(fleet.running()) == 3
+
+
+def test_scale_in_keeps_busy_and_booting_workers(tmp_path):
+    fleet = Fleet(tmp_path, min_workers=1, max_workers=4)
+    start = time.time()
+    fleet.send(100)
+    fleet.autoscaler.step(start)
+    busy, idle, idler, booting = fleet.launcher.all_instances()
+    fleet.drain()
+
+    def report(now):
+        fleet.report(busy, 1, None, now)
+        fleet.report(idle, 0, start + 50, now)
+        fleet.report(idler, 0, start + 20, now)
+
+    # nothing is stopped within the scale-in cooldown of the last scale-out
+    report(start + 100)
+    assert fleet.autoscaler.step(start + 100)["stopped"] == []
+
+    # one worker is wanted, but only the idle ones may go, most idle first
+    report(start + 400)
+    decision = fleet.autoscaler.step(start + 400)
+    assert decision["desired"] == 1
+    assert decision["stopped"] == [idler.id, idle.id]
+    assert sorted(fleet.running()) == sorted([busy.id, booting.id])
+
+
+def test_local_ssm_does_not_know_a_command_at_first(tmp_path):
+    launcher = LocalLauncher(TAG)
+    instance = launcher.launch_instance(num_inst=1, **LAUNCH)[0]
+    ssm = LocalSSM(launcher)
+    cmd_id = ssm.run_cmd_on_inst(WarmPool.READY, instance.id)["Command"]["CommandId"]
+
+    assert ssm.cmd_status(cmd_id, instance.id) == "Failed"
+    assert ssm.cmd_status(cmd_id, instance.id) == "Success"
+    other = ssm.run_cmd_on_inst(WarmPool.READY, instance.id)["Command"]["CommandId"]
+    assert WarmPool.command_status(ssm, other, instance.id, time.time()) == "Pending"
+    assert WarmPool.command_status(ssm, other, instance.id, time.time()) == "Success"
+
+
+def test_bake_waits_for_ssm_to_know_its_commands(tmp_path):
+    launcher = LocalLauncher(("awsrun", "builder"))
+    ssm = LocalSSM(launcher, stdout="clang=clang version 17\nkernel=6.1\n")
+    waiter = ReadinessWaiter(LocalInstanceUtility(launcher), ssm, min_interval=0.01)
+    launch = {k: v for k, v in LAUNCH.items() if k != "img_id"}
+    baker = ImageBaker(launcher, ssm, waiter, launch, setup_timeout=30, poll_interval=0.01)
+
+    image_id, name, versions = baker.bake("awsrun-worker", "ami-base", "#!/bin/sh\n")
+
+    assert name == "awsrun-worker.1"
+    assert versions == {"clang": "clang version 17", "kernel": "6.1"}
+    assert launcher.get_ami("awsrun-worker")[0]["ImageId"] == image_id
+    assert [i.state['Name'] for i in launcher.all_instances()] == ["terminated"]
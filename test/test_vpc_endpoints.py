@@ -0,0 +1,90 @@
+"""VPCManager.create_endpoints against a stubbed EC2 client; run with python test/test_vpc_endpoints.py."""
+import logging
+import sys
+import unittest
+from os import path
+
+import boto3
+from botocore.stub import Stubber
+
+sys.path.append(path.join(path.dirname(path.dirname(path.abspath(__file__))), "awsrun"))
+
+from aws.aws_ec2 import VPCManager
+
+REGION = "us-west-1"
+S3 = "com.amazonaws.{0}.s3".format(REGION)
+SQS = "com.amazonaws.{0}.sqs".format(REGION)
+
+
+class CreateEndpointsTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = VPCManager.__new__(VPCManager)
+        self.manager._region = REGION
+        self.manager._ec2cli = boto3.client("ec2", region_name=REGION, aws_access_key_id="testing",
+                                            aws_secret_access_key="testing")
+        self.manager.logger = logging.getLogger(VPCManager.__class__.__name__)
+        self.stub = Stubber(self.manager._ec2cli)
+
+    def tearDown(self):
+        self.stub.assert_no_pending_responses()
+
+    def _expect_listing(self, endpoints, rtb_ids):
+        self.stub.add_response("describe_vpc_endpoints", {"VpcEndpoints": endpoints},
+                               {"Filters": [{"Name": "vpc-id", "Values": ["vpc-1"]}]})
+        self.stub.add_response("describe_route_tables",
+                               {"RouteTables": [{"RouteTableId": rtb_id} for rtb_id in rtb_ids]},
+                               {"Filters": [{"Name": "vpc-id", "Values": ["vpc-1"]}]})
+
+    def _expect_gateway(self):
+        self.stub.add_response("create_vpc_endpoint", {"VpcEndpoint": {"VpcEndpointId": "vpce-s3"}},
+                               {"VpcEndpointType": "Gateway", "VpcId": "vpc-1", "ServiceName": S3,
+                                "RouteTableIds": ["rtb-1"]})
+
+    def _expect_subnets(self, subnets):
+        self.stub.add_response("describe_subnets",
+                               {"Subnets": [{"SubnetId": subnet_id, "AvailabilityZone": zone}
+                                            for subnet_id, zone in subnets]},
+                               {"Filters": [{"Name": "vpc-id", "Values": ["vpc-1"]}]})
+
+    def test_fresh_vpc(self):
+        self._expect_listing([], ["rtb-1"])
+        self._expect_gateway()
+        self._expect_subnets([("s-b", REGION + "b"), ("s-a", REGION + "a"), ("s-c", REGION + "a")])
+        for attribute in ("EnableDnsSupport", "EnableDnsHostnames"):
+            self.stub.add_response("modify_vpc_attribute", {}, {"VpcId": "vpc-1", attribute: {"Value": True}})
+        self.stub.add_response("describe_security_groups", {"SecurityGroups": []},
+                               {"Filters": [{"Name": "group-name", "Values": [VPCManager.ENDPOINT_SG]},
+                                            {"Name": "vpc-id", "Values": ["vpc-1"]}]})
+        self.stub.add_response("describe_vpcs", {"Vpcs": [{"CidrBlock": "10.0.0.0/16"}]}, {"VpcIds": ["vpc-1"]})
+        self.stub.add_response("create_security_group", {"GroupId": "sg-1"},
+                               {"GroupName": VPCManager.ENDPOINT_SG, "VpcId": "vpc-1",
+                                "Description": "awsrun VPC endpoints"})
+        self.stub.add_response("create_tags", {}, {"Resources": ["sg-1"],
+                                                   "Tags": [{"Key": "Name", "Value": VPCManager.ENDPOINT_SG}]})
+        self.stub.add_response("authorize_security_group_ingress", {}, None)
+        self.stub.add_response("create_vpc_endpoint", {"VpcEndpoint": {"VpcEndpointId": "vpce-sqs"}},
+                               {"VpcEndpointType": "Interface", "VpcId": "vpc-1", "ServiceName": SQS,
+                                "SubnetIds": ["s-a", "s-b"], "SecurityGroupIds": ["sg-1"],
+                                "PrivateDnsEnabled": True})
+        with self.stub:
+            self.assertEqual({"s3": "vpce-s3", "sqs": "vpce-sqs"}, self.manager.create_endpoints("vpc-1"))
+
+    def test_rerun_attaches_new_route_tables(self):
+        self._expect_listing([{"ServiceName": S3, "VpcEndpointId": "vpce-s3", "State": "available",
+                               "RouteTableIds": ["rtb-1"]},
+                              {"ServiceName": SQS, "VpcEndpointId": "vpce-sqs", "State": "available"}],
+                             ["rtb-1", "rtb-2"])
+        self.stub.add_response("modify_vpc_endpoint", {}, {"VpcEndpointId": "vpce-s3", "AddRouteTableIds": ["rtb-2"]})
+        with self.stub:
+            self.assertEqual({"s3": "vpce-s3", "sqs": "vpce-sqs"}, self.manager.create_endpoints("vpc-1"))
+
+    def test_no_subnets_skips_interfaces(self):
+        self._expect_listing([], ["rtb-1"])
+        self._expect_gateway()
+        self._expect_subnets([])
+        with self.stub:
+            self.assertEqual({"s3": "vpce-s3"}, self.manager.create_endpoints("vpc-1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""AWSWorker.serve against the S3/SQS stand-ins of worker.local; run with python -m pytest test/test_worker.py."""
+import sys
+import tarfile
+from os import path
+
+sys.path.append(path.join(path.dirname(path.dirname(path.abspath(__file__))), "awsrun"))
+
+from common.configuration import CmdConfig, WSConfig
+from common.protocol import IOTask
+from common.resources import Folder
+from worker.cache import InputCache
+from worker.local import LocalBucket, LocalQueue
+from worker.tasks import AWSWorker
+
+BUCKET = "awsrun-test"
+
+
+class Harness:
+    def __init__(self, tmp_path, visibility_timeout=30):
+        self.tmp_path = tmp_path
+        self.bucket = LocalBucket(Folder(str(tmp_path / "s3")))
+        self.queue = LocalQueue(visibility_timeout)
+        Folder(str(tmp_path / "s3" / BUCKET)).create()
+
+    def submit(self, shell, timeout=30, content=b"hello\n"):
+        """Uploads an _in.tar holding data.txt and sends the task; returns it."""
+        task = IOTask.new(CmdConfig.new(shell, timeout, 1, None, []), WSConfig.new("tasks"), str(self.tmp_path),
+                          None)
+        source = self.tmp_path / "input.txt"
+        source.write_bytes(content)
+        tar = self.tmp_path / task.workspace.local_input
+        with tarfile.open(str(tar), "w") as tarball:
+            tarball.add(str(source), arcname="data.txt")
+        self.bucket.upload_file(str(tar), BUCKET, task.workspace.input.key)
+        self.queue.send_message(self.queue, task.flatten())
+        return task
+
+    def submit_raw(self, data: bytes):
+        task = IOTask.new(CmdConfig.new(["true"], 30, 1, None, []), WSConfig.new("tasks"), str(self.tmp_path), None)
+        raw = self.tmp_path / task.workspace.local_input
+        raw.write_bytes(data)
+        self.bucket.upload_file(str(raw), BUCKET, task.workspace.input.key)
+        self.queue.send_message(self.queue, task.flatten())
+        return task
+
+    def worker(self, **kwargs):
+        return AWSWorker(self.bucket, self.queue, self.queue, BUCKET, Folder(str(self.tmp_path / "worker")),
+                         wait_time=1, **kwargs)
+
+    def output(self, task: IOTask, member):
+        """Content of a member of the task's _out.tar as published to the bucket."""
+        target = self.tmp_path / "out" / task.workspace.local_output
+        self.bucket.download_file(BUCKET, task.workspace.output.key, str(target))
+        with tarfile.open(str(target)) as tarball:
+            return tarball.extractfile(member).read().decode()
+
+
+def test_serve_publishes_outputs_and_deletes_messages(tmp_path):
+    harness = Harness(tmp_path)
+    ok = harness.submit(["cat", "data.txt"])
+    failing = harness.submit(["sh", "-c", "echo oops >&2; exit 3"])
+
+    stats = harness.worker().serve(max_tasks=2)
+
+    assert (stats.received, stats.completed, stats.failed, stats.timed_out) == (2, 2, 0, 0)
+    assert harness.output(ok, "stdout") == "hello\n"
+    assert harness.output(ok, "exitcode").strip() == "0"
+    assert harness.output(failing, "stderr").strip() == "oops"
+    assert harness.output(failing, "exitcode").strip() == "3"
+    # finished messages are deleted, not left to reappear
+    assert LocalQueue.get_queue_depth(harness.queue) == (0, 0)
+    assert harness.queue.received == 2
+
+
+def test_timed_out_task_keeps_its_message_until_done(tmp_path):
+    harness = Harness(tmp_path, visibility_timeout=3)
+    task = harness.submit(["sleep", "30"], timeout=5)
+
+    stats = harness.worker().serve(max_tasks=1)
+
+    assert (stats.completed, stats.timed_out) == (1, 1)
+    # the run outlasted the visibility timeout, so the worker had to extend it
+    assert stats.extended >= 1
+    assert harness.queue.received == 1
+    assert "timed out after 5 seconds" in harness.output(task, "stderr")
+    assert harness.output(task, "exitcode").strip() != "0"
+    assert LocalQueue.get_queue_depth(harness.queue) == (0, 0)
+
+
+def test_corrupt_input_fails_the_task_not_the_worker(tmp_path):
+    harness = Harness(tmp_path, visibility_timeout=60)
+    harness.submit_raw(b"not a tarball")
+    ok = harness.submit(["cat", "data.txt"])
+
+    stats = harness.worker(cache=InputCache(Folder(str(tmp_path / "cache")))).serve(max_tasks=2)
+
+    assert (stats.received, stats.completed, stats.failed) == (2, 1, 1)
+    assert harness.output(ok, "stdout") == "hello\n"
+    # the broken task's message is not deleted: it comes back and is eventually dead-lettered
+    assert LocalQueue.get_queue_depth(harness.queue) == (0, 1)
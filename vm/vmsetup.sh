@@ -98,6 +98,7 @@ function install_osdev {
         zlib1g-dev \
         libz3-dev \
         ninja-build \
+        ccache \
         git \
         unzip \
         cmake \